@@ -0,0 +1,333 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+  name: openafs_timings
+  type: aggregate
+  short_description: Report the time taken by the OpenAFS modules.
+  description:
+    - Collect the duration of the C(openafs_contrib.openafs) module tasks
+      by host and by role, and write a performance report in json and text
+      formats at the end of the playbook.
+
+    - The report shows the slowest tasks, the total time spent waiting in
+      M(openafs_wait_for_quorum) and M(openafs_wait_for_registration), and
+      the number of retries by task.
+
+    - The external command timings returned by the modules are merged into
+      the report by command name. Set the I(timings) module option, or set
+      the C(ANSIBLE_OPENAFS_TIMINGS) environment variable for the tasks, to
+      have the modules return the command timings.
+
+  requirements:
+    - Enable in the configuration, for example with
+      C(ANSIBLE_CALLBACKS_ENABLED=openafs_contrib.openafs.openafs_timings)
+
+  options:
+    report_dir:
+      description:
+        - The directory of the report files. The report files are named
+          C(openafs-timings-<timestamp>.json) and
+          C(openafs-timings-<timestamp>.txt).
+      type: path
+      default: ~/.ansible/openafs_timings
+      env:
+        - name: ANSIBLE_OPENAFS_TIMINGS_DIR
+      ini:
+        - section: callback_openafs_timings
+          key: report_dir
+
+    slowest:
+      description:
+        - The number of the slowest tasks to show in the report.
+      type: int
+      default: 20
+      env:
+        - name: ANSIBLE_OPENAFS_TIMINGS_SLOWEST
+      ini:
+        - section: callback_openafs_timings
+          key: slowest
+
+  author: Michael Meffie
+"""
+
+import json           # noqa: E402
+import os             # noqa: E402
+import time           # noqa: E402
+
+from ansible.plugins.callback import CallbackBase  # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import percentile  # noqa: E402, E501
+
+COLLECTION = 'openafs_contrib.openafs.'
+WAIT_MODULES = ('openafs_wait_for_quorum', 'openafs_wait_for_registration')
+
+
+def module_name(task):
+    """
+    Return the short name of an openafs module task, or None if the task
+    does not run an openafs module.
+    """
+    action = getattr(task, 'resolved_action', None) or task.action or ''
+    if action.startswith(COLLECTION):
+        return action[len(COLLECTION):]
+    if '.' not in action and action.startswith('openafs_'):
+        return action
+    return None
+
+
+def role_name(task):
+    """
+    Return the name of the role of a task, without the collection name.
+    """
+    role = getattr(task, '_role', None)
+    if not role:
+        return '(none)'
+    name = role.get_name()
+    return name.split('.')[-1]
+
+
+def count_retries(result):
+    """
+    Return the number of retries reported by a module result.
+    """
+    retries = 0
+    if isinstance(result.get('retries'), int):
+        retries += result['retries']
+    attempts = result.get('attempts')
+    if isinstance(attempts, int) and attempts > 1:
+        retries += attempts - 1
+    timings = result.get('timings')
+    if isinstance(timings, dict):
+        for c in timings.get('commands', {}).values():
+            retries += c.get('retries', 0)
+    return retries
+
+
+class Report(object):
+    """
+    OpenAFS module task timings.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.tasks = []
+        self.calls = []
+
+    def add(self, host, role, task, module, status, elapsed, result):
+        """
+        Add a completed task, and the command timings in the result.
+        """
+        results = [result]
+        if isinstance(result.get('results'), list):
+            results = [r for r in result['results'] if isinstance(r, dict)]
+        retries = 0
+        for r in results:
+            retries += count_retries(r)
+            timings = r.get('timings')
+            if isinstance(timings, dict):
+                for call in timings.get('calls', []):
+                    call = dict(call, host=host)
+                    self.calls.append(call)
+        self.tasks.append({
+            'host': host,
+            'role': role,
+            'task': task,
+            'module': module,
+            'status': status,
+            'elapsed': round(elapsed, 3),
+            'retries': retries,
+        })
+
+    def summary(self, slowest=20):
+        """
+        Summarize the task timings.
+        """
+        hosts = {}
+        roles = {}
+        modules = {}
+        waits = {}
+        for t in self.tasks:
+            h = hosts.setdefault(t['host'], {'tasks': 0, 'total': 0.0,
+                                             'roles': {}})
+            h['tasks'] += 1
+            h['total'] += t['elapsed']
+            h['roles'][t['role']] = h['roles'].get(t['role'], 0.0) + \
+                t['elapsed']
+            for key, table in ((t['role'], roles), (t['module'], modules)):
+                s = table.setdefault(key, {'tasks': 0, 'total': 0.0})
+                s['tasks'] += 1
+                s['total'] += t['elapsed']
+            if t['module'] in WAIT_MODULES:
+                w = waits.setdefault(t['module'], {'total': 0.0, 'hosts': {}})
+                w['total'] += t['elapsed']
+                w['hosts'][t['host']] = w['hosts'].get(t['host'], 0.0) + \
+                    t['elapsed']
+
+        commands = {}
+        for call in self.calls:
+            c = commands.setdefault(call.get('name', ''), {
+                'count': 0,
+                'total': 0.0,
+                'retries': 0,
+                'failures': 0,
+                'elapsed': [],
+            })
+            c['count'] += 1
+            c['total'] += call.get('elapsed', 0.0)
+            c['elapsed'].append(call.get('elapsed', 0.0))
+            if call.get('retry'):
+                c['retries'] += 1
+            if call.get('rc') != 0:
+                c['failures'] += 1
+        for c in commands.values():
+            elapsed = c.pop('elapsed')
+            c['p50'] = percentile(elapsed, 50)
+            c['p95'] = percentile(elapsed, 95)
+
+        retried = [t for t in self.tasks if t['retries']]
+        finished = self.finished or time.time()
+        return {
+            'started': self.started,
+            'finished': finished,
+            'elapsed': round(finished - self.started, 3),
+            'total': round(sum(t['elapsed'] for t in self.tasks), 3),
+            'hosts': hosts,
+            'roles': roles,
+            'modules': modules,
+            'waits': waits,
+            'commands': commands,
+            'retries': {
+                'total': sum(t['retries'] for t in retried),
+                'tasks': sorted(retried, key=lambda t: -t['retries']),
+            },
+            'slowest': sorted(self.tasks,
+                              key=lambda t: -t['elapsed'])[:slowest],
+        }
+
+
+def format_text(summary):
+    """
+    Format the report summary as text.
+    """
+    lines = []
+
+    def section(title):
+        lines.append('')
+        lines.append(title)
+        lines.append('=' * len(title))
+
+    def row(name, seconds, extra=''):
+        lines.append('%-60s %10.2fs%s' % (name, seconds, extra))
+
+    lines.append('OpenAFS module timings')
+    lines.append('Playbook time: %.2fs, OpenAFS tasks time: %.2fs' %
+                 (summary['elapsed'], summary['total']))
+
+    section('Slowest tasks')
+    for t in summary['slowest']:
+        extra = ' %d retries' % t['retries'] if t['retries'] else ''
+        row('%s | %s | %s' % (t['host'], t['role'], t['task']),
+            t['elapsed'], extra)
+
+    section('Hosts')
+    for host, h in sorted(summary['hosts'].items()):
+        row('%s (%d tasks)' % (host, h['tasks']), h['total'])
+        for role, total in sorted(h['roles'].items()):
+            row('  %s' % role, total)
+
+    section('Roles')
+    for role, r in sorted(summary['roles'].items(),
+                          key=lambda x: -x[1]['total']):
+        row('%s (%d tasks)' % (role, r['tasks']), r['total'])
+
+    section('Waiting')
+    for name in WAIT_MODULES:
+        w = summary['waits'].get(name, {'total': 0.0, 'hosts': {}})
+        row(name, w['total'])
+        for host, total in sorted(w['hosts'].items()):
+            row('  %s' % host, total)
+
+    section('Retries')
+    lines.append('Total retries: %d' % summary['retries']['total'])
+    for t in summary['retries']['tasks']:
+        lines.append('%-60s %10d' % ('%s | %s' % (t['host'], t['task']),
+                                     t['retries']))
+
+    if summary['commands']:
+        section('Commands')
+        lines.append('%-40s %6s %10s %8s %8s %7s' %
+                     ('command', 'count', 'total', 'p50', 'p95', 'retries'))
+        for name, c in sorted(summary['commands'].items(),
+                              key=lambda x: -x[1]['total']):
+            lines.append('%-40s %6d %9.2fs %7.2fs %7.2fs %7d' %
+                         (name, c['count'], c['total'], c['p50'], c['p95'],
+                          c['retries']))
+    return '\n'.join(lines) + '\n'
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'openafs_contrib.openafs.openafs_timings'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.report = Report()
+        self.task_started = {}
+        self.host_started = {}
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.task_started[task._uuid] = time.time()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.task_started[task._uuid] = time.time()
+
+    def v2_runner_on_start(self, host, task):
+        self.host_started[(host.get_name(), task._uuid)] = time.time()
+
+    def _task_done(self, result, status):
+        task = result._task
+        module = module_name(task)
+        if not module:
+            return
+        host = result._host.get_name()
+        now = time.time()
+        started = self.host_started.pop((host, task._uuid), None)
+        if started is None:
+            started = self.task_started.get(task._uuid, now)
+        self.report.add(host, role_name(task), task.get_name(), module,
+                        status, now - started, result._result)
+
+    def v2_runner_on_ok(self, result):
+        self._task_done(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._task_done(result, 'failed')
+
+    def v2_runner_on_unreachable(self, result):
+        self._task_done(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        self.report.finished = time.time()
+        if not self.report.tasks:
+            return
+        summary = self.report.summary(self.get_option('slowest'))
+        report_dir = os.path.expanduser(self.get_option('report_dir'))
+        stamp = time.strftime('%Y%m%d-%H%M%S',
+                              time.localtime(self.report.started))
+        base = os.path.join(report_dir, 'openafs-timings-%s' % stamp)
+        try:
+            if not os.path.isdir(report_dir):
+                os.makedirs(report_dir)
+            with open(base + '.json', 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+                f.write('\n')
+            with open(base + '.txt', 'w') as f:
+                f.write(format_text(summary))
+        except (IOError, OSError) as e:
+            self._display.warning('Unable to write openafs timings report: %s'
+                                  % e)
+            return
+        self._display.display('OpenAFS timings report: %s.txt' % base)
@@ -19,6 +19,25 @@ DOCUMENTATION = """
     - Specify the C(,reset) suffix on the counter name to reset the counter
       value to zero.
 
+    - Specify the C(,next:N) suffix on the counter name to reserve a
+      contiguous block of I(N) values in one update of the counter file.
+      The I(N) values are returned.
+
+    - Set the I(reserve) keyword to reserve blocks of values in advance.
+      The reserved values are handed out by subsequent lookups in the same
+      process without reading or writing the counter file. Reserved values
+      which are not handed out are skipped, so the values may have gaps.
+
+    - All of the terms of a lookup are processed in one update of the
+      counter file.
+
+    - Set the C(ANSIBLE_OPENAFS_COUNTER_BACKEND) environment variable to
+      C(sqlite) to save the counters in a SQLite database,
+      C(counter.db), instead of the json file. Each counter is a row in the
+      database, updated with a single statement, so lookups of different
+      counters do not wait for each other. The counters in the json file are
+      copied to the database when it is created.
+
     - File locking used for mutual exclusion in case more than one playbook is
       running at a time.
 
@@ -27,9 +46,15 @@ DOCUMENTATION = """
       description:
         - list of counter names, in the form I(<name>[,<operation>]), where
           I(<name>) is the counter name and I(<operation>) is one of
-          C(next), C(current), C(reset)
+          C(next), C(next:N), C(current), C(reset)
         - The default operation is C(next)
       required: True
+    reserve:
+      description:
+        - The number of values to reserve when the counter file is updated
+          by a C(next) operation.
+      type: int
+      default: 0
   author: Michael Meffie
 """
 
@@ -50,6 +75,16 @@ EXAMPLES = """
     - test_b
     - test_c
 
+- name: "Allocate a block of 5 values."
+  debug:
+    msg: "{{ query('openafs_contrib.openafs.counter', 'test_a,next:5') }}"
+
+- name: "Allocate values from blocks of 1000 reserved values."
+  debug:
+    msg: "{{ lookup('openafs_contrib.openafs.counter', 'test_a',
+                    reserve=1000) }}"
+  loop: "{{ range(0, 5000) | list }}"
+
 - name: "Reset counters using 'with_' syntax."
   assert:
     that: item == 0
@@ -71,6 +106,9 @@ import errno          # noqa: E402
 import fcntl          # noqa: E402
 import json           # noqa: E402
 import os             # noqa: E402
+import re             # noqa: E402
+import sqlite3        # noqa: E402
+import tempfile       # noqa: E402
 
 from ansible.plugins.lookup import LookupBase  # noqa: E402
 from ansible.errors import AnsibleError        # noqa: E402
@@ -84,38 +122,61 @@ def lock(filename):
         fcntl.flock(f, fcntl.LOCK_UN)
 
 
-class LookupModule(LookupBase):
+class Allocator(object):
+    """
+    In-process allocator of reserved counter values.
 
-    def run(self, terms, variables=None, **kwargs):
-        ret = []
-        try:
-            self.init_paths()
-            for term in terms:
-                if ',' in term:
-                    name, op = term.split(',', 1)
-                else:
-                    name, op = term, 'next'
-                with lock(self.lockfile):
-                    if op == 'next':
-                        value = self.get_next(name)
-                    elif op == 'current':
-                        value = self.get_current(name)
-                    elif op == 'reset':
-                        value = self.reset(name)
-                    else:
-                        raise ValueError('Invalid operation: %s' % (op))
-                    ret.append(value)
-        except Exception as e:
-            raise AnsibleError(e)
-        return ret
+    Holds the blocks of counter values reserved in the counter file and not
+    yet handed out, keyed by counter file and counter name.
+    """
 
-    def init_paths(self):
-        directory = os.path.expanduser(os.getenv(
-                      'ANISIBLE_OPENAFS_COUNTER_DIR', '~/.ansible'))
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+    def __init__(self):
+        self.blocks = {}
+
+    def take(self, key, count):
+        """
+        Take count values from a reserved block. Returns None if the block
+        does not have enough values left.
+        """
+        block = self.blocks.get(key)
+        if not block or block[1] - block[0] + 1 < count:
+            return None
+        first = block[0]
+        block[0] += count
+        return list(range(first, first + count))
+
+    def add(self, key, first, last):
+        if first <= last:
+            self.blocks[key] = [first, last]
+        else:
+            self.blocks.pop(key, None)
+
+    def discard(self, key):
+        self.blocks.pop(key, None)
+
+
+allocator = Allocator()
+
+
+class JsonCounters(object):
+    """
+    Counters saved in a json file, updated under an exclusive file lock.
+    """
+
+    def __init__(self, directory):
         self.lockfile = os.path.join(directory, 'counter.lock')
         self.filename = os.path.join(directory, 'counter.json')
+        self.counters = {}
+        self.dirty = False
+
+    @contextlib.contextmanager
+    def session(self):
+        with lock(self.lockfile):
+            self.load()
+            self.dirty = False
+            yield self
+            if self.dirty:
+                self.store()
 
     def load(self):
         try:
@@ -129,23 +190,201 @@ class LookupModule(LookupBase):
         return self.counters
 
     def store(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.counters, f, indent=4)
-        return 0
-
-    def reset(self, name):
-        self.load()
-        self.counters[name] = 0
-        self.store()
+        directory = os.path.dirname(self.filename)
+        fd, tmp = tempfile.mkstemp(prefix='.counter.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.counters, f, indent=4)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.filename)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.dirty = False
         return 0
 
-    def get_current(self, name):
-        self.load()
+    def get(self, name):
         return self.counters.get(name, 0)
 
-    def get_next(self, name):
-        self.load()
-        value = self.counters.get(name, 0) + 1
+    def set(self, name, value):
         self.counters[name] = value
-        self.store()
+        self.dirty = True
+
+    def add(self, name, count):
+        value = self.get(name) + count
+        self.set(name, value)
         return value
+
+
+class SqliteCounters(object):
+    """
+    Counters saved in a SQLite database in WAL mode, one row per counter.
+    """
+
+    def __init__(self, directory):
+        self.lockfile = os.path.join(directory, 'counter.lock')
+        self.jsonfile = os.path.join(directory, 'counter.json')
+        self.filename = os.path.join(directory, 'counter.db')
+        self.conn = None
+
+    @contextlib.contextmanager
+    def session(self):
+        conn = sqlite3.connect(self.filename, timeout=60,
+                               isolation_level=None)
+        try:
+            self.conn = conn
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.init_db()
+            yield self
+        finally:
+            self.conn = None
+            conn.close()
+
+    def init_db(self):
+        """
+        Create the tables and copy the counters from the json file once.
+        """
+        self.conn.execute('CREATE TABLE IF NOT EXISTS counters '
+                          '(name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                          '(key TEXT PRIMARY KEY, value TEXT)')
+        if self.get_meta('migrated'):
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not self.get_meta('migrated'):
+                self.migrate()
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?',
+                                (key,)).fetchone()
+        return row[0] if row else None
+
+    def migrate(self):
+        counters = {}
+        if os.path.exists(self.jsonfile):
+            with lock(self.lockfile):
+                with open(self.jsonfile, 'r') as f:
+                    counters = json.load(f)
+        for name, value in counters.items():
+            self.conn.execute('INSERT OR IGNORE INTO counters (name, value) '
+                              'VALUES (?, ?)', (name, int(value)))
+        self.conn.execute('INSERT INTO meta (key, value) VALUES (?, ?)',
+                          ('migrated', self.jsonfile))
+
+    def get(self, name):
+        row = self.conn.execute('SELECT value FROM counters WHERE name = ?',
+                                (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, name, value):
+        self.conn.execute('INSERT OR REPLACE INTO counters (name, value) '
+                          'VALUES (?, ?)', (name, value))
+
+    def add(self, name, count):
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            row = self.conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET value = value + ? '
+                'RETURNING value', (name, count, count)).fetchone()
+            return row[0]
+        # No RETURNING clause in older versions of SQLite.
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('INSERT OR IGNORE INTO counters (name, value) '
+                              'VALUES (?, 0)', (name,))
+            self.conn.execute('UPDATE counters SET value = value + ? '
+                              'WHERE name = ?', (count, name))
+            value = self.get(name)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return value
+
+
+BACKENDS = {
+    'json': JsonCounters,
+    'sqlite': SqliteCounters,
+}
+
+
+class LookupModule(LookupBase):
+
+    def run(self, terms, variables=None, **kwargs):
+        ret = []
+        try:
+            self.init_paths()
+            reserve = int(kwargs.get('reserve', 0))
+            ops = [self.parse(term) for term in terms]
+            self.counters = None
+            with contextlib.ExitStack() as stack:
+                for name, op, count in ops:
+                    key = (self.filename, name)
+                    if op == 'next':
+                        values = allocator.take(key, count)
+                        if values is None:
+                            if self.counters is None:
+                                self.counters = stack.enter_context(
+                                    self.backend.session())
+                            values = self.get_range(name, count, reserve)
+                        ret.extend(values)
+                        continue
+                    if self.counters is None:
+                        self.counters = stack.enter_context(
+                            self.backend.session())
+                    if op == 'current':
+                        ret.append(self.counters.get(name))
+                    elif op == 'reset':
+                        allocator.discard(key)
+                        self.counters.set(name, 0)
+                        ret.append(0)
+        except Exception as e:
+            raise AnsibleError(e)
+        return ret
+
+    def parse(self, term):
+        """
+        Parse a term into a (<name>, <operation>, <count>) tuple.
+        """
+        if ',' in term:
+            name, op = term.split(',', 1)
+        else:
+            name, op = term, 'next'
+        count = 1
+        m = re.match(r'next:(\d+)$', op)
+        if m:
+            op, count = 'next', int(m.group(1))
+            if count < 1:
+                raise ValueError('Invalid count: %s' % (term))
+        if op not in ('next', 'current', 'reset'):
+            raise ValueError('Invalid operation: %s' % (op))
+        return name, op, count
+
+    def init_paths(self):
+        directory = os.getenv('ANSIBLE_OPENAFS_COUNTER_DIR') or \
+            os.getenv('ANISIBLE_OPENAFS_COUNTER_DIR', '~/.ansible')
+        directory = os.path.expanduser(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        name = os.getenv('ANSIBLE_OPENAFS_COUNTER_BACKEND', 'json')
+        if name not in BACKENDS:
+            raise ValueError('Invalid counter backend: %s' % (name))
+        self.backend = BACKENDS[name](directory)
+        self.filename = self.backend.filename
+
+    def get_range(self, name, count, reserve=0):
+        """
+        Reserve a block of values and return the first count values. The
+        rest of the block is handed out by the in-process allocator.
+        """
+        size = max(count, reserve)
+        last = self.counters.add(name, size)
+        first = last - size + 1
+        allocator.add((self.filename, name), first + count, last)
+        return list(range(first, first + count))
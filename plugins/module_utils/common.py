@@ -3,37 +3,212 @@
 # BSD 2-Clause License
 
 
+import atexit                   # noqa: E402
 import contextlib               # noqa: E402
 import errno                    # noqa: E402
+import fcntl                    # noqa: E402
 import json                     # noqa: E402
 import os                       # noqa: E402
+import pprint                   # noqa: E402
 import shutil                   # noqa: E402
 import syslog                   # noqa: E402
 import tempfile                 # noqa: E402
+import threading                # noqa: E402
+import time                     # noqa: E402
+
+FACTS_DIR = '/etc/ansible/facts.d'
+
+
+LOG_LEVEL_ENV = 'ANSIBLE_OPENAFS_LOG_LEVEL'
+LOG_FILE_ENV = 'ANSIBLE_OPENAFS_LOG_FILE'
+LOG_SYSLOG_ENV = 'ANSIBLE_OPENAFS_LOG_SYSLOG'
+LOG_LEVEL = 'debug'
+LOG_BUFFER_LINES = 100
+
+LOG_LEVELS = {
+    'debug': syslog.LOG_DEBUG,
+    'info': syslog.LOG_INFO,
+    'warning': syslog.LOG_WARNING,
+    'error': syslog.LOG_ERR,
+    'none': -1,
+}
+
+LOG_LEVEL_NAMES = {
+    syslog.LOG_DEBUG: 'DEBUG',
+    syslog.LOG_INFO: 'INFO',
+    syslog.LOG_WARNING: 'WARNING',
+    syslog.LOG_ERR: 'ERROR',
+}
+
+_loggers = {}
+_log_files = {}
+_log_lock = threading.RLock()
+_syslog_ident = [None]
+
+
+def log_level(name, spec=None):
+    """
+    Return the log level for a logger name.
+
+    The level specification is a comma separated list of a default level
+    name and optional <logger>=<level> pairs, for example
+    'warning,openafs_volume=debug'. The specification is read from the
+    ANSIBLE_OPENAFS_LOG_LEVEL environment variable when not given.
+    """
+    if spec is None:
+        spec = os.environ.get(LOG_LEVEL_ENV, '')
+    level = LOG_LEVEL
+    for item in spec.split(','):
+        item = item.strip().lower()
+        if '=' in item:
+            logger, value = item.split('=', 1)
+            if logger.strip() == name.lower() and value.strip() in LOG_LEVELS:
+                return LOG_LEVELS[value.strip()]
+        elif item in LOG_LEVELS:
+            level = item
+    return LOG_LEVELS[level]
+
+
+class Lazy(object):
+    """
+    Deferred log message argument. The function is only called when the
+    message is formatted.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+    __repr__ = __str__
+
+
+def pretty(obj):
+    """
+    Deferred pprint.pformat() of a log message argument.
+    """
+    return Lazy(pprint.pformat, obj)
+
+
+class LogFile(object):
+    """
+    Buffered log file. Lines are appended to the file when the buffer is
+    full, when flushed, and at exit.
+    """
+
+    def __init__(self, path, size=LOG_BUFFER_LINES):
+        self.path = path
+        self.size = size
+        self.lines = []
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def write(self, line):
+        with self.lock:
+            self.lines.append(line)
+            full = len(self.lines) >= self.size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            if lines:
+                try:
+                    with open(self.path, 'a') as f:
+                        f.write(''.join(lines))
+                except (IOError, OSError):
+                    pass
+
+
+def log_file(path):
+    """
+    Return the shared buffered log file for a path.
+    """
+    with _log_lock:
+        if path not in _log_files:
+            _log_files[path] = LogFile(path)
+        return _log_files[path]
 
 
 class Logger:
+    """
+    Syslog logger.
+
+    Messages below the log level are discarded before the message is
+    formatted. The level defaults to 'debug', and is set with the level
+    keyword or the ANSIBLE_OPENAFS_LOG_LEVEL environment variable. Messages
+    are also written to a buffered log file when the logfile keyword or the
+    ANSIBLE_OPENAFS_LOG_FILE environment variable is set. Set the
+    ANSIBLE_OPENAFS_LOG_SYSLOG environment variable to 'no' to disable
+    syslog messages.
+    """
+
     def __init__(self, name, **kwargs):
         self.name = name
-        syslog.openlog(name, 0, syslog.LOG_USER)
+        level = kwargs.get('level')
+        if level is None:
+            self.level = log_level(name)
+        else:
+            self.level = LOG_LEVELS[level]
+        self.use_syslog = kwargs.get('use_syslog')
+        if self.use_syslog is None:
+            value = os.environ.get(LOG_SYSLOG_ENV, 'yes').lower()
+            self.use_syslog = value not in ('0', 'n', 'no', 'false', 'off')
+        logfile = kwargs.get('logfile', os.environ.get(LOG_FILE_ENV))
+        self.logfile = log_file(logfile) if logfile else None
+
+    def is_enabled(self, priority):
+        return priority <= self.level
+
+    def log(self, priority, fmt, *args):
+        if priority > self.level:
+            return
+        msg = fmt % args if args else fmt
+        if self.use_syslog:
+            if _syslog_ident[0] != self.name:
+                syslog.openlog(self.name, 0, syslog.LOG_USER)
+                _syslog_ident[0] = self.name
+            syslog.syslog(priority, msg)
+        if self.logfile:
+            self.logfile.write('%s %s[%d]: %s: %s\n' % (
+                time.strftime('%Y-%m-%d %H:%M:%S'), self.name, os.getpid(),
+                LOG_LEVEL_NAMES.get(priority, priority), msg))
 
     def debug(self, fmt, *args):
-        syslog.syslog(syslog.LOG_DEBUG, fmt % (args))
+        self.log(syslog.LOG_DEBUG, fmt, *args)
 
     def info(self, fmt, *args):
-        syslog.syslog(syslog.LOG_INFO, fmt % (args))
+        self.log(syslog.LOG_INFO, fmt, *args)
 
     def warning(self, fmt, *args):
-        syslog.syslog(syslog.LOG_WARNING, fmt % (args))
+        self.log(syslog.LOG_WARNING, fmt, *args)
 
     def error(self, fmt, *args):
-        syslog.syslog(syslog.LOG_ERR, fmt % (args))
+        self.log(syslog.LOG_ERR, fmt, *args)
+
+    def flush(self):
+        if self.logfile:
+            self.logfile.flush()
 
     # aliases
     warn = warning
     err = error
 
 
+def get_logger(name, **kwargs):
+    """
+    Return the logger for a name, creating it when needed.
+    """
+    with _log_lock:
+        if name not in _loggers:
+            _loggers[name] = Logger(name, **kwargs)
+        return _loggers[name]
+
+
 @contextlib.contextmanager
 def chdir(path):
     """
@@ -62,19 +237,103 @@ def tmpdir():
         shutil.rmtree(tmp)
 
 
+class FactsStore(object):
+    """
+    Local facts file store.
+
+    The facts file is read by Ansible when facts are gathered, and is
+    updated by several modules. Updates are serialized with an exclusive
+    lock on a separate lock file, and the new facts are written to a
+    temporary file which is renamed to the facts file, so readers never see
+    a partially written file. The facts are only written when the canonical
+    serialized facts changed.
+    """
+
+    def __init__(self, factsdir=FACTS_DIR, name='openafs'):
+        self.factsdir = factsdir
+        self.path = os.path.join(factsdir, '%s.fact' % name)
+        self.lockpath = os.path.join(factsdir, '.%s.fact.lock' % name)
+        self.changed = False
+
+    def load(self):
+        """
+        Return the facts as a dict, or an empty dict if the facts file does
+        not exist.
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Exclusive facts file lock context manager.
+        """
+        if not os.path.isdir(self.factsdir):
+            os.makedirs(self.factsdir)
+        fd = os.open(self.lockpath, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def update(self):
+        """
+        Facts update context manager.
+
+        Yields the current facts, which may be modified in place. The facts
+        are written on exit, if changed. An invalid facts file is replaced.
+        """
+        with self.lock():
+            try:
+                facts = self.load()
+            except ValueError:
+                facts = {}
+            before = canonical_facts(facts)
+            yield facts
+            after = canonical_facts(facts)
+            if after != before:
+                self.write(after)
+                self.changed = True
+
+    def write(self, data):
+        """
+        Atomically replace the facts file.
+        """
+        fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(self.path),
+                                   dir=self.factsdir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def canonical_facts(facts):
+    """
+    Return the canonical serialized facts.
+    """
+    text = json.dumps(facts, indent=2, sort_keys=True) + '\n'
+    return text.encode('utf-8')
+
+
 def lookup_facts():
     """
     Return the local facts as a dict.
     """
-    try:
-        with open('/etc/ansible/facts.d/openafs.fact') as f:
-            facts = json.load(f)
-    except IOError as e:
-        if e.errno == errno.ENOENT:
-            facts = {}
-        else:
-            raise
-    return facts
+    return FactsStore().load()
 
 
 def lookup_fact(name, section=None, default=None):
@@ -67,6 +67,7 @@ class Keytab:
 
     def __init__(self, filename):
         self.entries = []
+        self._keys = {}
         self.name = filename
         self.read(filename)
 
@@ -108,7 +109,7 @@ class Keytab:
         if version != KEYTAB_MAGIC_OLD:
             self._read_data(f, "!L")  # read past name_type
         timestamp, vno8, eno = self._read_data(f, "!LBH")
-        self._read_bytes(f)  # read past key
+        key = self._read_bytes(f)
         principal = "%s@%s" % ('/'.join(components), realm)
         entry = {
             'realm': realm,
@@ -119,7 +120,7 @@ class Keytab:
             'eno': eno,
             'enctype': ENCTYPES.get(eno, 'unknown'),
         }
-        return entry
+        return entry, key
 
     def read(self, path):
         """
@@ -140,10 +141,21 @@ class Keytab:
                 f.seek(offset)
                 # record size, not including this field
                 size, = self._read_data(f, "!l")
-                entry = self._read_entry(f, version)
-                self.entries.append(entry)
+                if size < 0:
+                    # A deleted entry (hole) in the keytab.
+                    offset += struct.calcsize("!l") - size
+                    continue
+                entry, key = self._read_entry(f, version)
                 # Calculate next record location.
                 record_size = struct.calcsize("!l") + size
+                # The 32-bit kvno follows the key, if present.
+                if offset + record_size - f.tell() >= 4:
+                    vno, = self._read_data(f, "!L")
+                    if vno != 0:
+                        entry['kvno'] = vno
+                self.entries.append(entry)
+                self._keys[(entry['principal'], entry['kvno'],
+                            entry['eno'])] = key
                 offset += record_size
         return
 
@@ -157,6 +169,13 @@ class Keytab:
                 entries.append(e)
         return entries
 
+    def get_key(self, principal, kvno, eno):
+        """
+        Return the key contents of an entry. The key contents are not kept
+        in the entries, so the entries may be safely logged and returned.
+        """
+        return self._keys[(principal, kvno, eno)]
+
     def get_entries(self, principal, kvno=None):
         """
         Return the list of entries for the given principal and kvno.  If knvo
@@ -0,0 +1,139 @@
+# Copyright (c) 2026, Sine Nomine Associates
+# BSD 2-Clause License
+
+import os
+import struct
+import tempfile
+
+RXKAD = 0
+RXGK = 1
+RXKAD_KRB5 = 2
+
+KEY_TYPES = {
+    RXKAD: 'rxkad',
+    RXGK: 'rxgk',
+    RXKAD_KRB5: 'rxkad_krb5',
+}
+
+
+class KeyFileError(Exception):
+    pass
+
+
+class KeyFileExt:
+    """
+    Read and write the OpenAFS extended key file (KeyFileExt).
+    """
+    #
+    # The following C-like structure definitions illustrate the KeyFileExt
+    # file format. All values are in network byte order.
+    #
+    #   keyfile {
+    #       int32_t num_keys;
+    #       key_record keys[num_keys];
+    #   };
+    #   key_record {
+    #       int32_t size;       /* length of the fields below */
+    #       int32_t type;       /* 0: rxkad, 1: rxgk, 2: rxkad_krb5 */
+    #       int32_t kvno;
+    #       int32_t subtype;    /* enctype, for rxkad_krb5 and rxgk keys */
+    #       int32_t length;
+    #       uint8_t key[length];
+    #   };
+    #
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.changed = False
+        if os.path.exists(path):
+            self.read()
+
+    def _read_data(self, f, fmt):
+        size = struct.calcsize(fmt)
+        data = f.read(size)
+        if len(data) != size:
+            raise KeyFileError('Failed to read key file %s.' % self.path)
+        return struct.unpack(fmt, data)
+
+    def read(self):
+        """
+        Read the key file.
+        """
+        self.keys = {}
+        with open(self.path, 'rb') as f:
+            nkeys, = self._read_data(f, '!l')
+            if nkeys < 0:
+                raise KeyFileError('Invalid key file %s.' % self.path)
+            for _ in range(nkeys):
+                size, = self._read_data(f, '!l')
+                if size < 16:
+                    raise KeyFileError('Invalid key record in %s.' % self.path)
+                ktype, kvno, subtype, length = self._read_data(f, '!llll')
+                if length < 0 or length > size - 16:
+                    raise KeyFileError('Invalid key length in %s.' % self.path)
+                key, = self._read_data(f, '%ds' % length)
+                f.read(size - 16 - length)  # Skip any unknown fields.
+                self.keys[(ktype, kvno, subtype)] = key
+            if f.read(1):
+                raise KeyFileError('Trailing data in %s.' % self.path)
+
+    def list(self):
+        """
+        List the keys, without the key contents.
+        """
+        keys = []
+        for ktype, kvno, subtype in sorted(self.keys):
+            keys.append({
+                'type': KEY_TYPES.get(ktype, str(ktype)),
+                'kvno': str(kvno),
+                'eno': str(subtype),
+            })
+        return keys
+
+    def missing(self, ktype, entries):
+        """
+        Return the (kvno, subtype, key) tuples which are not present in the
+        key file with the same contents.
+        """
+        return [(kvno, subtype, key) for kvno, subtype, key in entries
+                if self.keys.get((ktype, kvno, subtype)) != key]
+
+    def add(self, ktype, kvno, subtype, key):
+        """
+        Add or replace a key.
+        """
+        if self.keys.get((ktype, kvno, subtype)) != key:
+            self.keys[(ktype, kvno, subtype)] = key
+            self.changed = True
+
+    def write(self):
+        """
+        Atomically replace the key file. The mode and ownership of an
+        existing key file are retained.
+        """
+        data = [struct.pack('!l', len(self.keys))]
+        for (ktype, kvno, subtype) in sorted(self.keys):
+            key = self.keys[(ktype, kvno, subtype)]
+            data.append(struct.pack('!lllll', 16 + len(key), ktype, kvno,
+                                    subtype, len(key)))
+            data.append(key)
+        dirname, basename = os.path.split(self.path)
+        fd, tmp = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(data))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                st = os.stat(self.path)
+                os.chmod(tmp, st.st_mode & 0o7777)
+                os.chown(tmp, st.st_uid, st.st_gid)
+            except OSError:
+                os.chmod(tmp, 0o600)
+            os.rename(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.changed = False
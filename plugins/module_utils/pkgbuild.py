@@ -0,0 +1,637 @@
+# Copyright (c) 2021-2026, Sine Nomine Associates
+# BSD 2-Clause License
+
+"""
+OpenAFS package building engine.
+
+Platform specific package builders shared by the openafs_build_packages and
+openafs_build_redhat_rpms modules.
+"""
+
+import glob             # noqa: E402
+import hashlib          # noqa: E402
+import json             # noqa: E402
+import os               # noqa: E402
+import platform         # noqa: E402
+import re               # noqa: E402
+import shutil           # noqa: E402
+import subprocess       # noqa: E402
+import tarfile          # noqa: E402
+
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from multiprocessing import cpu_count  # noqa: E402
+
+from ansible.module_utils.basic import get_distribution  # noqa: E402
+from ansible.module_utils.common.sys_info import get_platform_subclass  # noqa: E402, E501
+
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import get_logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import tmpdir  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.treesync import copy_file, file_digest, is_same  # noqa: E402, E501
+
+log = get_logger('openafs_build_packages')
+
+STORE = '.packages.json'
+
+# Source archive members needed to prepare the rpm workspace.
+WORKSPACE_MEMBERS = re.compile(
+    r'[^/]+/(\.version|src/packaging/RedHat/[^/]+|src/afsd/CellServDB)$')
+
+
+def expand_path(path):
+    if path:
+        path = os.path.abspath(os.path.expanduser(path))
+    return path
+
+
+class PackageBuilder(object):
+    """
+    Base class for package builders.  Platform specific subclasses must provide
+    implementation.
+
+    This class is created on platforms we do not support packaging building
+    yet, and so the module will fail on those platforms.
+    """
+    def __new__(cls, *args, **kwargs):
+        new_cls = get_platform_subclass(PackageBuilder)
+        return super(cls, new_cls).__new__(new_cls)
+
+    def __init__(self, module, name='openafs_build_packages'):
+        self.name = name
+        self.module = module
+        self.timer = CommandTimer(module).attach()
+        self.results = dict(
+            changed=False,
+            platform=platform.system(),
+            distribution=get_distribution(),
+            builder=self.__class__.__name__,
+            logfiles=[],
+        )
+
+    def create_workspace(self):
+        self.module.fail_json(
+            msg='Unsupported platform.',
+            module=self.name,
+            platform=platform.system(),
+            distribution=get_distribution(),
+        )
+
+    def build(self):
+        self.module.fail_json(
+            msg='Unsupported platform.',
+            module=self.name,
+            platform=platform.system(),
+            distribution=get_distribution(),
+        )
+
+    def copy(self, src, dst):
+        """
+        Copy a file.
+
+        The destination is left as is when it is already up to date, and
+        is hard linked to the source, when possible, instead of copied.
+        """
+        if not os.path.exists(src):
+            self.module.fail_json(msg='Source file not found.', src=src)
+        if src == dst:
+            self.module.fail_json(
+                msg='Source name is same as destination.', src=src)
+        if is_same(src, dst):
+            log.debug('Skipping "%s"; unchanged.', dst)
+            return
+        log.info('Copying "%s" to "%s".' % (src, dst))
+        copy_file(src, dst, link=True)
+
+    def write(self, filename, content):
+        """
+        Write a text file, unless it already has the given content.
+        """
+        try:
+            with open(filename, 'r') as f:
+                if f.read() == content:
+                    log.debug('Skipping "%s"; unchanged.', filename)
+                    return
+        except IOError:
+            pass
+        log.info('Writing "%s".', filename)
+        with open(filename + '.tmp', 'w') as f:
+            f.write(content)
+        os.rename(filename + '.tmp', filename)
+
+    def extract(self, archive):
+        """
+        Extract the workspace files from a source archive in the current
+        directory.
+
+        The compressed archive is read as a stream and only the members
+        needed to prepare the workspace are written.
+        """
+        log.info('Reading archive "%s".' % archive)
+        if archive.endswith('.gz'):
+            mode = 'r|gz'
+        elif archive.endswith('.bz2'):
+            mode = 'r|bz2'
+        else:
+            raise ValueError('Unsupported compression type: %s' % archive)
+        kwargs = {}
+        if hasattr(tarfile, 'data_filter'):
+            kwargs['filter'] = 'data'
+        with tarfile.open(archive, mode) as tar:
+            for member in tar:
+                if member.isfile() and WORKSPACE_MEMBERS.match(member.name):
+                    log.debug('Extracting "%s".', member.name)
+                    tar.extract(member, **kwargs)
+
+    def unpack_source(self, sdist):
+        """
+        Unpack the source archive file and return the version info.
+        """
+        g = glob.glob('%s/openafs-*-src.tar.bz2' % sdist)
+        if len(g) == 0:
+            raise ValueError('Source archive not found in path "%s".' % sdist)
+        if len(g) > 1:
+            raise ValueError(
+                'More than one source archive found in path "%s".' % sdist)
+        archive = g[0]
+        self.extract(archive)
+        roots = glob.glob('openafs*')
+        if len(roots) != 1:
+            raise ValueError('One root directory expected source archive.')
+        os.chdir(roots[0])
+        version = self.extract_version_info()
+        self.results['version'] = version
+        return version
+
+
+class RedHatRpmBuilder(PackageBuilder):
+    """
+    Package builder for RedHat family distributions.
+    """
+    platform = 'Linux'
+    distribution = 'Redhat'
+
+    def __init__(self, module, name='openafs_build_packages'):
+        super(RedHatRpmBuilder, self).__init__(module, name)
+        self.topdir = expand_path(module.params['topdir'])
+        self.logdir = expand_path(module.params['logdir'])
+        self.inputs = []
+        self.results['cached'] = []
+        # Set up logging.
+        if not self.logdir:
+            self.logdir = os.path.join(self.topdir, 'BUILD')
+        if not os.path.isdir(self.logdir):
+            os.makedirs(self.logdir)
+            self.results['changed'] = True
+
+    def create_workspace(self):
+        """
+        Setup the rpmbuild workspace directory tree.
+
+        Create the rpmbuild SOURCES and SPECS directories and populate them
+        with the source and spec files from the source distribution in
+        preparation for building the source and binary RPM files.
+        """
+
+        sdist = expand_path(self.module.params['sdist'])
+        spec = expand_path(self.module.params['spec'])
+        relnotes = expand_path(self.module.params['relnotes'])
+        changelog = expand_path(self.module.params['changelog'])
+        csdb = expand_path(self.module.params['csdb'])
+        patchdir = expand_path(self.module.params['patchdir'])
+
+        for name in ('SOURCES', 'SPECS'):
+            directory = os.path.join(self.topdir, name)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        with tmpdir():
+            version = self.unpack_source(sdist)
+            if spec:
+                if spec.endswith('.in'):
+                    self.prepare_spec(spec, version)
+                else:
+                    self.copy(spec, os.path.join(self.topdir, 'SPECS', 'openafs.spec'))  # noqa: E501
+            else:
+                self.prepare_spec('src/packaging/RedHat/openafs.spec.in', version)   # noqa: E501
+            for source in self.list_sources(version):
+                dest = os.path.join(self.topdir, 'SOURCES', source)
+                if '-src.tar.' in source:
+                    self.copy(os.path.join(sdist, source), dest)
+                elif '-doc.tar.' in source:
+                    self.copy(os.path.join(sdist, source), dest)
+                elif 'RELNOTES' in source:
+                    if not relnotes:
+                        relnotes = os.path.join(sdist, source)
+                    if os.path.exists(relnotes):
+                        self.copy(relnotes, dest)
+                    else:
+                        self.write(dest, 'No release notes provided.\n')
+                elif 'ChangeLog' in source:
+                    if not changelog:
+                        changelog = os.path.join(sdist, 'ChangeLog')
+                    if os.path.exists(changelog):
+                        self.copy(changelog, dest)
+                    else:
+                        self.write(dest, 'No change log provided.\n')
+                elif 'CellServDB' in source:
+                    if not csdb:
+                        csdb = os.path.join(sdist, 'CellServDB')
+                        if not os.path.exists(csdb):
+                            csdb = 'src/afsd/CellServDB'
+                    self.copy(csdb, dest)
+                else:
+                    self.copy(os.path.join('src/packaging/RedHat', source), dest)   # noqa: E501
+
+            patches = self.list_patches(version)
+            for patch in patches:
+                dest = os.path.join(self.topdir, 'SOURCES', patch)
+                if patchdir:
+                    self.copy(os.path.join(patchdir, patch), dest)
+                else:
+                    self.copy(os.path.join(sdist, patch), dest)
+            self.inputs = self.list_sources(version) + patches
+
+    def build(self):
+        """
+        Run rpmbuild to build the source and/or binary rpms.
+
+        The source rpm is built first, then the binary rpms are rebuilt from
+        the source rpm with concurrent rpmbuild jobs. Jobs are skipped when
+        the packages built from the same inputs are still present.
+        """
+        build = self.module.params['build'] or 'all'
+        rpmbuild = self.module.get_bin_path('rpmbuild', required=True)
+        spec = os.path.join(self.topdir, 'SPECS', 'openafs.spec')
+        store = self.load_store()
+        inputs = self.inputs_digest(store)
+        built = {}
+
+        key = self.job_key(inputs, 'source', [])
+        packages = self.cached_packages(store, 'source', key)
+        if packages is None:
+            args = [rpmbuild, '--define', '_topdir %s' % self.topdir,
+                    '-bs', spec]
+            rc, logfile, packages = self.rpmbuild('source', args)
+            if rc != 0:
+                self.module.fail_json(msg='rpmbuild failed', logfile=logfile)
+            built['source'] = {'key': key, 'packages': packages}
+        srpms = [p for p in packages if p.endswith('.src.rpm')]
+        if len(srpms) != 1:
+            self.module.fail_json(msg='Source rpm not found.')
+        packages = list(packages)
+
+        jobs = []
+        for name, defines in self.binary_jobs(build):
+            key = self.job_key(inputs, name, defines)
+            cached = self.cached_packages(store, name, key)
+            if cached is None:
+                jobs.append((name, defines, key))
+            else:
+                packages.extend(cached)
+        if jobs:
+            for name, key, rpms in self.build_binaries(rpmbuild, srpms[0],
+                                                       jobs):
+                built[name] = {'key': key, 'packages': rpms}
+                packages.extend(rpms)
+
+        if built:
+            store['builds'].update(built)
+            self.save_store(store)
+            self.results['changed'] = True
+        self.results['package_type'] = 'rpm'
+        self.results['packages'] = packages
+
+    def load_store(self):
+        """
+        Read the record of the packages built in this workspace.
+        """
+        try:
+            with open(os.path.join(self.topdir, STORE)) as f:
+                store = json.load(f)
+        except (IOError, ValueError):
+            store = {}
+        store.setdefault('builds', {})
+        store.setdefault('digests', {})
+        return store
+
+    def save_store(self, store):
+        """
+        Record the packages built. This is written after the builds are
+        complete, so an interrupted build is not taken as complete.
+        """
+        filename = os.path.join(self.topdir, STORE)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(store, f, indent=2, sort_keys=True)
+        os.rename(filename + '.tmp', filename)
+
+    def inputs_digest(self, store):
+        """
+        Return a digest of the spec and the source and patch files.
+
+        File hashes are saved in the store and are only computed again
+        when the file size or modification time changes.
+        """
+        digests = {}
+        h = hashlib.sha256()
+        paths = [os.path.join(self.topdir, 'SPECS', 'openafs.spec')]
+        for name in sorted(set(self.inputs)):
+            paths.append(os.path.join(self.topdir, 'SOURCES', name))
+        for path in paths:
+            st = os.stat(path)
+            stamp = [st.st_size, st.st_mtime_ns]
+            saved = store['digests'].get(path)
+            if saved and saved[:2] == stamp:
+                digest = saved[2]
+            else:
+                digest = file_digest(path)
+            digests[path] = stamp + [digest]
+            h.update(('%s %s\n' % (digest, os.path.basename(path))).encode())
+        store['digests'] = digests
+        return h.hexdigest()
+
+    def job_key(self, inputs, name, defines):
+        """
+        Return the key of a build job's inputs.
+        """
+        key = json.dumps([inputs, name, defines], sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def cached_packages(self, store, name, key):
+        """
+        Return the packages of a previous build job with the same key,
+        or None if the job must be run.
+        """
+        saved = store['builds'].get(name)
+        if not saved or saved['key'] != key:
+            return None
+        packages = saved['packages']
+        if not packages or not all(os.path.exists(p) for p in packages):
+            return None
+        log.info('Skipping rpmbuild %s; packages are up to date.', name)
+        self.results['cached'].append(name)
+        return packages
+
+    def binary_jobs(self, build):
+        """
+        List the binary rpmbuild jobs for the build type.
+
+        :returns: a list of (<name>, <defines>) tuples
+        """
+        jobs = []
+        if build in ('all', 'userspace'):
+            jobs.append(('userspace', [
+                ('build_userspace', '1'),
+                ('build_modules', '0'),
+            ]))
+        if build in ('all', 'modules'):
+            for kernvers in (self.module.params['kernvers'] or [None]):
+                defines = [('build_userspace', '0'), ('build_modules', '1')]
+                if kernvers:
+                    defines.append(('kernvers', kernvers))
+                jobs.append(('kmod-%s' % (kernvers or platform.release()),
+                             defines))
+        return jobs
+
+    def build_binaries(self, rpmbuild, srpm, jobs):
+        """
+        Rebuild the binary rpms from the source rpm.
+
+        Each job is run in a separate rpmbuild _topdir so the jobs may be run
+        concurrently. The rpm files written by each job are moved to the RPMS
+        directory of the main workspace once all the jobs have completed
+        successfully.
+
+        :arg jobs: list of (<name>, <defines>, <key>) tuples
+        :returns: a list of (<name>, <key>, <rpms>) tuples
+        """
+        max_jobs = self.module.params['jobs'] or cpu_count()
+        workers = max(1, min(max_jobs, len(jobs)))
+        log.info('Running %d rpmbuild jobs; %d at a time.',
+                 len(jobs), workers)
+
+        def run_job(job):
+            name, defines, key = job
+            jobdir = os.path.join(self.topdir, 'JOBS', name)
+            if os.path.exists(jobdir):
+                shutil.rmtree(jobdir)
+            os.makedirs(jobdir)
+            args = [rpmbuild, '--define', '_topdir %s' % jobdir]
+            for macro, value in defines:
+                args.extend(['--define', '%s %s' % (macro, value)])
+            args.extend(['--rebuild', srpm])
+            rc, logfile, packages = self.rpmbuild(name, args)
+            return name, key, jobdir, rc, logfile, packages
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_job, jobs))
+
+        failed = [r for r in results if r[3] != 0]
+        if failed:
+            self.module.fail_json(
+                msg='rpmbuild failed',
+                jobs=[r[0] for r in failed],
+                logfiles=[r[4] for r in failed])
+
+        built = []
+        for name, key, jobdir, rc, logfile, packages in results:
+            rpms = []
+            for path in packages:
+                relpath = os.path.relpath(path, jobdir)
+                if relpath.startswith(os.pardir):
+                    rpms.append(path)  # Not written to the job workspace.
+                    continue
+                dest = os.path.join(self.topdir, relpath)
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                log.info('Moving "%s" to "%s".', path, dest)
+                os.rename(path, dest)
+                rpms.append(dest)
+            shutil.rmtree(jobdir)
+            built.append((name, key, rpms))
+        return built
+
+    def rpmbuild(self, name, args):
+        """
+        Run rpmbuild and list the package files written.
+
+        The output is written to a log file, named by the build job name,
+        in the log directory.
+
+        :returns: a tuple of the exit code, the log file path, and the list
+                  of the package files written
+        """
+        logfile = os.path.join(self.logdir, 'rpmbuild-%s.log' % name)
+        self.results['logfiles'].append(logfile)
+        with open(logfile, 'w') as f, self.timer.timed(args) as status:
+            log.info('Running: %s > %s' % (' '.join(args), logfile))
+            proc = subprocess.Popen(args, stdout=f.fileno(), stderr=f.fileno())
+            rc = status['rc'] = proc.wait()
+        log.info('rpmbuild %s rc=%d', name, rc)
+        packages = []
+        with open(logfile, 'r') as f:
+            for line in f.readlines():
+                m = re.match(r'Wrote: (.*)', line)
+                if m:
+                    packages.append(m.group(1).rstrip())
+        return rc, logfile, packages
+
+    def extract_version_info(self):
+        """
+        Extract the version information from the .version file.
+        """
+        version = None
+        if os.path.exists('.version'):
+            with open('.version') as f:
+                line = f.read().rstrip()
+            log.info('.version contains "%s"', line)
+            if line.startswith('openafs-'):
+                # Extract version from the git tag name.
+                version = re.sub('openafs-[^-]*-', '', line).replace('_', '.')
+            elif line.startswith('BP-'):
+                # Branch point tags do not contain the version number.
+                log.info('.version file has old branch point tag name.')
+            else:
+                # Use the given version string.
+                version = line
+        if not version:
+            # Unable to lookup version from the .version file, try to extract
+            # the version from the source directory name.
+            root = os.path.basename(os.path.abspath('.'))
+            m = re.match(r'openafs-(.*)', root)
+            if m:
+                version = m.group(1)
+        if not version:
+            self.module.fail_json(msg='Unable to determine version.')
+
+        # Determine package version and release from the OpenAFS version.
+        m1 = re.match(r'(.*)(pre[0-9]+)', version)              # prerelease
+        m2 = re.match(r'(.*)dev', version)                      # development
+        m3 = re.match(r'(.*)-([0-9]+)-(g[a-f0-9]+)$', version)  # development
+        m4 = re.match(r'(.*)-([a-z]+)([0-9]+)', version)        # custom
+        if m1:
+            v = m1.group(1)
+            r = "0.{0}".format(m1.group(2))
+        elif m2:
+            v = m2.group(1)
+            r = "0.dev"
+        elif m3:
+            v = m3.group(1)
+            r = "{0}.{1}".format(m3.group(2), m3.group(3))
+        elif m4:
+            v = m4.group(1).replace('-', '')
+            r = "1.2.{0}.{1}".format(m4.group(3), m4.group(2))
+        else:
+            v = version  # standard release
+            r = "1"      # increment when repackaging this version
+        # '-' are used as delimiters by rpm.
+        v = v.replace('-', '_')
+        r = r.replace('-', '_')
+        package_version = {
+            'openafs_version': version,
+            'package_version': v,
+            'package_release': r,
+        }
+        return package_version
+
+    def prepare_spec(self, template, version):
+        """
+        Render the openafs.spec file from the openafs.spec.in template.
+
+        Fill in the application and package version numbers.
+        Remove the date extension from the CellServDB source so we can
+        use a provided file or one from the tree if not provided.
+        """
+        v = version
+        lines = []
+        with open(template, 'r') as fin:
+            for line in fin.readlines():
+                line = line.replace('@VERSION@', v['openafs_version'])
+                line = line.replace('@PACKAGE_VERSION@', v['openafs_version'])  # noqa: E501
+                line = line.replace('@LINUX_PKGVER@', v['package_version'])
+                line = line.replace('@LINUX_PKGREL@', v['package_release'])
+                line = re.sub(r'^Source([\d]+): .*CellServDB.*',
+                              r'Source\1: CellServDB', line)
+                lines.append(line)
+        self.write(os.path.join(self.topdir, 'SPECS/openafs.spec'),
+                   ''.join(lines))
+
+    def list_sources(self, version):
+        """
+        Extract the source filenames from the spec file.
+        """
+        sources = []
+        spec = os.path.join(self.topdir, 'SPECS', 'openafs.spec')
+        with open(spec, 'r') as f:
+            for line in f.readlines():
+                line = line.rstrip()
+                m = re.match(r'Source[\d]+: (.*)', line)
+                if m:
+                    source = m.group(1).replace(
+                        r'%{afsvers}',
+                        version['openafs_version'])
+                    sources.append(os.path.basename(source))
+        return sources
+
+    def list_patches(self, version):
+        """
+        Extract the patch filenames from the spec file.
+        """
+        patches = []
+        spec = os.path.join(self.topdir, 'SPECS', 'openafs.spec')
+        with open(spec, 'r') as f:
+            for line in f.readlines():
+                line = line.rstrip()
+                m = re.match(r'Patch[\d]+: (.*)', line)
+                if m:
+                    patch = m.group(1).replace(r'%{afsvers}',
+                                               version['openafs_version'])
+                    patches.append(os.path.basename(patch))
+        return patches
+
+
+class CentOSRpmBuilder(RedHatRpmBuilder):
+    platform = 'Linux'
+    distribution = 'Centos'
+
+
+class FedoraRpmBuilder(RedHatRpmBuilder):
+    platform = 'Linux'
+    distribution = 'Fedora'
+
+
+class AlmaRpmBuilder(RedHatRpmBuilder):
+    platform = 'Linux'
+    distribution = 'Almalinux'
+
+
+class RockyRpmBuilder(RedHatRpmBuilder):
+    platform = 'Linux'
+    distribution = 'Rocky'
+
+
+class OracleRpmBuilder(RedHatRpmBuilder):
+    platform = 'Linux'
+    distribution = 'Oracle'
+
+
+def argument_spec():
+    """
+    Return the module options of the package building modules.
+    """
+    return dict(
+        build=dict(choices=['all', 'source', 'userspace', 'modules'],
+                   default='all'),
+        sdist=dict(type='path', required=True),
+        spec=dict(type='str', default=None),
+        relnotes=dict(type='str', default=None),
+        changelog=dict(type='str', default=None),
+        csdb=dict(type='path', default=None),
+        patchdir=dict(type='path', default=None),
+        kernvers=dict(type='list', elements='str', default=None),
+        jobs=dict(type='int', default=None),
+        topdir=dict(type='path', default='~/rpmbuild'),
+        logdir=dict(type='path', default=None),
+        tar=dict(type='path', default=None),
+        tar_extra_options=dict(type='str', default=''),
+        timings=dict(type='bool', default=False),
+    )
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# Copyright (c) 2026, Sine Nomine Associates
+# BSD 2-Clause License
+
+"""
+Opt-in module profiling.
+
+The main() function of each module is decorated with profiled(). When the
+ANSIBLE_OPENAFS_PROFILE environment variable is set on the remote node, the
+module is run under cProfile and/or tracemalloc and the profile data is
+written to the ANSIBLE_OPENAFS_PROFILE_DIR directory on the remote node.
+The paths of the files written are returned in the 'profile' module result.
+
+ANSIBLE_OPENAFS_PROFILE may be 'cpu' (cProfile), 'memory' (tracemalloc), or
+'all' (both). Any other true value, such as '1' or 'yes', is the same as
+'all'. The cProfile data may be viewed with the pstats module or snakeviz,
+and the tracemalloc snapshots loaded with tracemalloc.Snapshot.load().
+"""
+
+import functools                # noqa: E402
+import os                       # noqa: E402
+import tempfile                 # noqa: E402
+import time                     # noqa: E402
+
+from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+
+PROFILE_ENV = 'ANSIBLE_OPENAFS_PROFILE'
+PROFILE_DIR_ENV = 'ANSIBLE_OPENAFS_PROFILE_DIR'
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'ansible-openafs-profile')
+
+
+def profile_modes():
+    """
+    Return the set of profile modes requested, if any.
+    """
+    value = os.environ.get(PROFILE_ENV, '').strip().lower()
+    if value in ('', '0', 'n', 'no', 'false', 'off'):
+        return set()
+    if value in ('cpu', 'memory'):
+        return set([value])
+    return set(['cpu', 'memory'])
+
+
+class Profiler(object):
+    """
+    Run cProfile and tracemalloc and save the results.
+    """
+
+    def __init__(self, name, modes, directory=None):
+        if directory is None:
+            directory = os.environ.get(PROFILE_DIR_ENV) or PROFILE_DIR
+        self.name = name
+        self.modes = modes
+        self.directory = directory
+        self.profile = None
+        self.results = None
+
+    def start(self):
+        if 'memory' in self.modes:
+            import tracemalloc
+            tracemalloc.start()
+        if 'cpu' in self.modes:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the profile files. Returns a dict of the
+        paths written. Only the first call writes the files.
+        """
+        if self.results is not None:
+            return self.results
+        if self.profile:
+            self.profile.disable()
+        self.results = {}
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            base = os.path.join(self.directory, '%s-%s-%d' % (
+                self.name, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+            if self.profile:
+                path = base + '.prof'
+                self.profile.dump_stats(path)
+                self.results['cprofile'] = path
+            if 'memory' in self.modes:
+                import tracemalloc
+                if tracemalloc.is_tracing():
+                    path = base + '.tracemalloc'
+                    tracemalloc.take_snapshot().dump(path)
+                    current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    self.results['tracemalloc'] = path
+                    self.results['peak_memory'] = peak
+        except (IOError, OSError) as e:
+            self.results['error'] = 'Unable to write profile: %s' % e
+        return self.results
+
+
+def profiled(main):
+    """
+    Module main() decorator to run the module under the profiler when
+    requested with the ANSIBLE_OPENAFS_PROFILE environment variable.
+    """
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        modes = profile_modes()
+        if not modes:
+            return main(*args, **kwargs)
+        filename = main.__globals__.get('__file__') or main.__module__
+        name = os.path.basename(filename).replace('.py', '')
+        profiler = Profiler(name, modes)
+        exit_json = AnsibleModule.exit_json
+        fail_json = AnsibleModule.fail_json
+
+        def profiled_exit_json(self, **kwargs):
+            kwargs['profile'] = profiler.stop()
+            exit_json(self, **kwargs)
+
+        def profiled_fail_json(self, msg=None, **kwargs):
+            kwargs['profile'] = profiler.stop()
+            fail_json(self, msg=msg, **kwargs)
+
+        AnsibleModule.exit_json = profiled_exit_json
+        AnsibleModule.fail_json = profiled_fail_json
+        profiler.start()
+        try:
+            return main(*args, **kwargs)
+        finally:
+            profiler.stop()
+            AnsibleModule.exit_json = exit_json
+            AnsibleModule.fail_json = fail_json
+    return wrapper
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# Copyright (c) 2026, Sine Nomine Associates
+# BSD 2-Clause License
+
+"""
+External command timings.
+
+Run external commands with the module run_command() and record the argument
+vector, wall clock time, retry attempt, and exit code of each command. The
+recorded calls are summarized by command name (count, total time, and the
+50th and 95th percentile times) and returned in the module results when
+timings are requested with the module 'timings' option or by setting the
+ANSIBLE_OPENAFS_TIMINGS environment variable on the managed host.
+"""
+
+import contextlib               # noqa: E402
+import math                     # noqa: E402
+import os                       # noqa: E402
+import shlex                    # noqa: E402
+import threading                # noqa: E402
+import time                     # noqa: E402
+
+TIMINGS_ENV = 'ANSIBLE_OPENAFS_TIMINGS'
+
+# Commands with subcommands, which are timed by '<command> <subcommand>'.
+COMMAND_SUITES = ('bos', 'fs', 'pts', 'vos')
+
+
+def timings_enabled(module=None):
+    """
+    Return True if command timings have been requested.
+    """
+    if module is not None and module.params.get('timings'):
+        return True
+    value = os.environ.get(TIMINGS_ENV, '')
+    return value.lower() in ('1', 'y', 'yes', 'true', 'on')
+
+
+def command_name(args):
+    """
+    Return the name of a command for the timings summary.
+    """
+    if isinstance(args, str):
+        args = shlex.split(args)
+    if not args:
+        return ''
+    name = os.path.basename(str(args[0]))
+    if name in COMMAND_SUITES and len(args) > 1 and \
+            not str(args[1]).startswith('-'):
+        name = '%s %s' % (name, args[1])
+    return name
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of the values (nearest rank method).
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+class CommandTimer(object):
+    """
+    Run external commands and record their timings.
+    """
+
+    def __init__(self, module, enabled=None):
+        self.module = module
+        if enabled is None:
+            enabled = timings_enabled(module)
+        self.enabled = enabled
+        self.calls = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._run_command = module.run_command
+
+    def _call(self, args, elapsed, rc, retry=0, name=None):
+        if isinstance(args, str):
+            args = shlex.split(args)
+        return {
+            'name': name or command_name(args),
+            'argv': [str(a) for a in args],
+            'elapsed': round(elapsed, 6),
+            'rc': rc,
+            'retry': retry,
+        }
+
+    def record(self, args, elapsed, rc, retry=0, name=None):
+        """
+        Record a command call.
+        """
+        call = self._call(args, elapsed, rc, retry, name)
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    @contextlib.contextmanager
+    def timed(self, args, retry=0, name=None):
+        """
+        Time a command which is not run with run_command(). Yields a dict
+        in which the caller sets the 'rc' of the command. A command still
+        running, for example when the module fails with check_rc, is
+        included in the summary with the time so far.
+        """
+        status = {'rc': None}
+        start = time.monotonic()
+        key = object()
+        with self._lock:
+            self._pending[key] = (args, start, retry, name, status)
+        try:
+            yield status
+        finally:
+            with self._lock:
+                del self._pending[key]
+            self.record(args, time.monotonic() - start, status['rc'],
+                        retry, name)
+
+    def run_command(self, args, retry=0, name=None, **kwargs):
+        """
+        Run a command with the module run_command() and record the timing.
+        The retry is the number of previous attempts of the same command.
+        """
+        with self.timed(args, retry, name) as status:
+            rc, out, err = self._run_command(args, **kwargs)
+            status['rc'] = rc
+        return rc, out, err
+
+    def attach(self):
+        """
+        Time every command run with the module run_command(), and add the
+        timings summary to the module exit_json() and fail_json() results,
+        if requested. Returns the timer.
+        """
+        module = self.module
+        run_command = self._run_command
+        exit_json = module.exit_json
+        fail_json = module.fail_json
+
+        def timed_run_command(args, *a, **kwargs):
+            with self.timed(args) as status:
+                rc, out, err = run_command(args, *a, **kwargs)
+                status['rc'] = rc
+            return rc, out, err
+
+        def timed_exit_json(**kwargs):
+            exit_json(**self.update(kwargs))
+
+        def timed_fail_json(msg=None, **kwargs):
+            fail_json(msg=msg, **self.update(kwargs))
+
+        module.run_command = timed_run_command
+        module.exit_json = timed_exit_json
+        module.fail_json = timed_fail_json
+        return self
+
+    def summary(self):
+        """
+        Summarize the recorded calls by command name.
+        """
+        with self._lock:
+            calls = list(self.calls)
+            pending = list(self._pending.values())
+        now = time.monotonic()
+        for args, start, retry, name, status in pending:
+            calls.append(self._call(args, now - start, status['rc'], retry,
+                                    name))
+        commands = {}
+        for call in calls:
+            c = commands.setdefault(call['name'], {
+                'count': 0,
+                'total': 0.0,
+                'retries': 0,
+                'failures': 0,
+                'elapsed': [],
+            })
+            c['count'] += 1
+            c['total'] += call['elapsed']
+            c['elapsed'].append(call['elapsed'])
+            if call['retry']:
+                c['retries'] += 1
+            if call['rc'] != 0:
+                c['failures'] += 1
+        for c in commands.values():
+            elapsed = c.pop('elapsed')
+            c['total'] = round(c['total'], 6)
+            c['p50'] = percentile(elapsed, 50)
+            c['p95'] = percentile(elapsed, 95)
+        return {
+            'total': round(sum(c['elapsed'] for c in calls), 6),
+            'commands': commands,
+            'calls': calls,
+        }
+
+    def update(self, results):
+        """
+        Add the timings summary to the module results, if requested.
+        """
+        if self.enabled:
+            results['timings'] = self.summary()
+        return results
@@ -0,0 +1,331 @@
+#!/usr/bin/python
+# Copyright (c) 2026, Sine Nomine Associates
+# BSD 2-Clause License
+
+"""
+Incremental directory tree copy.
+
+Copy the files of a source directory tree to a destination directory tree,
+skipping files which are already up to date. Files are copied to a temporary
+file in the destination directory, then renamed into place, so a partially
+written file is never visible at the destination path. The fastest available
+copy method is used; a reflink (copy-on-write clone) when the filesystem
+supports it, then copy_file_range(), then sendfile(), then a plain read and
+write loop. Hard links may be requested instead of copies when the source
+tree is not modified after the copy.
+"""
+
+import errno                    # noqa: E402
+import filecmp                  # noqa: E402
+import fnmatch                  # noqa: E402
+import hashlib                  # noqa: E402
+import os                       # noqa: E402
+import platform                 # noqa: E402
+import shutil                   # noqa: E402
+import stat                     # noqa: E402
+import tempfile                 # noqa: E402
+
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from multiprocessing import cpu_count  # noqa: E402
+
+FICLONE = 0x40049409  # Linux ioctl to clone a file (reflink).
+CHUNK_SIZE = 1024 * 1024
+
+
+class CopyTreeError(Exception):
+    pass
+
+
+class _NullLogger(object):
+    def debug(self, fmt, *args):
+        pass
+
+    info = debug
+
+
+def file_digest(path):
+    """
+    Return the sha256 hex digest of a file.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_same(src, dst, checksum=False):
+    """
+    Return True if the destination is up to date with the source.
+
+    Regular files are considered the same when the sizes and modification
+    times (to the nanosecond) match, or when the sizes match and the
+    contents are identical, so an identical rebuilt file is not copied
+    again. The modification time of an identical destination file is
+    updated from the source, so the contents are not compared again on the
+    next sync. When checksum is true, the file contents are compared by
+    hash when the sizes match, regardless of the times. Symlinks are the
+    same when the link targets match.
+    """
+    try:
+        s = os.lstat(src)
+        d = os.lstat(dst)
+    except OSError:
+        return False
+    if stat.S_IFMT(s.st_mode) != stat.S_IFMT(d.st_mode):
+        return False
+    if stat.S_ISLNK(s.st_mode):
+        return os.readlink(src) == os.readlink(dst)
+    if s.st_size != d.st_size:
+        return False
+    if checksum:
+        return file_digest(src) == file_digest(dst)
+    if s.st_mtime_ns == d.st_mtime_ns:
+        return True
+    if not filecmp.cmp(src, dst, shallow=False):
+        return False
+    try:
+        shutil.copystat(src, dst)
+    except OSError:
+        pass
+    return True
+
+
+def _clone(fsrc, fdst):
+    """
+    Clone the file contents with a reflink. Raises OSError if the
+    filesystem does not support reflinks.
+    """
+    import fcntl
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                               min(size - offset, 1 << 30))
+        if n == 0:
+            break
+        offset += n
+    if offset != size:
+        raise OSError(errno.EIO, 'short copy')
+
+
+def _sendfile(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        n = os.sendfile(fdst.fileno(), fsrc.fileno(), offset,
+                        min(size - offset, 1 << 30))
+        if n == 0:
+            break
+        offset += n
+    if offset != size:
+        raise OSError(errno.EIO, 'short copy')
+
+
+def copy_contents(src, fdst):
+    """
+    Copy the contents of the file src to the open file fdst using the
+    fastest method available.
+    """
+    with open(src, 'rb') as fsrc:
+        size = os.fstat(fsrc.fileno()).st_size
+        if size == 0:
+            return
+        if platform.system() == 'Linux':
+            try:
+                _clone(fsrc, fdst)
+                return
+            except (IOError, OSError):
+                pass
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    _copy_file_range(fsrc, fdst, size)
+                    return
+                except (IOError, OSError):
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+            if hasattr(os, 'sendfile'):
+                try:
+                    _sendfile(fsrc, fdst, size)
+                    return
+                except (IOError, OSError):
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+
+
+def _tempname(dst):
+    dirname, basename = os.path.split(dst)
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+    os.close(fd)
+    os.remove(tmp)
+    return tmp
+
+
+def stage_file(src, dst, link=False):
+    """
+    Copy a file or symlink to a temporary file next to the destination path.
+
+    The temporary file is in the same directory, and so on the same
+    filesystem, as the destination, so it may be renamed to the destination
+    path atomically. When link is true, a hard link to the source is made
+    instead of a copy, if possible.
+
+    :returns: the temporary file path
+    """
+    if os.path.islink(src):
+        tmp = _tempname(dst)
+        os.symlink(os.readlink(src), tmp)
+        return tmp
+
+    if link:
+        tmp = _tempname(dst)
+        try:
+            os.link(src, tmp)
+            return tmp
+        except OSError:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+
+    dirname, basename = os.path.split(dst)
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fdst:
+            copy_contents(src, fdst)
+        shutil.copystat(src, tmp)
+    except Exception:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return tmp
+
+
+def copy_file(src, dst, link=False):
+    """
+    Atomically copy a file or symlink to the destination path.
+
+    The file is written to a temporary file in the destination directory and
+    then renamed to the destination path.
+    """
+    tmp = stage_file(src, dst, link)
+    try:
+        os.rename(tmp, dst)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def walk_tree(src, dst, exclude=None, log=None):
+    """
+    List the directories of a source tree and the corresponding destination.
+
+    :arg src: directory to walk. must already exist
+    :arg dst: destination directory
+    :arg exclude: list of patterns (glob notation) of destination paths to
+                  exclude
+    :arg log: optional logger
+    :returns: a list of (<srcdir>, <dstdir>, <names>) tuples, where names is
+              the list of the non-directory entries to be copied, parent
+              directories first
+
+    Symlinks to directories in the source tree are followed, and the files
+    of the linked directory are copied to a directory at the destination.
+    """
+    if exclude is None:
+        exclude = []
+    if log is None:
+        log = _NullLogger()
+
+    def is_exclusion(fn):
+        for pattern in exclude:
+            if fnmatch.fnmatch(fn, pattern):
+                return True
+        return False
+
+    if not os.path.isdir(src):
+        raise CopyTreeError("Cannot copy tree '%s': not a directory." % src)
+
+    dirs = []
+    pending = [(src, dst)]
+    while pending:
+        s, d = pending.pop(0)
+        try:
+            entries = sorted(os.scandir(s), key=lambda e: e.name)
+        except OSError:
+            raise CopyTreeError("Error listing files in '%s'." % s)
+        names = []
+        for entry in entries:
+            d_name = os.path.join(d, entry.name)
+            if is_exclusion(d_name):
+                log.info("Excluding '%s'.", d_name)
+            elif entry.is_dir():
+                pending.append((entry.path, d_name))
+            else:
+                names.append(entry.name)
+        dirs.append((s, d, names))
+    return dirs
+
+
+def sync_tree(src, dst, exclude=None, checksum=False, link=False,
+              workers=None, report_unchanged=False, log=None):
+    """
+    Incrementally copy a directory tree.
+
+    Creates the destination if needed. Files which are missing or different
+    in the destination are atomically replaced. The files of each directory
+    are processed in a thread pool.
+
+    :arg src: directory to copy from. must already exist
+    :arg dst: directory to copy to. created if not already present
+    :arg exclude: list of patterns (glob notation) of destination paths to
+                  exclude
+    :arg checksum: compare file contents by hash instead of modification time
+    :arg link: hard link files instead of copying when possible
+    :arg workers: maximum number of threads
+    :arg report_unchanged: include unchanged files in the results
+    :arg log: optional logger
+    :returns: a sorted list of (<path>, <changed>) tuples of the destination
+              files/symlinks; only the changed files unless report_unchanged
+              is true
+    """
+    if log is None:
+        log = _NullLogger()
+    if workers is None:
+        workers = min(32, cpu_count() + 4)
+
+    # Walk the source tree and create the destination directories, then
+    # process the files in each directory in parallel.
+    jobs = []
+    for s, d, names in walk_tree(src, dst, exclude, log):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        if names:
+            jobs.append((s, d, names))
+
+    def sync_dir(job):
+        s, d, names = job
+        files = []
+        for n in names:
+            s_name = os.path.join(s, n)
+            d_name = os.path.join(d, n)
+            if is_same(s_name, d_name, checksum):
+                log.debug("Skipping '%s'; unchanged.", d_name)
+                files.append((d_name, False))
+            else:
+                log.debug("Copying '%s' to '%s'.", s_name, d_name)
+                copy_file(s_name, d_name, link)
+                files.append((d_name, True))
+        return files
+
+    files = []
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for result in executor.map(sync_dir, jobs):
+                files.extend(result)
+    if not report_unchanged:
+        files = [f for f in files if f[1]]
+    return sorted(files)
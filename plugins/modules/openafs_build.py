@@ -149,6 +149,40 @@ options:
     type: str
     default: detect
 
+  kernels:
+    description:
+      - List of Linux kernel versions or kernel header directories to build
+        the OpenAFS kernel module for.
+      - A kernel version is mapped to the C(/lib/modules/<version>/build)
+        header directory. A path (starting with C(/)) is taken as the kernel
+        header directory, and the kernel version is read from the
+        C(include/config/kernel.release) file in that directory.
+      - When specified, the userspace programs are built once, a standalone
+        C(libafs_tree) is generated, and the kernel module is built for each
+        kernel concurrently in a separate C(libafs-<version>) directory under
+        the I(builddir).
+      - Unless I(configure_options) is specified, the kernel module is not
+        built in the main build tree when I(kernels) is given.
+      - Only supported on Linux.
+    type: list
+    elements: str
+
+  kernel_jobs:
+    description:
+      - The maximum number of kernel module builds to run at the same time
+        when I(kernels) is specified.
+    default: the number of CPUs on the system
+    type: int
+
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -193,6 +227,14 @@ EXAMPLES = r'''
         - krb5: /path/to/krb5.lib
       with_linux_kernel_packaging: true
       with_swig: true
+
+- name: Build OpenAFS and kernel modules for several installed kernels.
+  openafs_contrib.openafs.openafs_build:
+    srcdir: ~/src/openafs
+    kernels:
+      - 5.14.0-427.13.1.el9_4.x86_64
+      - 5.14.0-503.14.1.el9_5.x86_64
+      - /usr/src/kernels/5.14.0-570.12.1.el9_6.x86_64
 '''
 
 RETURN = r'''
@@ -236,6 +278,23 @@ kmods:
   type: list
   sample:
     - /home/tycobb/projects/myproject/src/libafs/MODLOAD-5.1.0-SP/openafs.ko
+
+kernel_modules:
+  description: The kernel modules built for each kernel version, when
+               I(kernels) is specified.
+  returned: when kernels is specified
+  type: dict
+  sample:
+    5.1.0:
+      - /home/tycobb/openafs/libafs-5.1.0/src/libafs/MODLOAD-5.1.0-SP/afs.ko
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
 import glob        # noqa: E402
@@ -246,16 +305,21 @@ import re          # noqa: E402
 import shlex       # noqa: E402
 import shutil      # noqa: E402
 import subprocess  # noqa: E402
+import threading   # noqa: E402
 
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
 from multiprocessing import cpu_count  # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible.module_utils.six import string_types  # noqa: E402
 
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common \
-    import Logger, chdir, lookup_fact  # noqa: E402
+    import Logger, lookup_fact  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.o2a \
     import options_to_args  # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.treesync import sync_tree  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
@@ -273,41 +337,6 @@ all:
 """  # noqa: W191,E101
 
 
-def copy_tree(src, dst):
-    """Copy an entire directory tree.
-
-    Creates destination if needed. Clobbers any existing files/symlinks.
-
-    :arg src: directory to copy from. must already exist
-    :arg dst: directory to copy to. created if not already present
-    :returns: a list of files/symlinks created
-    """
-    outputs = []
-    if not os.path.isdir(src):
-        raise ValueError("cannot copy tree '%s': not a directory" % src)
-    try:
-        names = os.listdir(src)
-    except os.error:
-        raise ValueError("error listing files in '%s'" % src)
-    if not os.path.isdir(dst):
-        os.makedirs(dst)
-    for n in names:
-        src_name = os.path.join(src, n)
-        dst_name = os.path.join(dst, n)
-        if os.path.islink(src_name):
-            link_dest = os.readlink(src_name)
-            if os.path.exists(dst_name):
-                os.remove(dst_name)
-            os.symlink(link_dest, dst_name)
-            outputs.append(dst_name)
-        elif os.path.isdir(src_name):
-            outputs.extend(copy_tree(src_name, dst_name))
-        else:
-            shutil.copy2(src_name, dst_name)
-            outputs.append(dst_name)
-    return outputs
-
-
 def get_platform_subclass(cls):
     for subcls in cls.__subclasses__():
         if platform.system() == subcls.platform:
@@ -324,6 +353,7 @@ class Builder(object):
     def __init__(self, module):
         self._stage = 'init'
         self.module = module
+        self.timer = CommandTimer(module).attach()
         self.logdir = None
         self.logfiles = set()
         self.changed = False
@@ -339,7 +369,14 @@ class Builder(object):
         self.configure_args = None
         self.make_args = None
         self.kmods = []
+        self.kernels = self.module.params['kernels']
+        self.kernel_modules = {}
         self.install_dirs = {}
+        self._log_lock = threading.Lock()
+
+        if self.kernels and not hasattr(self, 'build_kernel_module'):
+            self.fail('kernels option is not supported on %s' %
+                      platform.system())
 
         # Verify srcdir exists.
         self.srcdir = os.path.abspath(self.module.params['srcdir'])
@@ -392,6 +429,7 @@ class Builder(object):
         self.build_regen()
         self.build_configure()
         self.build_make()
+        self.build_kernels()
         self.log('Build completed.')
         results = {
             'changed': self.changed,
@@ -414,6 +452,8 @@ class Builder(object):
             results['version'] = self.version
         if self.target:
             results['target'] = self.target
+        if self.kernels:
+            results['kernel_modules'] = self.kernel_modules
         return results
 
     def build_clean(self):
@@ -563,9 +603,11 @@ class Builder(object):
 
         # make may silently fail to build a kernel module for the running
         # kernel version (or any version). Let's fail early instead of finding
-        # out later when we try to start the cache manager.
+        # out later when we try to start the cache manager. The modules for
+        # an explicit list of kernels are verified after they are built.
         self.kmods = self.collect_kernel_modules(self.builddir)
-        self.verify_kernel_module()
+        if not self.kernels:
+            self.verify_kernel_module()
 
         # Transarc style post build tasks.
         if self.transarc_paths:
@@ -582,18 +624,76 @@ class Builder(object):
         with open(filename, 'w') as f:
             f.write(json.dumps(build_info, indent=4))
 
+    def build_kernels(self):
+        """
+        Build the kernel module for each of the requested kernels.
+
+        The userspace build is done once. A standalone libafs tree is
+        generated from the configured build tree, then copied to a separate
+        build directory for each kernel and the kernel module builds are run
+        concurrently.
+        """
+        if self._stage != 'make':
+            raise AssertionError('sequence error: %s' % self._stage)
+        self._stage = 'kernels'
+
+        if not self.kernels:
+            return
+
+        kernels = []
+        for kernel in self.kernels:
+            version, headers = self.resolve_kernel(kernel)
+            if not os.path.isdir(headers):
+                self.fail('Kernel headers not found for kernel %s: %s' %
+                          (version, headers))
+            kernels.append((version, headers))
+
+        self.run('libafs_tree', [self.make, 'libafs_tree'], self.builddir)
+        tree = os.path.join(self.builddir, 'libafs_tree')
+        if not os.path.isdir(tree):
+            self.fail('Missing libafs_tree directory: %s' % tree)
+
+        workers = self.module.params['kernel_jobs']
+        if workers < 1:
+            workers = 1
+        workers = min(workers, len(kernels))
+        jobs = self.module.params['jobs']
+        if jobs > 0:
+            jobs = max(1, jobs // workers)
+
+        self.log('Building kernel modules for %d kernels (%d at a time).' %
+                 (len(kernels), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for version, headers in kernels:
+                futures.append((version, executor.submit(
+                    self.build_kernel_module, tree, version, headers, jobs)))
+            errors = []
+            for version, future in futures:
+                try:
+                    self.kernel_modules[version] = future.result()
+                except Exception as e:
+                    errors.append('%s: %s' % (version, e))
+        self.changed = True
+        if errors:
+            self.fail('Kernel module build failed; %s' % '; '.join(errors))
+
+        for version in sorted(self.kernel_modules):
+            self.kmods.extend(self.kernel_modules[version])
+
     def log(self, msg):
         """
         Log a message to the build.log file and the syslog.
         """
         log.info(msg)
-        if not os.path.isdir(self.logdir):
-            os.makedirs(self.logdir)
-            self.changed = True
-        build_log = os.path.join(self.logdir, 'build.log')
-        with open(build_log, 'a') as f:
-            f.write('%s\n' % msg)
-        self.logfiles.add(build_log)
+        with self._log_lock:
+            if not os.path.isdir(self.logdir):
+                os.makedirs(self.logdir)
+                self.changed = True
+            build_log = os.path.join(self.logdir, 'build.log')
+            with open(build_log, 'a') as f:
+                f.write('%s\n' % msg)
+            self.logfiles.add(build_log)
 
     def abspath(self, base, rel):
         """
@@ -626,35 +726,37 @@ class Builder(object):
             log.error(err)
         return out
 
-    def run(self, name, command, cwd, extra_env=None):
+    def run(self, name, command, cwd, extra_env=None, check=True):
         """
         Run a command and write stdout and stderr a tailable file.
 
         Unlike the standard run_command(), this function pipes the output as
         received to a file that can be followed with tail -f.  This can be
         helpful when troubleshooting builds.
+
+        The working directory is passed to the child process instead of
+        changing the current directory, so commands may be run from more than
+        one thread. When check is false, the exit code is returned instead of
+        failing the module.
         """
         env = os.environ.copy()
         if extra_env:
             env.update(extra_env)
 
-        if not os.path.isdir(self.logdir):
-            os.makedirs(self.logdir)
-            self.changed = True
-
         self.log('Running [%s] %s' % (cwd, ' '.join(command)))
         logfile = os.path.join(self.logdir, '%s.log' % name)
-        self.logfiles.add(logfile)
-        with open(logfile, 'w') as f:
-            with chdir(cwd):
-                proc = subprocess.Popen(command, env=env, stdout=f.fileno(),
-                                        stderr=f.fileno())
-                rc = proc.wait()
-        if rc != 0:
+        with self._log_lock:
+            self.logfiles.add(logfile)
+        with open(logfile, 'w') as f, self.timer.timed(command) as status:
+            proc = subprocess.Popen(command, env=env, cwd=cwd,
+                                    stdout=f.fileno(), stderr=f.fileno())
+            rc = status['rc'] = proc.wait()
+        if rc != 0 and check:
             self.fail('%s command failed; see "%s".' % (name, logfile))
+        return rc
 
     def get_deprecated_option(self, name):
-        self.log("WARNING: %s option is deprecated.", name)
+        self.log("WARNING: %s option is deprecated." % name)
         return self.module.params[name]
 
     def get_configure_options(self):
@@ -676,7 +778,7 @@ class Builder(object):
             self.fail("specify build_userspace and/or build_module")
 
         options = {'enable': [], 'disable': [], 'with': [], 'without': []}
-        if build_module:
+        if build_module and not self.kernels:
             options['enable'].append('kernel-module')
             self.kernel_module_configure_options(options)
         else:
@@ -690,7 +792,7 @@ class Builder(object):
         if with_debug_symbols:
             options['enable'].append('debug')
             options['disable'].extend(['optimize', 'strip-binaries'])
-            if build_module:
+            if build_module and not self.kernels:
                 options['enable'].append('debug-kernel')
                 options['disable'].append('optimize-kernel')
         if with_transarc_paths:
@@ -794,8 +896,10 @@ class Builder(object):
             dest = os.path.join(self.builddir, sysname, 'dest')
             if not os.path.isdir(dest):
                 self.fail('Missing dest directory: %s' % dest)
-            copy_tree(dest, self.destdir)
-            self.changed = True
+            files = sync_tree(dest, self.destdir, log=log)
+            self.log('%d files changed in %s' % (len(files), self.destdir))
+            if files:
+                self.changed = True
 
         #
         # Copy security key utilities to a standard location.
@@ -826,6 +930,73 @@ class LinuxBuilder(Builder):
     def kernel_module_configure_options(self, options):
         options['with'].append('linux-kernel-packaging')
 
+    def resolve_kernel(self, kernel):
+        """
+        Get the kernel version and kernel headers directory.
+
+        The kernel may be given as a kernel version or as the path to the
+        kernel headers directory.
+        """
+        if not kernel.startswith('/'):
+            return kernel, os.path.join('/lib/modules', kernel, 'build')
+        headers = os.path.abspath(kernel)
+        release = os.path.join(headers, 'include', 'config', 'kernel.release')
+        try:
+            with open(release) as f:
+                version = f.read().strip()
+        except IOError:
+            version = None
+        if not version:
+            self.fail('Unable to read kernel version from %s' % release)
+        return version, headers
+
+    def build_kernel_module(self, tree, version, headers, jobs):
+        """
+        Build the kernel module for one kernel in a copy of the libafs tree.
+
+        Runs in a worker thread, so errors are raised instead of failing the
+        module. Returns the list of kernel modules built.
+        """
+        kbuilddir = os.path.join(self.builddir, 'libafs-%s' % version)
+        if os.path.exists(kbuilddir):
+            shutil.rmtree(kbuilddir)
+        shutil.copytree(tree, kbuilddir, symlinks=True)
+
+        # Carry over the kernel options from the userspace configure.
+        configure = [os.path.join(kbuilddir, 'configure'),
+                     '--with-linux-kernel-headers=%s' % headers,
+                     '--with-linux-kernel-packaging']
+        for arg in self.configure_args[1:]:
+            if re.match(r'--(enable|disable)-(debug|optimize)-kernel$', arg):
+                configure.append(arg)
+        env = self.module.params['configure_environment']
+        rc = self.run('configure-%s' % version, configure, kbuilddir,
+                      extra_env=env, check=False)
+        if rc != 0:
+            raise RuntimeError('configure failed; see "%s/configure-%s.log"' %
+                               (self.logdir, version))
+
+        make = [self.make]
+        fakeroot = self.module.params['fakeroot']
+        if fakeroot:
+            make.insert(0, fakeroot)
+        if jobs > 0:
+            make.extend(['-j', '%d' % jobs])
+        rc = self.run('make-%s' % version, make, kbuilddir, check=False)
+        if rc != 0:
+            raise RuntimeError('make failed; see "%s/make-%s.log"' %
+                               (self.logdir, version))
+
+        pattern = \
+            r'/MODLOAD-%s(-[A-Z]*)?/(lib|open)afs\.ko$' % re.escape(version)
+        kmods = [k for k in self.collect_kernel_modules(kbuilddir)
+                 if re.search(pattern, k)]
+        self.log('Modules found for kernel %s: %s' %
+                 (version, ' '.join(kmods)))
+        if not kmods:
+            raise RuntimeError('loadable kernel module not found')
+        return kmods
+
     def collect_kernel_modules(self, builddir):
         """
         Search for built kernel modules on Linux.
@@ -932,6 +1103,7 @@ class FreeBSDBuilder(Builder):
         pass
 
 
+@profiled
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -967,6 +1139,9 @@ def main():
             build_bindings=dict(type='bool', default=True),
 
             target=dict(type='str', default=None),
+            kernels=dict(type='list', elements='str', default=None),
+            kernel_jobs=dict(type='int', fallback=(cpu_count, [])),
+            timings=dict(type='bool', default=False),
         ),
         supports_check_mode=False,
     )
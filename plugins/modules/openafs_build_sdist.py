@@ -18,15 +18,22 @@ description:
   - Create OpenAFS source and document source distribution archives from
     a git checkout.
 
+  - The archives are reproducible; the archive members are sorted, the
+    modification times are set to the time of the git commit, the owners
+    are set to root, and the gzip header does not contain a timestamp.
+
+  - The commit of the files written is recorded in the I(sdist) directory.
+    When the source distribution files for the current commit are already
+    present, the existing files are returned and nothing is changed.
+
 requirements:
   - git
   - autoconfig
   - automake
   - libtools
   - tar
-  - gzip
-  - bzip2
-  - md5sum
+  - gzip or pigz
+  - bzip2 or pbzip2
   - pod2man
 
 options:
@@ -42,6 +49,17 @@ options:
     type: path
     default: C(openafs)
 
+  cachedir:
+    description:
+      - The path on the remote node to cache the extracted and generated
+        source tree.
+      - The cached tree is reused when the git commit and the version have
+        not changed, to avoid running C(regen.sh) again.
+      - The trees are kept in the C(openafs_build_sdist) subdirectory of
+        this path. Only the trees created by this module are removed.
+    type: path
+    default: C(~/.cache/openafs_build_sdist)
+
   tar:
     description: C(tar) program path
     type: path
@@ -53,20 +71,52 @@ options:
     default: detected
 
   gzip:
-    description: C(gzip) program path
+    description:
+      - C(gzip) program path
+      - The multi-threaded C(pigz) program is used when available, unless
+        this option is specified.
     type: path
     default: detected
 
   bzip2:
-    description: C(bzip2) program path
+    description:
+      - C(bzip2) program path
+      - The multi-threaded C(pbzip2) program is used when available, unless
+        this option is specified.
     type: path
     default: detected
 
-  md5sum:
-    description: C(md5sum) program path
+  xz:
+    description:
+      - C(xz) program path
+      - C(xz) is run with the C(-T0) option to use all of the CPUs.
     type: path
     default: detected
 
+  formats:
+    description:
+      - The list of compressed archive formats to create.
+      - The archives are compressed concurrently.
+    type: list
+    elements: str
+    choices: ['gz', 'bz2', 'xz']
+    default: ['gz', 'bz2']
+
+  md5sum:
+    description:
+      - Not used. The md5 and sha256 checksum files are computed by the
+        module while the compressed archives are written.
+    type: path
+
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -97,28 +147,74 @@ files:
   description: The list of sdist files created on the remote node.
   returned: always
   type: list
+
+commit:
+  description: The git commit of the source distribution.
+  returned: always
+  type: str
+
+cached:
+  description: True if the existing source distribution files or the
+               cached generated source tree was used.
+  returned: always
+  type: bool
+
+archives:
+  description: The compressed archives created, with the size in bytes,
+               the time in seconds to create, and the checksums.
+  returned: always
+  type: list
+  sample:
+    - file: /home/tycobb/openafs/packages/openafs-1.8.8-src.tar.gz
+      compressor: /usr/bin/pigz
+      size: 15204394
+      seconds: 1.42
+      md5: 1b1f5e1dd1ca5f8e5d31d1a8e0b5e7b5
+      sha256: 0e5d4a7f4a2e4b9a8c3d1f0b6a5e4d3c2b1a0f9e8d7c6b5a4f3e2d1c0b9a8f7e
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
-import glob                    # noqa: E402
+import hashlib                 # noqa: E402
+import json                    # noqa: E402
 import os                      # noqa: E402
 import platform                # noqa: E402
 import re                      # noqa: E402
 import shutil                  # noqa: E402
+import subprocess              # noqa: E402
+import tarfile                 # noqa: E402
+import tempfile                # noqa: E402
+import threading               # noqa: E402
+import time                    # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import chdir  # noqa: E402, E501
-from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import tmpdir  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
 
 COMPRESSIONS = [
-    # suffix, command
-    ('gz',  'gzip'),
-    ('bz2', 'bzip2'),
+    # suffix, parameter, commands in order of preference
+    ('gz',  'gzip', [['pigz', '-n'], ['gzip', '-n']]),
+    ('bz2', 'bzip2', [['pbzip2'], ['bzip2']]),
+    ('xz',  'xz', [['xz', '-T0']]),
 ]
+CHUNK_SIZE = 1024 * 1024
+STORE = '.sdist.json'
+
+# Cached source trees are named <git commit>-<version>.
+CACHE_SUBDIR = 'openafs_build_sdist'
+CACHE_ENTRY = re.compile(r'^[0-9a-f]{40,64}-\S+$')
 
 
 def get_platform_subclass(cls):
@@ -138,7 +234,8 @@ class SourceDistBuilder(object):
 
     def __init__(self, module):
         self.module = module
-        self.results = dict(files=[], commands=[])
+        self.timer = CommandTimer(module).attach()
+        self.results = dict(files=[], commands=[], archives=[])
         # paths
         self.sdist = self.get_path('sdist')
         self.topdir = self.get_path('topdir')
@@ -147,10 +244,13 @@ class SourceDistBuilder(object):
         self.tar = self.get_bin_path('tar', required=True)
         # add available compression programs
         self.compressors = []
-        for suffix, command in COMPRESSIONS:
-            path = self.get_bin_path(command)
-            if path:
-                self.compressors.append(Compressor(self, suffix, path))
+        formats = self.module.params['formats']
+        for suffix, name, commands in COMPRESSIONS:
+            if suffix not in formats:
+                continue
+            command = self.find_compressor(name, commands)
+            if command:
+                self.compressors.append(Compressor(self, suffix, command))
 
     def build(self):
         """
@@ -159,49 +259,184 @@ class SourceDistBuilder(object):
         sdist = self.sdist
         topdir = self.topdir
         git = self.git
-        tar = self.tar
 
         # Create output directory if not present.
         if not os.path.exists(sdist):
             os.makedirs(sdist)
 
-        # Get the version and change log.
+        # Get the version and commit.
         with chdir(topdir):
             version = self.extract_version_string()
+            commit = self.shell('%(git)s rev-parse HEAD' % locals()).strip()
+            mtime = int(self.shell('%(git)s log -1 --format=%%ct HEAD' %
+                                   locals()).strip())
+        self.results['commit'] = commit
+
+        # Return the existing files if already built for this commit.
+        key = {
+            'commit': commit,
+            'version': version,
+            'formats': sorted(c.suffix for c in self.compressors),
+        }
+        stored = self.load_store()
+        if stored.get('key') == key and \
+           all(os.path.exists(f) for f in stored.get('files', [])):
+            log.info('Source distribution for %s is up to date.', commit)
+            self.results['files'] = stored['files']
+            self.results['archives'] = stored['archives']
+            self.results['cached'] = True
+            self.results['changed'] = False
+            return
+
+        # Write the change log.
+        with chdir(topdir):
             changelog = '%(sdist)s/ChangeLog' % locals()
             self.shell('%(git)s log >%(changelog)s' % locals())
             self.results['files'].append(changelog)
 
         # Make source archives.
-        with tmpdir():
-            # Extract source tree into temp dir.
+        tree = self.regen_tree(version, commit)
+        self.write_archives(tree, version, sdist, mtime)
+        self.save_store(key)
+        self.results['changed'] = True
+
+    def load_store(self):
+        """
+        Read the record of the last source distribution written.
+        """
+        try:
+            with open(os.path.join(self.sdist, STORE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save_store(self, key):
+        """
+        Record the source distribution files written for a commit. This is
+        written last, so an interrupted build is not taken as complete.
+        """
+        store = {
+            'key': key,
+            'files': self.results['files'],
+            'archives': self.results['archives'],
+        }
+        filename = os.path.join(self.sdist, STORE)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(store, f, indent=2)
+        os.rename(filename + '.tmp', filename)
+
+    def regen_tree(self, version, commit):
+        """
+        Extract the source tree and generate configure, makefiles, and
+        documents.
+
+        The generated tree is cached by commit and version, so it is reused
+        when the commit has not changed. Only the most recent tree is kept.
+        """
+        git = self.git
+        tar = self.tar
+        topdir = self.topdir
+        cachedir = os.path.join(self.get_path('cachedir'), CACHE_SUBDIR)
+        key = '%s-%s' % (commit, version)
+        tree = os.path.join(cachedir, key, 'openafs-%s' % version)
+        if os.path.exists(os.path.join(cachedir, key, '.complete')):
+            log.info('Using cached source tree %s', tree)
+            self.results['cached'] = True
+            return tree
+        self.results['cached'] = False
+
+        # Remove the stale and incomplete trees created by this module.
+        if os.path.isdir(cachedir):
+            for name in os.listdir(cachedir):
+                path = os.path.join(cachedir, name)
+                if not CACHE_ENTRY.match(name) or os.path.islink(path) or \
+                        not os.path.isdir(path):
+                    continue
+                log.info('Removing stale cache %s', name)
+                shutil.rmtree(path)
+        workdir = os.path.join(cachedir, key)
+        os.makedirs(workdir)
+
+        # Extract source tree into the cache dir.
+        with chdir(workdir):
             self.shell('(cd %(topdir)s &&'
                        ' %(git)s archive'
                        '  --format=tar'
                        '  --prefix=openafs-%(version)s/  HEAD) |'
                        ' %(tar)s xf -' % locals())
 
-            # Generate configure, makefiles, and documents in temp dir.
-            with chdir('openafs-%(version)s' % locals()):
-                with open('.version', 'w') as f:
-                    f.write(version + '\n')
-                self.shell('./regen.sh')
-
-            # Create documentation and source archives.
-            self.shell('%(tar)s cf'
-                       ' openafs-%(version)s-doc.tar'
-                       ' openafs-%(version)s/doc' % locals())
-            shutil.rmtree('openafs-%(version)s/doc' % locals())
-            self.shell('%(tar)s cf '
-                       ' openafs-%(version)s-src.tar'
-                       ' openafs-%(version)s' % locals())
-
-            # Create compressed archives in destination directory.
-            for archive in glob.glob('*.tar'):
-                for c in self.compressors:
-                    c.compress(archive, sdist)
+        # Generate configure, makefiles, and documents.
+        with chdir(tree):
+            with open('.version', 'w') as f:
+                f.write(version + '\n')
+            self.shell('./regen.sh')
 
-        self.results['changed'] = True
+        with open(os.path.join(workdir, '.complete'), 'w') as f:
+            f.write(commit + '\n')
+        return tree
+
+    def write_archives(self, tree, version, destdir, mtime):
+        """
+        Write the compressed documentation and source archives.
+
+        The tree is read once. The doc subdirectory is written to the
+        documentation archive stream and everything else to the source
+        archive stream, and each stream is fed to all of the compressors
+        at the same time, so no intermediate tar files are written.
+
+        The archives are reproducible; the members are sorted, and the
+        modification times are set to the commit time and the owners to
+        root.
+        """
+        def normalize(info):
+            info.mtime = mtime
+            info.uid = info.gid = 0
+            info.uname = info.gname = 'root'
+            return info
+
+        if not self.compressors:
+            return
+        prefix = 'openafs-%s' % version
+        docdir = '%s/doc' % prefix
+        streams = {}
+        for kind in ('src', 'doc'):
+            filename = '%s-%s.tar' % (prefix, kind)
+            outputs = [c.open(filename, destdir) for c in self.compressors]
+            archive = tarfile.open(fileobj=Tee(outputs), mode='w|',
+                                   format=tarfile.GNU_FORMAT)
+            streams[kind] = (archive, outputs)
+
+        try:
+            for path, arcname in walk_sorted(tree, prefix):
+                if arcname == docdir or arcname.startswith(docdir + '/'):
+                    kind = 'doc'
+                else:
+                    kind = 'src'
+                streams[kind][0].add(path, arcname, recursive=False,
+                                     filter=normalize)
+            for kind in ('src', 'doc'):
+                streams[kind][0].close()
+        except (IOError, OSError) as e:
+            self.module.fail_json(msg='Failed to write archives: %s' % e)
+
+        errors = []
+        for kind in ('src', 'doc'):
+            for output in streams[kind][1]:
+                try:
+                    info = output.close()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                log.info('Created %s: %d bytes in %.2f seconds',
+                         info['file'], info['size'], info['seconds'])
+                self.results['archives'].append(info)
+                self.results['files'].append(info['file'])
+                for checksum in ('md5', 'sha256'):
+                    self.results['files'].append(
+                        '%s.%s' % (info['file'], checksum))
+        if errors:
+            self.module.fail_json(msg='Compression failed: %s' %
+                                  '; '.join(errors), **self.results)
 
     def shell(self, command):
         log.info('Running: %s', command)
@@ -229,6 +464,23 @@ class SourceDistBuilder(object):
             bin_path = self.module.get_bin_path(bin_name, required)
         return bin_path
 
+    def find_compressor(self, name, commands):
+        """
+        Find the compression command. An explicit program path is used if
+        given, otherwise the first program found in the list of commands.
+        """
+        bin_path = self.module.params.get(name, None)
+        if bin_path:
+            for command in commands:
+                if os.path.basename(bin_path) == command[0]:
+                    return [bin_path] + command[1:]
+            return [bin_path]
+        for command in commands:
+            bin_path = self.module.get_bin_path(self.get_bin_name(command[0]))
+            if bin_path:
+                return [bin_path] + command[1:]
+        return None
+
     def get_bin_name(self, name):
         """
         Lookup a binary name from the parameter name.  Subclasses may
@@ -260,32 +512,141 @@ class SourceDistBuilder(object):
         return version
 
 
+def walk_sorted(top, arcname):
+    """
+    Walk a directory tree in sorted order, top down.
+
+    :returns: a list of (<path>, <archive name>) tuples
+    """
+    entries = [(top, arcname)]
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, top)
+        if rel == '.':
+            base = arcname
+        else:
+            base = '%s/%s' % (arcname, rel.replace(os.sep, '/'))
+        for name in sorted(dirnames + filenames):
+            entries.append((os.path.join(dirpath, name),
+                            '%s/%s' % (base, name)))
+    return entries
+
+
+class Tee(object):
+    """
+    Write to several file-like objects.
+    """
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def write(self, data):
+        for output in self.outputs:
+            output.write(data)
+        return len(data)
+
+
 class Compressor(object):
 
     def __init__(self, builder, suffix, command):
         self.builder = builder
         self.suffix = suffix
         self.command = command
-        self.md5sum = builder.get_bin_path('md5sum')
 
-    def compress(self, filename, destdir):
+    def open(self, filename, destdir):
         """
-        Create a compressed archive and also create an md5 checksum file
-        if the md5sum program is available.
+        Start a compressed archive.
         """
-        builder = self.builder
-        suffix = self.suffix
-        command = self.command
+        output = '%s/%s.%s' % (destdir, filename, self.suffix)
+        return CompressedOutput(self.command + ['-c'], output,
+                                self.builder.timer)
 
-        output = '%(destdir)s/%(filename)s.%(suffix)s' % locals()
-        builder.shell('%(command)s < %(filename)s > %(output)s' % locals())
-        builder.results['files'].append(output)
 
-        md5sum = self.md5sum
-        if md5sum:
-            output_md5 = '%(output)s.md5' % locals()
-            builder.shell('%(md5sum)s %(output)s > %(output_md5)s' % locals())
-            builder.results['files'].append(output_md5)
+class CompressedOutput(object):
+    """
+    A compression process writing a compressed archive file.
+
+    The data written is piped to the compression program. The compressed
+    output is written to the archive file by a reader thread, which also
+    computes the md5 and sha256 checksums, so the archive is not read
+    again.
+    """
+    def __init__(self, command, output, timer=None):
+        log.info('Running: %s > %s', ' '.join(command), output)
+        self.command = command
+        self.output = output
+        self.timer = timer
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.error = None
+        self.start = time.time()
+        self.fout = open(output, 'wb')
+        self.ferr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=self.ferr)
+        self.reader = threading.Thread(target=self._read)
+        self.reader.start()
+
+    def _read(self):
+        for chunk in iter(lambda: self.proc.stdout.read(CHUNK_SIZE), b''):
+            self.fout.write(chunk)
+            self.md5.update(chunk)
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+
+    def write(self, data):
+        """
+        Write to the compression program. A write error is raised when the
+        archive is closed, so the other archives are still completed.
+        """
+        if self.error:
+            return
+        try:
+            self.proc.stdin.write(data)
+        except (IOError, OSError) as e:
+            self.error = e  # The compression program exited early.
+
+    def close(self):
+        """
+        Finish the archive and write the checksum files.
+
+        :returns: a dictionary with the archive size, time, and checksums
+        """
+        try:
+            self.proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.reader.join()
+        rc = self.proc.wait()
+        self.fout.close()
+        seconds = time.time() - self.start
+        if self.timer:
+            self.timer.record(self.command, seconds, rc)
+        self.ferr.seek(0)
+        err = self.ferr.read()
+        self.ferr.close()
+        if rc != 0:
+            raise RuntimeError('%s failed: rc=%d, %s' %
+                               (' '.join(self.command), rc,
+                                err.decode().strip()))
+        if self.error:
+            raise RuntimeError('%s failed: %s' %
+                               (' '.join(self.command), self.error))
+
+        # Use the md5sum/sha256sum output format.
+        output = self.output
+        for name, h in (('md5', self.md5), ('sha256', self.sha256)):
+            with open('%s.%s' % (output, name), 'w') as f:
+                f.write('%s  %s\n' % (h.hexdigest(), output))
+
+        return {
+            'file': output,
+            'compressor': self.command[0],
+            'size': self.size,
+            'seconds': round(seconds, 2),
+            'md5': self.md5.hexdigest(),
+            'sha256': self.sha256.hexdigest(),
+        }
 
 
 class SolarisSourceDistBuilder(SourceDistBuilder):
@@ -299,17 +660,25 @@ class SolarisSourceDistBuilder(SourceDistBuilder):
             return name
 
 
+@profiled
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             sdist=dict(type='path', required=True),
             topdir=dict(type='path', default='openafs'),
+            cachedir=dict(type='path',
+                          default='~/.cache/openafs_build_sdist'),
             # bin paths
             git=dict(type='path', default=None),
             tar=dict(type='path', default=None),
             gzip=dict(type='path', default=None),
             bzip2=dict(type='path', default=None),
-            md5sum=dict(type='path', default=None),
+            xz=dict(type='path', default=None),
+            md5sum=dict(type='path', default=None),  # Not used.
+            formats=dict(type='list', elements='str',
+                         choices=['gz', 'bz2', 'xz'],
+                         default=['gz', 'bz2']),
+            timings=dict(type='bool', default=False),
         ),
         supports_check_mode=False,
     )
@@ -17,10 +17,15 @@ short_description: Detect installation paths from package installation.
 description:
 
   - Detect the paths of installed OpenAFS programs and detect configuration
-    directories from installed man pages.
+    directories from the canonical paths in the installed C(afs/dirpath.h)
+    header, when available, or from the installed man pages.
 
   - Supports rpm and deb packaging.
 
+  - The results are cached in the C(/etc/ansible/facts.d) directory, keyed by
+    the state of the package database, and the cached results are returned
+    until packages are installed, upgraded, or removed.
+
 options:
   package_mgr_type:
     description:
@@ -28,6 +33,21 @@ options:
       - Supported values are C(rpm) and C(apt).
     default: autodetect
 
+  cache:
+    description:
+      - Use the cached results when the package database is unchanged.
+    type: bool
+    default: true
+
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -45,19 +65,76 @@ EXAMPLES = r'''
 
 import errno                # noqa: E402
 import gzip                 # noqa: E402
+import json                 # noqa: E402
 import os                   # noqa: E402
 import re                   # noqa: E402
 import stat                 # noqa: E402
 
+from multiprocessing.pool import ThreadPool  # noqa: E402
+
 from ansible.module_utils.basic import AnsibleModule   # noqa: E402
 from ansible.module_utils.facts.system.distribution import DistributionFactCollector  # noqa: E402, E501
 from ansible.module_utils.facts.system.pkg_mgr import PkgMgrFactCollector  # noqa: E402, E501
 
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
 
+DPKG_INFO = '/var/lib/dpkg/info'
+DPKG_STATUS = '/var/lib/dpkg/status'
+FACTS_DIR = '/etc/ansible/facts.d'
+CACHE = os.path.join(FACTS_DIR, 'openafs_install_paths.json')
+CACHE_VERSION = 1
+RPMDB_DIRS = ('/var/lib/rpm', '/usr/lib/sysimage/rpm')
+RPMDB_FILES = ('Packages', 'Packages.db', 'rpmdb.sqlite', 'rpmdb.sqlite-wal')
+
+# Configuration directories and the man pages in which they are described.
+MANPAGE_DIRS = [
+    ('afsbosconfigdir', 'bosserver',
+     r'create a file named (\S+)/BosConfig\.new'),
+    ('afsconfdir', 'KeyFile',
+     r'The file must reside in the (\S+) directory'),
+    ('afsdbdir', 'vldb.DB0',
+     r'reside in the (\S+) directory'),
+    ('afslocaldir', 'NetInfo',
+     r'The server NetInfo file, if present in the (\S+) directory'),
+    ('afslogsdir', 'FileLog',
+     r'file does not already exist in the (\S+) directory'),
+    ('afssrvbindir', 'fileserver',
+     r'its binary file is located in the (\S+) directory'),
+    ('viceetcdir', 'cacheinfo',
+     r'must reside in the (\S+) directory'),
+]
+
+# Configuration directories defined in the installed afs/dirpath.h header.
+# The configured paths are the string literals of the canonical path macros;
+# the AFSDIR_SERVER_*_DIRPATH macros are getDirPath() calls.
+DIRPATH_MACROS = {
+    'AFSDIR_CANONICAL_SERVER_BOSCONFIG_DIRPATH': 'afsbosconfigdir',
+    'AFSDIR_CANONICAL_SERVER_ETC_DIRPATH': 'afsconfdir',
+    'AFSDIR_CANONICAL_SERVER_DB_DIRPATH': 'afsdbdir',
+    'AFSDIR_CANONICAL_SERVER_LOCAL_DIRPATH': 'afslocaldir',
+    'AFSDIR_CANONICAL_SERVER_LOGS_DIRPATH': 'afslogsdir',
+    'AFSDIR_CANONICAL_SERVER_BIN_DIRPATH': 'afssrvbindir',
+    'AFSDIR_CANONICAL_CLIENT_ETC_DIRPATH': 'viceetcdir',
+}
+DIRPATH_DEFINE = re.compile(
+    r'#\s*define\s+(AFSDIR_CANONICAL_\w+)\s+"(/[^"]*)"\s*(/\*.*)?$')
+
+# Paths which are never programs; data files under share and include, and
+# libraries and headers. Programs may be installed in any other directory,
+# for example /usr/vice/etc/afsd in the Transarc layout.
+NOT_PROGRAM = re.compile(
+    r'/(share|include)/|\.(so(\.\d+){0,3}|a|la|h)$')
+
+# troff escapes removed from man pages, and whitespace runs, which are
+# replaced by a single space.
+TROFF_NOISE = re.compile(r'\\&|\\f.|\s+')
+SEARCH_WINDOW = 512
+
 
 def prefix_keys(prefix, facts):
     """
@@ -72,6 +149,13 @@ def prefix_keys(prefix, facts):
     return new_facts
 
 
+def normalize_noise(m):
+    """
+    Replace whitespace runs with a space and remove troff escapes.
+    """
+    return ' ' if m.group(0)[0].isspace() else ''
+
+
 def get_system_pkg_mgr(module):
     """
     Run the Ansible PkgMgrFactCollector to find the ansible_pkg_mgr on this
@@ -123,31 +207,109 @@ class InstallationFactCollector(object):
 
     def __init__(self, module):
         self.module = module
+        self.bins_examined = 0
 
     def collect(self):
         """
         Collect information about the OpenAFS installation on this system.
+
+        The package facts are cached and reused while the package database
+        fingerprint is unchanged. The cacheinfo is not package data, so it is
+        always read.
+        """
+        fingerprint = None
+        if self.module.params.get('cache', True):
+            fingerprint = self.fingerprint()
+        facts = self.load_cache(fingerprint)
+        if facts:
+            log.info('Using cached installation facts.')
+            facts['cached'] = True
+        else:
+            packages = self.collect_package_names()
+            paths = self.collect_all_paths(packages)
+            bins = self.collect_bins(paths)
+            manpages = self.collect_manpages(paths)
+            dirs = self.collect_dirs(manpages, paths)
+            facts = {
+                'packages': sorted(list(packages)),
+                'paths': sorted(list(paths)),
+                'bins': bins,
+                'bins_examined': self.bins_examined,
+                'manpages': manpages,
+                'dirs': dirs,
+            }
+            self.save_cache(fingerprint, facts)
+            facts['cached'] = False
+        facts['cacheinfo'] = self.collect_cacheinfo(facts['dirs'])
+        return facts
+
+    def fingerprint(self):
+        """
+        Return a cheap fingerprint of the package database state, or None if
+        the package database state cannot be determined. Subclasses provide
+        the package database files to be checked.
+        """
+        stamps = []
+        for path in self.package_db_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps.append([path, st.st_size, st.st_mtime])
+        if not stamps:
+            return None
+        return {'collector': self.__class__.__name__, 'stamps': stamps}
+
+    def package_db_files(self):
+        """
+        List the files which change when packages are installed or removed.
+        """
+        return []
+
+    def load_cache(self, fingerprint):
+        """
+        Return the cached facts if the fingerprint matches, otherwise None.
+        """
+        if not fingerprint:
+            return None
+        try:
+            with open(CACHE) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cache.get('version') != CACHE_VERSION or \
+           cache.get('fingerprint') != fingerprint:
+            return None
+        return cache.get('facts')
+
+    def save_cache(self, fingerprint, facts):
         """
-        packages = self.collect_package_names()
-        paths = self.collect_all_paths(packages)
-        bins = self.collect_bins(paths)
-        manpages = self.collect_manpages(paths)
-        dirs = self.collect_dirs(manpages)
-        cacheinfo = self.collect_cacheinfo(dirs)
-
-        facts = {
-            'packages': sorted(list(packages)),
-            'paths': sorted(list(paths)),
-            'bins': bins,
-            'manpages': manpages,
-            'dirs': dirs,
-            'cacheinfo': cacheinfo,
+        Save the facts and the package database fingerprint. Failure to
+        save the cache is not fatal.
+        """
+        if not fingerprint:
+            return
+        cache = {
+            'version': CACHE_VERSION,
+            'fingerprint': fingerprint,
+            'facts': facts,
         }
-        return facts
+        tmp = CACHE + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(CACHE)):
+                os.makedirs(os.path.dirname(CACHE))
+            with open(tmp, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp, CACHE)
+        except (IOError, OSError) as e:
+            log.warning('Unable to save cache %s: %s', CACHE, e)
 
     def collect_all_paths(self, packages):
         """
         Find all the paths for one or more installed packages.
+
+        Subclasses may override this method to list the files of all the
+        packages with one query.
         """
         paths = set()
         for package in packages:
@@ -157,16 +319,37 @@ class InstallationFactCollector(object):
     def collect_bins(self, paths):
         """
         Find the installed program files.
+
+        Data files, headers, and libraries are skipped without a stat. The
+        remaining candidates are grouped by directory, and each directory is
+        listed once, so only the paths which exist are examined.
         """
         canonical_name = {
             'pagsh.openafs': 'pagsh',
         }
-        bins = {}
+        candidates = {}
         for path in paths:
-            if self.is_bin(path):
-                basename = os.path.basename(path)
-                name = canonical_name.get(basename, basename)
-                bins[name] = path
+            if not NOT_PROGRAM.search(path):
+                dirname, basename = os.path.split(path)
+                candidates.setdefault(dirname, set()).add(basename)
+
+        bins = {}
+        examined = 0
+        for dirname in sorted(candidates):
+            try:
+                names = os.listdir(dirname)
+            except OSError as e:  # OSError works in both PY2 and PY3.
+                if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                raise e
+            for name in sorted(candidates[dirname].intersection(names)):
+                examined += 1
+                path = os.path.join(dirname, name)
+                if self.is_x(path):
+                    bins[canonical_name.get(name, name)] = path
+        log.info('Examined %d of %d paths for programs.',
+                 examined, len(paths))
+        self.bins_examined = examined
         return bins
 
     def collect_manpages(self, paths):
@@ -181,53 +364,55 @@ class InstallationFactCollector(object):
                 manpages[name] = path
         return manpages
 
-    def collect_dirs(self, manpages):
+    def collect_dirs(self, manpages, paths=None):
         """
         Find the configuration directories.
 
-        This is a hacky workaround to find the OpenAFS configuration
-        directories, since that is a build time option, but we currently do not
-        have a way to query the binaries to show the embedded configuration
-        directories.  For now, try to find them in the man pages, which
-        fortunately do not change often.
+        The configuration directories are a build time option. They are read
+        from the canonical paths in the afs/dirpath.h header when it is
+        installed (with the development package). Otherwise, this is a hacky
+        workaround to find the OpenAFS configuration directories, since we
+        currently do not have a way to query the binaries to show the
+        embedded configuration directories.  Try to find them in the man
+        pages, which fortunately do not change often. The man pages are
+        searched concurrently.
         """
         dirs = {}
+        for path in sorted(paths or []):
+            if path.endswith('/afs/dirpath.h'):
+                dirs.update(self.read_dirpath(path))
+
+        searches = []
+        for name, page, regex in MANPAGE_DIRS:
+            if name not in dirs and manpages.get(page):
+                searches.append((name, manpages[page], regex))
+        if searches:
+            pool = ThreadPool(len(searches))
+            try:
+                found = pool.map(
+                    lambda s: (s[0], self.search_page(s[1], s[2])), searches)
+            finally:
+                pool.close()
+                pool.join()
+            dirs.update(found)
+        return dirs
 
-        path = manpages.get('bosserver')
-        if path:
-            regex = r'create a file named (\S+)/BosConfig\.new'
-            dirs['afsbosconfigdir'] = self.search_page(path, regex)
-
-        path = manpages.get('KeyFile')
-        if path:
-            regex = r'The file must reside in the (\S+) directory'
-            dirs['afsconfdir'] = self.search_page(path, regex)
-
-        path = manpages.get('vldb.DB0')
-        if path:
-            regex = r'reside in the (\S+) directory'
-            dirs['afsdbdir'] = self.search_page(path, regex)
-
-        path = manpages.get('NetInfo')
-        if path:
-            regex = r'The server NetInfo file, if present in the (\S+) directory'  # noqa: E501
-            dirs['afslocaldir'] = self.search_page(path, regex)
-
-        path = manpages.get('FileLog')
-        if path:
-            regex = r'file does not already exist in the (\S+) directory'
-            dirs['afslogsdir'] = self.search_page(path, regex)
-
-        path = manpages.get('fileserver')
-        if path:
-            regex = r'its binary file is located in the (\S+) directory'
-            dirs['afssrvbindir'] = self.search_page(path, regex)
-
-        path = manpages.get('cacheinfo')
-        if path:
-            regex = r'must reside in the (\S+) directory'
-            dirs['viceetcdir'] = self.search_page(path, regex)
-
+    def read_dirpath(self, path):
+        """
+        Read the configuration directories from the afs/dirpath.h header.
+        Only the canonical paths defined as a single string literal are
+        read.
+        """
+        dirs = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    m = DIRPATH_DEFINE.match(line)
+                    if m and m.group(1) in DIRPATH_MACROS:
+                        dirs[DIRPATH_MACROS[m.group(1)]] = m.group(2)
+        except (IOError, OSError) as e:
+            log.warning('Unable to read %s: %s', path, e)
+        log.debug('Directories in %s: %s', path, dirs)
         return dirs
 
     def collect_cacheinfo(self, dirs):
@@ -255,22 +440,39 @@ class InstallationFactCollector(object):
             cacheinfo = None
         return cacheinfo
 
+    def open_page(self, path):
+        """
+        Open a man page.
+        """
+        return gzip.open(path)
+
     def search_page(self, path, pattern):
         """
         Search an OpenAFS man page for a directory.
+
+        The man page is read a line at a time and troff escapes are removed
+        as it is read, until the first match is found. Whitespace runs,
+        including line breaks, are replaced with single spaces, so the
+        pattern may span lines.
         """
+        regex = re.compile(pattern)
+        text = ''
         # Note: Avoiding a context manager here to support ancient versions
         #       of Python found on RHEL/CentOS 6.
-        z = gzip.open(path)
-        content = z.read().decode()
-        z.close()
-        content = re.sub(r'\\&', '', content)
-        content = re.sub(r'\\f.', '', content)
-        content = re.sub(r'\s+', ' ', content)
-        m = re.search(pattern, content)
-        if not m:
-            raise ValueError('Failed to find directory in %s.' % path)
-        return m.group(1)
+        f = self.open_page(path)
+        try:
+            for line in f:
+                line = line.decode('utf-8', 'replace')
+                line = TROFF_NOISE.sub(normalize_noise, line)
+                if text.endswith(' ') and line.startswith(' '):
+                    line = line[1:]
+                text = text[-SEARCH_WINDOW:] + line
+                m = regex.search(text)
+                if m:
+                    return m.group(1)
+        finally:
+            f.close()
+        raise ValueError('Failed to find directory in %s.' % path)
 
     def is_bin(self, path):
         """
@@ -307,6 +509,18 @@ class RpmInstallationFactCollector(InstallationFactCollector):
         super(RpmInstallationFactCollector, self).__init__(module)
         self.rpm = module.get_bin_path('rpm', required=True)
 
+    def package_db_files(self):
+        """
+        List the rpm database files. The rpm database directory is
+        /usr/lib/sysimage/rpm on newer systems. Lock and shared memory files
+        are not included, since these change when the database is read.
+        """
+        files = []
+        for dbpath in RPMDB_DIRS:
+            for name in RPMDB_FILES:
+                files.append(os.path.join(dbpath, name))
+        return files
+
     def collect_package_names(self):
         """
         Find the names of the OpenAFS packages installed on this system.
@@ -318,11 +532,30 @@ class RpmInstallationFactCollector(InstallationFactCollector):
             self.module.fail_json(msg='rpm query failed', rc=rc, err=err)
         return set(out.splitlines())
 
+    def collect_all_paths(self, packages):
+        """
+        Find all the paths for one or more installed packages.
+
+        The files of all the packages are listed with a single rpm query.
+        A query format is used instead of --list so packages without files
+        do not add a '(contains no files)' line to the output.
+        """
+        if not packages:
+            return set()
+        return self.query_paths(sorted(packages))
+
     def collect_paths(self, package):
         """
         Find the paths of the files and directories installed by a package.
         """
-        args = [self.rpm, '--query', '--list', package]
+        return self.query_paths([package])
+
+    def query_paths(self, packages):
+        """
+        Query the paths of the files and directories installed by packages.
+        """
+        args = [self.rpm, '--query', '--queryformat', '[%{FILENAMES}\\n]']
+        args.extend(packages)
         rc, out, err = self.module.run_command(args)
         if rc != 0:
             log.error('rpm query failed', err)
@@ -343,6 +576,10 @@ class DebianInstallationFactCollector(InstallationFactCollector):
     def __init__(self, module):
         super(DebianInstallationFactCollector, self).__init__(module)
         self.dpkg_query = module.get_bin_path('dpkg-query', required=True)
+        self.dpkg_lists = None
+
+    def package_db_files(self):
+        return [DPKG_STATUS]
 
     def collect_package_names(self):
         """
@@ -361,20 +598,74 @@ class DebianInstallationFactCollector(InstallationFactCollector):
                 packages.add(package)
         return packages
 
+    def collect_all_paths(self, packages):
+        """
+        Find all the paths for one or more installed packages.
+
+        The file lists are read directly from the dpkg database. The file
+        lists of any packages not found there are listed with a single
+        dpkg-query.
+        """
+        paths = set()
+        missing = []
+        for package in sorted(packages):
+            lines = self.read_file_list(package)
+            if lines is None:
+                missing.append(package)
+            else:
+                paths.update(self.filter_paths(lines))
+        if missing:
+            paths.update(self.query_paths(missing))
+        return paths
+
     def collect_paths(self, package):
         """
         Find the paths of the files and directories installed by a package.
         """
-        args = [self.dpkg_query, '--no-pager', '--listfiles', package]
+        return self.query_paths([package])
+
+    def read_file_list(self, package):
+        """
+        Read the list of files of an installed package from the dpkg
+        database. Multi-arch packages are listed as <package>:<arch>.
+
+        :returns: the lines of the file list, or None if not found
+        """
+        names = [package + '.list']
+        if ':' not in package:
+            if self.dpkg_lists is None:
+                try:
+                    self.dpkg_lists = [n for n in os.listdir(DPKG_INFO)
+                                       if ':' in n and n.endswith('.list')]
+                except OSError:
+                    self.dpkg_lists = []
+            prefix = package + ':'
+            names.extend(n for n in self.dpkg_lists if n.startswith(prefix))
+        for name in names:
+            try:
+                with open(os.path.join(DPKG_INFO, name)) as f:
+                    return f.read().splitlines()
+            except IOError:
+                continue
+        return None
+
+    def query_paths(self, packages):
+        """
+        Query the paths of the files and directories installed by packages.
+        """
+        args = [self.dpkg_query, '--no-pager', '--listfiles'] + packages
         rc, out, err = self.module.run_command(args)
         if rc != 0:
             log.error('dpkg-query failed', err)
             self.module.fail_json(msg='dpkg-query failed', rc=rc, err=err)
+        return self.filter_paths(out.splitlines())
+
+    def filter_paths(self, lines):
         paths = set()
-        for path in out.splitlines():
-            if path != '/.':      # Omit root directory
+        for path in lines:
+            if path and path != '/.':      # Omit root directory
                 paths.add(path)
-        return set(paths)
+        return paths
 
 
 class SolarisInstallationFactCollector(InstallationFactCollector):
@@ -433,28 +724,24 @@ class SolarisInstallationFactCollector(InstallationFactCollector):
                 manpages[name] = path
         return manpages
 
-    def search_page(self, path, pattern):
+    def open_page(self, path):
         """
-        Search an OpenAFS man page for a directory.
+        Open a man page.
         """
-        with open(path) as f:
-            content = f.read()
-        content = re.sub(r'\\&', '', content)
-        content = re.sub(r'\\f.', '', content)
-        content = re.sub(r'\s+', ' ', content)
-        m = re.search(pattern, content)
-        if not m:
-            raise ValueError('Failed to find directory in %s.' % path)
-        return m.group(1)
+        return open(path, 'rb')
 
 
+@profiled
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             package_manager_type=dict(type='str', default=None),
+            cache=dict(type='bool', default=True),
+            timings=dict(type='bool', default=False),
         ),
         supports_check_mode=False,
     )
+    CommandTimer(module).attach()
     log.info('Starting %s', module_name)
 
     collector = InstallationFactCollector(module)
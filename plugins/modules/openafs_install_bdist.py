@@ -32,6 +32,39 @@ options:
       List of file patterns to be excluded.
     type: list
 
+  staged:
+    description: >
+      Install the new and changed files atomically. The files are first
+      staged next to the installed files, on the same filesystem, then
+      renamed into place, shared libraries first, then kernel modules, then
+      programs and then the remaining files. The previous files are kept as
+      hard links, and are listed in a journal, until all of the files are
+      in place. The previous installation is restored if the installation
+      fails or was interrupted.
+    type: bool
+    default: false
+
+  manifest:
+    description: >
+      Save a manifest of the installed files, with the size and
+      modification time of each file, in the local facts directory.
+      On the next run, the installation is skipped when the manifest of the
+      installation file tree matches the saved manifest, without comparing
+      each of the installed files. Set to false to always compare the
+      installed files, for example to restore files which were removed
+      after the installation.
+    type: bool
+    default: true
+
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -48,6 +81,12 @@ EXAMPLES = r'''
   openafs_contrib.openafs.openafs_install:
     path: /tmp/openafs/bdist
     exclude: /usr/vice/etc/*
+
+- name: Upgrade OpenAFS binaries on a running server
+  become: yes
+  openafs_contrib.openafs.openafs_install:
+    path: /tmp/openafs/bdist
+    staged: yes
 '''
 
 RETURN = r'''
@@ -86,21 +125,31 @@ logfiles:
   type: list
   sample:
     - /tmp/logs/install.log
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
 import filecmp            # noqa: E402
-import fnmatch            # noqa: E402
 import glob               # noqa: E402
 import json               # noqa: E402
 import os                 # noqa: E402
 import platform           # noqa: E402
-import pprint             # noqa: E402
 import re                 # noqa: E402
 import shutil             # noqa: E402
 import stat               # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.treesync import is_same, stage_file, sync_tree, walk_tree  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
@@ -114,66 +163,42 @@ TRANSARC_INSTALL_DIRS = {
     'viceetcdir': '/usr/vice/etc',
 }
 
-
-class CopyTreeError(Exception):
-    pass
+FACTS_DIR = '/etc/ansible/facts.d'
+JOURNAL = os.path.join(FACTS_DIR, 'openafs_install_journal.json')
+MANIFEST = os.path.join(FACTS_DIR, 'openafs_install_manifest.json')
 
 
 def copy_tree(src, dst, exclude=None):
-    """Copy an entire directory tree.
-
-    Creates destination if needed. Clobbers any existing files/symlinks.
+    """Incrementally copy an entire directory tree.
 
     :arg src: directory to copy from. must already exist
     :arg dst: directory to copy to. created if not already present
     :arg exclude: list of patterns (glob notation) to exclude
     :returns: a list of tuples of the files/symlinks copied and skipped
     """
-    files = []  # list of (<path>, <changed>, <executable>) tuples
-    if exclude is None:
-        exclude = []
-
-    def is_exclusion(fn):
-        for pattern in exclude:
-            if fnmatch.fnmatch(fn, pattern):
-                return True
-        return False
-
-    def is_same(src, dst):
-        if os.path.exists(src) and os.path.exists(dst):
-            return filecmp.cmp(src, dst, shallow=True)
-        return False
-
-    if not os.path.isdir(src):
-        raise CopyTreeError("Cannot copy tree '%s': not a directory." % src)
-    try:
-        names = os.listdir(src)
-    except os.error:
-        raise CopyTreeError("Error listing files in '%s'." % src)
-    if not os.path.isdir(dst):
-        os.makedirs(dst)
-    for n in names:
-        src_name = os.path.join(src, n)
-        dst_name = os.path.join(dst, n)
-        if is_exclusion(dst_name):
-            log.info("Excluding '%s'.", dst_name)
-        elif os.path.isdir(src_name):
-            files.extend(copy_tree(src_name, dst_name, exclude))
-        elif is_same(src_name, dst_name):
-            log.info("Skipping '%s'; unchanged.", dst_name)
-            files.append((dst_name, False))
-        elif os.path.islink(src_name):
-            link_dest = os.readlink(src_name)
-            if os.path.exists(dst_name):
-                os.remove(dst_name)
-            log.debug("Creating symlink '%s'.", dst_name)
-            os.symlink(link_dest, dst_name)
-            files.append((dst_name, True))
-        else:
-            log.debug("Copying '%s' to '%s'.", src_name, dst_name)
-            shutil.copy2(src_name, dst_name)
-            files.append((dst_name, True))
-    return files
+    return sync_tree(src, dst, exclude=exclude, report_unchanged=True,
+                     log=log)
+
+
+def is_shared_library(fn):
+    return re.match(r'^lib.*\.so[.\d]*$', os.path.basename(fn)) is not None
+
+
+def install_order(fn):
+    """
+    Sort key to install files in dependency order; shared libraries first,
+    then kernel modules, then programs, then everything else.
+    """
+    if is_shared_library(fn):
+        rank = 0
+    elif fn.endswith('.ko') or re.match(r'^libafs.*\.o$',
+                                        os.path.basename(fn)):
+        rank = 1
+    elif os.path.basename(os.path.dirname(fn)) in ('bin', 'sbin', 'libexec'):
+        rank = 2
+    else:
+        rank = 3
+    return (rank, fn)
 
 
 def get_platform_subclass(cls):
@@ -200,6 +225,7 @@ class BinaryDistInstaller(object):
         self.kmods = []
         self.bins = {}
         self.dirs = {}
+        self.manifest = {}
 
     def install(self):
         """
@@ -214,14 +240,15 @@ class BinaryDistInstaller(object):
         if self.transarc_dist:
             log.info('Installing files from %s to legacy paths.',
                      self.transarc_dist)
-            files = self.install_transarc(self.transarc_dist, exclude)
+            trees = self.transarc_trees(self.transarc_dist)
             self.dirs = TRANSARC_INSTALL_DIRS
-            self.collect_bins(files)
         else:
             log.info('Installing files from %s to modern paths.', path)
-            files = copy_tree(path, '/', exclude)
+            trees = [(path, '/')]
             self.collect_dirs(path)
-            self.collect_bins(files)
+
+        files = self.install_files(path, trees, exclude)
+        self.collect_bins(files)
 
         self.install_shared_libraries(files)
         self.install_kernel_module(files)
@@ -236,12 +263,44 @@ class BinaryDistInstaller(object):
         )
         return results
 
-    def install_transarc(self, destdir, exclude):
+    def install_files(self, path, trees, exclude):
+        """
+        Install the files of the installation file trees.
+
+        An interrupted staged install is recovered before the saved manifest
+        is checked. The saved manifest is removed before any file is copied
+        and written again only after all of the files are installed, so a
+        failed or interrupted installation is never taken to be up to date.
+
+        :returns: a list of (<path>, <changed>) tuples of the installed files
         """
-        Install a Transarc-style distribution to the lecacy paths.
+        self.recover_staged()
+
+        source = None
+        if self.module.params['manifest']:
+            source = self.source_manifest(trees, exclude)
+            self.manifest = self.load_manifest()
+        if source and self.manifest.get('files') == source:
+            log.info('Installation is up to date with %s.', path)
+            return [(fn, False) for fn in sorted(source)]
+
+        self.remove_manifest()
+        if self.module.params['staged']:
+            files = self.install_staged(trees, exclude)
+        else:
+            files = []
+            for src, dst in trees:
+                files.extend(copy_tree(src, dst, exclude))
+        if source is not None:
+            self.save_manifest(source)
+        return files
+
+    def transarc_trees(self, destdir):
+        """
+        Map the Transarc-style distribution directories to the lecacy paths.
         """
         components = self.module.params['components']
-        files = []
+        trees = []
         if 'common' in components:
             for d in ('bin', 'etc', 'include', 'lib', 'man'):
                 src = '%s/%s' % (destdir, d)
@@ -249,17 +308,188 @@ class BinaryDistInstaller(object):
                     dst = '/usr/bin'  # Put misc programs in the PATH.
                 else:
                     dst = '/%s' % d
-                files.extend(copy_tree(src, dst, exclude))
+                trees.append((src, dst))
         if 'server' in components:
             src = '%s/%s' % (destdir, 'root.server')
-            dst = '/'
-            files.extend(copy_tree(src, dst, exclude))
+            trees.append((src, '/'))
         if 'client' in components:
             src = '%s/%s' % (destdir, 'root.client')
-            dst = '/'
-            files.extend(copy_tree(src, dst, exclude))
+            trees.append((src, '/'))
+        return trees
+
+    def source_manifest(self, trees, exclude):
+        """
+        Describe the files to be installed.
+
+        Only the installation file tree is read; the installed files are
+        not examined.
+
+        :returns: a dictionary of installation path to [source path, size,
+                  modification time] lists.
+        """
+        files = {}
+        for src, dst in trees:
+            for s, d, names in walk_tree(src, dst, exclude, log):
+                for n in names:
+                    s_name = os.path.join(s, n)
+                    st = os.lstat(s_name)
+                    files[os.path.join(d, n)] = \
+                        [s_name, st.st_size, st.st_mtime_ns]
+        return files
+
+    def load_manifest(self):
+        """
+        Read the manifest saved by the previous installation.
+        """
+        try:
+            with open(MANIFEST) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if manifest.get('version') != 1:
+            return {}
+        return manifest
+
+    def save_manifest(self, source):
+        """
+        Save the manifest of the installed files.
+        """
+        self.manifest = {'version': 1, 'files': source}
+        dirname = os.path.dirname(MANIFEST)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = MANIFEST + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+        os.rename(tmp, MANIFEST)
+        log.info('Wrote manifest %s.', MANIFEST)
+
+    def remove_manifest(self):
+        """
+        Remove the saved manifest before the installed files are changed.
+        """
+        if os.path.exists(MANIFEST):
+            log.info('Removing manifest %s.', MANIFEST)
+            os.remove(MANIFEST)
+
+    def install_staged(self, trees, exclude):
+        """
+        Atomically install the new and changed files.
+
+        The new files are staged in temporary files next to the installed
+        files, then renamed into place in dependency order. The previous
+        files are kept as hard links, and are recorded in a journal, until
+        all of the files are in place. The previous installation is restored
+        on failure, or by recover_staged() on the next run if the install
+        was interrupted.
+        """
+        files = []
+        changes = []
+        for src, dst in trees:
+            for s, d, names in walk_tree(src, dst, exclude, log):
+                if not os.path.isdir(d):
+                    os.makedirs(d)
+                for n in names:
+                    s_name = os.path.join(s, n)
+                    d_name = os.path.join(d, n)
+                    if is_same(s_name, d_name):
+                        log.info("Skipping '%s'; unchanged.", d_name)
+                        files.append((d_name, False))
+                    else:
+                        changes.append((s_name, d_name))
+        if not changes:
+            return files
+
+        changes.sort(key=lambda c: install_order(c[1]))
+        journal = []
+        try:
+            for s_name, d_name in changes:
+                log.debug("Staging '%s' for '%s'.", s_name, d_name)
+                journal.append({'path': d_name,
+                                'staged': stage_file(s_name, d_name)})
+            for entry in journal:
+                path = entry['path']
+                if os.path.lexists(path):
+                    entry['backup'] = entry['staged'] + '.orig'
+                    os.link(path, entry['backup'], follow_symlinks=False)
+            self.write_journal(journal)
+            for entry in journal:
+                log.debug("Installing '%s'.", entry['path'])
+                os.rename(entry['staged'], entry['path'])
+                entry['installed'] = True
+        except Exception as e:
+            log.error('Staged install failed: %s', e)
+            self.rollback(journal)
+            self.module.fail_json(msg='Staged install failed; previous files '
+                                      'restored: %s' % e)
+
+        for entry in journal:
+            if 'backup' in entry:
+                os.remove(entry['backup'])
+        os.remove(JOURNAL)
+        files.extend([(d_name, True) for s_name, d_name in changes])
         return files
 
+    def write_journal(self, journal):
+        """
+        Save the rollback journal before files are replaced.
+        """
+        dirname = os.path.dirname(JOURNAL)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = JOURNAL + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(journal, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, JOURNAL)
+
+    def rollback(self, journal):
+        """
+        Restore the previous files recorded in the journal.
+
+        The backups are hard links to the previous files, so they are
+        restored as is, including any local changes to the previous files.
+        """
+        for entry in reversed(journal):
+            path = entry['path']
+            staged = entry.get('staged')
+            backup = entry.get('backup')
+            if staged and os.path.lexists(staged):
+                os.remove(staged)
+            if backup and os.path.lexists(backup):
+                if os.path.lexists(path) and \
+                   os.path.samestat(os.lstat(path), os.lstat(backup)):
+                    os.remove(backup)  # Not replaced.
+                else:
+                    log.info("Restoring '%s'.", path)
+                    os.rename(backup, path)
+            elif entry.get('installed') and os.path.lexists(path):
+                log.info("Removing '%s'.", path)
+                os.remove(path)
+        if os.path.exists(JOURNAL):
+            os.remove(JOURNAL)
+
+    def recover_staged(self):
+        """
+        Restore the previous installation if a staged install was
+        interrupted.
+        """
+        if not os.path.exists(JOURNAL):
+            return
+        log.warning('Recovering from interrupted install; journal %s',
+                    JOURNAL)
+        with open(JOURNAL) as f:
+            journal = json.load(f)
+        # Files are installed in journal order; a staged file which is no
+        # longer present was renamed into place.
+        for entry in journal:
+            if not os.path.lexists(entry['staged']):
+                entry['installed'] = True
+        self.rollback(journal)
+        self.remove_manifest()
+        self.changed = True
+
     def detect_transarc_dist(self, path, sysname=None):
         """
         Search for a legacy dest directory in the binary distribution. The
@@ -294,7 +524,7 @@ class BinaryDistInstaller(object):
             log.info("Reading metadata file '%s'.", filename)
             with open(filename) as f:
                 build_info = json.load(f)
-            log.info("build_info=%s", pprint.pformat(build_info))
+            log.info("build_info=%s", pretty(build_info))
             dirs = build_info.get('dirs', {})
         self.dirs = dirs
 
@@ -308,7 +538,7 @@ class BinaryDistInstaller(object):
             fn, changed = f
             if changed:
                 self.changed = True
-            if re.match(r'^lib.*\.so[.\d]*$', os.path.basename(fn)):
+            if is_shared_library(fn):
                 continue  # Skip shared libraries.
             try:
                 mode = os.stat(fn).st_mode
@@ -327,6 +557,10 @@ class BinaryDistInstaller(object):
                 found.append(filename)
         return found
 
+    def find_changed(self, files, predicate):
+        """Find the list of changed files matching the predicate."""
+        return [fn for fn, changed in files if changed and predicate(fn)]
+
     def directories(self, filenames):
         """Find the set of directory names for the given filename paths."""
         dirs = set()
@@ -342,7 +576,7 @@ class LinuxBinaryDistInstaller(BinaryDistInstaller):
         return self.module.params['exclude']
 
     def install_shared_libraries(self, files):
-        if self.changed:
+        if self.find_changed(files, is_shared_library):
             log.info('Updating shared object cache.')
             libdirs = self.directories(self.find_by_suffix(files, '.so'))
             if libdirs and os.path.exists('/etc/ld.so.conf.d'):
@@ -354,7 +588,7 @@ class LinuxBinaryDistInstaller(BinaryDistInstaller):
 
     def install_kernel_module(self, files):
         self.kmods = self.find_by_suffix(files, '.ko')
-        if self.changed and self.kmods:
+        if self.find_changed(files, lambda fn: fn.endswith('.ko')):
             log.info('Updating module dependencies.')
             depmod = self.module.params['depmod']
             self.module.run_command([depmod, '-a'], check_rc=True)
@@ -367,7 +601,7 @@ class SolarisBinaryDistInstaller(BinaryDistInstaller):
         return self.module.params['exclude']
 
     def install_shared_libraries(self, files):
-        if self.changed:
+        if self.find_changed(files, is_shared_library):
             libdirs = self.directories(self.find_by_suffix(files, '.so'))
             for libdir in libdirs:
                 log.info('Configuring runtime link path: %s', libdir)
@@ -439,6 +673,7 @@ class FreeBSDBinaryDistInstaller(BinaryDistInstaller):
                      stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
 
 
+@profiled
 def main():
     log.info('Starting %s', module_name)
     module = AnsibleModule(
@@ -450,13 +685,17 @@ def main():
                             default=['common', 'client', 'server']),
             ldconfig=dict(type='path', default='/sbin/ldconfig'),
             depmod=dict(type='path', default='/sbin/depmod'),
+            staged=dict(type='bool', default=False),
+            manifest=dict(type='bool', default=True),
+            timings=dict(type='bool', default=False),
         ),
         supports_check_mode=False
     )
+    CommandTimer(module).attach()
 
     installer = BinaryDistInstaller(module)
     results = installer.install()
-    log.info('Results: %s', pprint.pformat(results))
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
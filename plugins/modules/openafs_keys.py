@@ -21,6 +21,13 @@ description:
   - This module uses C(asetkey) rather than the newer C(akeyconvert)
     since C(akeyconvert) is not available on all platforms yet.
 
+  - When the server configuration directory is known from the local facts
+    and the installed OpenAFS version supports extended keys, the
+    C(KeyFileExt) file is read and updated directly by the module, without
+    running C(asetkey) for each key. The new keys are written in one
+    atomic update. C(asetkey) is used when the C(KeyFileExt) file cannot be
+    read.
+
   - Before running this module, be sure C(asetkey) is installed
 
   - The C(asetkey) program requires the server C(CellServDB)
@@ -28,6 +35,9 @@ description:
 
   - A keytab file containing the service keys must be copied to the server.
 
+  - The C(asetkey) capabilities are saved in the local facts, so C(asetkey)
+    is not probed again until it is changed.
+
 options:
 
   state:
@@ -36,13 +46,17 @@ options:
     type: str
 
   keytab:
-    description: path to the keytab file on the remote node
-    required: true
+    description:
+      - path to the keytab file on the remote node
+      - Required unless I(keytabs) is specified.
+    required: false
     type: path
 
   cell:
-    description: AFS cell name
-    required: true
+    description:
+      - AFS cell name
+      - Required with I(keytab).
+    required: false
     type: str
 
   realm:
@@ -51,12 +65,35 @@ options:
     type: str
     default: uppercase of the cell name
 
+  keytabs:
+    description:
+      - List of keytabs to import in one pass, instead of I(keytab),
+        I(cell), and I(realm).
+      - Each item is a dictionary with the C(keytab) and C(cell) keys, and
+        an optional C(realm) key. A keytab file may be listed more than once
+        for different cells.
+      - The keys of all the items are added with one update of the key file.
+      - The module fails when the items have different keys for the same
+        kvno and enctype.
+    required: false
+    type: list
+    elements: dict
+
   asetkey:
     description: asetkey program path
     required: false
     type: path
     default: Search the local facts, search the path.
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -77,6 +114,17 @@ EXAMPLES = r'''
     state: present
     keytab: /usr/afs/etc/rxkad.keytab
     cell: example.com
+
+- name: Add service keys for several cells
+  become: yes
+  openafs_contrib.openafs.openafs_keys:
+    state: present
+    keytabs:
+      - keytab: /usr/afs/etc/rxkad.keytab
+        cell: example.com
+      - keytab: /usr/afs/etc/rxkad.keytab
+        cell: test.example.com
+        realm: EXAMPLE.COM
 '''
 
 RETURN = r'''
@@ -86,6 +134,12 @@ asetkey:
   returned: success
 #  sample: /usr/sbin/asetkey
 
+keyfile:
+  description: Path of the key file updated directly by the module.
+  type: path
+  returned: when the key file is updated directly
+#  sample: /usr/afs/etc/KeyFileExt
+
 have_extended_keys:
   description: Indicates if extended keys are supported.
   type: bool
@@ -125,24 +179,44 @@ imported:
 service_principal:
   description: kerberos service principal
   type: str
+  returned: success, when one keytab is imported
+
+service_principals:
+  description: kerberos service principals of the imported keys
+  type: list
   returned: success
 #  sample: "afs/example.com@EXAMPLE.COM"
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import FactsStore  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import lookup_facts  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.keyfile import KeyFileError  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.keyfile import KeyFileExt  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.keyfile import RXKAD_KRB5  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.kerberos import Keytab  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.kerberos import DES_ENCTYPES  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
 
 
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -152,24 +226,41 @@ def main():
     module = AnsibleModule(
             argument_spec=dict(
                 state=dict(type='str', choices=['present'], default='present'),
-                keytab=dict(type='path', required=True),
-                cell=dict(type='str', required=True),
+                keytab=dict(type='path', default=None),
+                cell=dict(type='str', default=None),
                 realm=dict(type='str', default=None),
+                keytabs=dict(type='list', elements='dict', default=None),
+                timings=dict(type='bool', default=False),
             ),
+            required_one_of=[('keytab', 'keytabs')],
+            mutually_exclusive=[('keytab', 'keytabs')],
+            required_together=[('keytab', 'cell')],
             supports_check_mode=False,
     )
+    CommandTimer(module).attach()
     log.info('Starting %s', module_name)
 
-    keytab = module.params['keytab']
-    cell = module.params['cell']
-    realm = module.params['realm']
-    if not realm:
-        realm = cell.upper()
+    # Build the list of (keytab, cell, realm) items to import.
+    items = []
+    if module.params['keytabs']:
+        for item in module.params['keytabs']:
+            if not item.get('keytab') or not item.get('cell'):
+                module.fail_json(msg='keytab and cell are required in '
+                                     'each keytabs item.', item=item)
+            items.append((os.path.expanduser(item['keytab']), item['cell'],
+                          item.get('realm') or item['cell'].upper()))
+    else:
+        cell = module.params['cell']
+        items.append((module.params['keytab'], cell,
+                      module.params['realm'] or cell.upper()))
+
+    try:
+        facts = lookup_facts()
+    except Exception:
+        facts = {}
 
     def lookup_command(name):
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
             cmd = facts['bins'][name]
         except Exception:
             cmd = module.get_bin_path(name)
@@ -177,79 +268,173 @@ def main():
             module.fail_json(msg='Unable to locate %s command.' % name)
         return cmd
 
+    def probe_asetkey():
+        """
+        Check asetkey usage to determine how to add keys.
+        """
+        rc, out, err = module.run_command([asetkey])
+        usage = err.splitlines()
+        if len(usage) == 0 or 'usage' not in usage[0]:
+            log.error("Failed to get asetkey usage; rc=%d, out=%s, err=%s",
+                      rc, out, err)
+            module.fail_json(msg="Failed to get asetkey usage.",
+                             asetkey=asetkey, rc=rc, out=out, err=err)
+        have_extended_keys = False
+        for line in usage:
+            if "add <type> <kvno> <subtype> <keyfile> <princ>" in line:
+                have_extended_keys = True
+        return have_extended_keys
+
+    def get_have_extended_keys():
+        """
+        Lookup the asetkey capability in the local facts, or probe asetkey
+        and save the result in the local facts. The saved result is keyed
+        by the asetkey path, size, and modification time.
+        """
+        try:
+            st = os.stat(asetkey)
+            stamp = [asetkey, st.st_size, int(st.st_mtime)]
+        except OSError:
+            stamp = None
+        cached = facts.get('asetkey', {})
+        if stamp and cached.get('stamp') == stamp:
+            have_extended_keys = cached['have_extended_keys']
+        else:
+            have_extended_keys = probe_asetkey()
+            if stamp:
+                try:
+                    with FactsStore().update() as f:
+                        f['asetkey'] = {
+                            'stamp': stamp,
+                            'have_extended_keys': have_extended_keys,
+                        }
+                except (IOError, OSError) as e:
+                    log.warning('Unable to save asetkey facts: %s', e)
+        log.debug("have_extended_keys=%s",
+                  "True" if have_extended_keys else "False")
+        return have_extended_keys
+
+    def open_keyfile():
+        """
+        Open the extended key file to be updated directly, or return None
+        to update the keys with asetkey.
+        """
+        afsconfdir = facts.get('dirs', {}).get('afsconfdir')
+        if not afsconfdir or not os.path.isdir(afsconfdir):
+            log.info('Server configuration directory is unknown.')
+            return None
+        path = os.path.join(afsconfdir, 'KeyFileExt')
+        if not os.path.exists(path) and not get_have_extended_keys():
+            return None
+        try:
+            return KeyFileExt(path)
+        except (IOError, OSError, KeyFileError) as e:
+            log.warning('Unable to read %s: %s', path, e)
+            return None
+
     asetkey = lookup_command('asetkey')
     log.debug('asetkey=%s', asetkey)
 
-    # Decode the keytab to find the kvnos, enctypes, and principals.
-    keytab = Keytab(keytab)
-    service_principal = 'afs/%s@%s' % (cell, realm)
-    keys = keytab.find(service_principal)
-    if not keys:
-        # Try old service principal format.
-        service_principal = '%s@%s' % (cell, realm)
+    # Decode the keytabs to find the kvnos, enctypes, and principals. Each
+    # keytab file is read once.
+    keytabs = {}
+    imports = []  # (keytab, service_principal, entries)
+    for path, cell, realm in items:
+        if path not in keytabs:
+            keytabs[path] = Keytab(path)
+        keytab = keytabs[path]
+        service_principal = 'afs/%s@%s' % (cell, realm)
         keys = keytab.find(service_principal)
-    if not keys:
-        msg = "Keys not found in keytab %s for cell '%s', realm '%s'." % \
-              (keytab.name, cell, realm)
-        log.error(msg)
-        module.fail_json(msg=msg, keys=keytab.entries)
-
-    results['service_principal'] = service_principal
-    results['keys'] = keys
-
-    # Check asetkey usage to determine how to add keys.
-    rc, out, err = module.run_command([asetkey])
-    usage = err.splitlines()
-    if len(usage) == 0 or 'usage' not in usage[0]:
-        log.error("Failed to get asetkey usage; rc=%d, out=%s, err=%s",
-                  rc, out, err)
-        module.fail_json(msg="Failed to get asetkey usage.",
-                         asetkey=asetkey, rc=rc, out=out, err=err)
-    have_extended_keys = False
-    for line in usage:
-        if "add <type> <kvno> <subtype> <keyfile> <princ>" in line:
-            have_extended_keys = True
-    log.debug("have_extended_keys=%s",
-              "True" if have_extended_keys else "False")
+        if not keys:
+            # Try old service principal format.
+            service_principal = '%s@%s' % (cell, realm)
+            keys = keytab.find(service_principal)
+        if not keys:
+            msg = "Keys not found in keytab %s for cell '%s', realm '%s'." % \
+                  (keytab.name, cell, realm)
+            log.error(msg)
+            module.fail_json(msg=msg, keys=keytab.entries)
+        imports.append((keytab, service_principal, keys))
+
+    results['service_principals'] = [i[1] for i in imports]
+    results['keys'] = [e for i in imports for e in i[2]]
+    if len(imports) == 1:
+        results['service_principal'] = imports[0][1]
+
+    # Check for conflicting keys before adding any, since the last key added
+    # for a kvno and enctype would silently replace the others.
+    entries = {}
+    for keytab, service_principal, keys in imports:
+        for e in keys:
+            key = keytab.get_key(service_principal, e['kvno'], e['eno'])
+            if entries.get((e['kvno'], e['eno']), key) != key:
+                msg = 'Conflicting keys for kvno %d enctype %d.' % \
+                      (e['kvno'], e['eno'])
+                log.error(msg)
+                module.fail_json(
+                    msg=msg, service_principals=results['service_principals'])
+            entries[(e['kvno'], e['eno'])] = key
+    entries = [(k[0], k[1], v) for k, v in sorted(entries.items())]
+
+    # Add the keys directly to the extended key file when possible.
+    keyfile = open_keyfile()
+    if keyfile:
+        for kvno, eno, key in keyfile.missing(RXKAD_KRB5, entries):
+            log.info('Adding key rxkad_krb5 kvno %d enctype %d to %s.',
+                     kvno, eno, keyfile.path)
+            keyfile.add(RXKAD_KRB5, kvno, eno, key)
+        if keyfile.changed:
+            keyfile.write()
+            results['changed'] = True
+        results['have_extended_keys'] = True
+        results['keyfile'] = keyfile.path
+        results['imported'] = keyfile.list()
+        log.info('Results: %s', pretty(results))
+        module.exit_json(**results)
+
+    have_extended_keys = get_have_extended_keys()
     results['have_extended_keys'] = have_extended_keys
 
     # Retrieve the current keys to check for changes.
     rc, before, err = module.run_command([asetkey, 'list'])
     if rc != 0:
-        log.error("Failed to list keys; rc=%d, out=%s, err=%s", rc, out, err)
+        log.error("Failed to list keys; rc=%d, out=%s, err=%s",
+                  rc, before, err)
         module.fail_json(msg="Failed to list keys.",
-                         asetkey=asetkey, rc=rc, out=out, err=err)
+                         asetkey=asetkey, rc=rc, out=before, err=err)
 
     # Add the keys.
-    for e in keys:
-        kvno = str(e['kvno'])
-        eno = str(e['eno'])
-        if have_extended_keys:
-            args = [asetkey, 'add', 'rxkad_krb5', kvno, eno, keytab.name,
-                    service_principal]
-        else:
-            # Old versions only support DES. OpenAFS 1.6.5 up to 1.8.0 will
-            # read non-DES keys from rxkad.keytab directly, so we just ignore
-            # them here and hope for the best.
-            if eno not in DES_ENCTYPES:
-                continue
-            args = [asetkey, 'add', kvno, keytab.name, service_principal]
-        rc, out, err = module.run_command(args)
-        results['debug'].append(dict(cmd=' '.join(args),
-                                rc=rc, out=out, err=err))
-        if rc != 0:
-            log.error("Failed asetkey add; rc=%d, out=%s, err=%s",
-                      rc, out, err)
-            module.fail_json(msg="Failed asetkey add",
-                             rc=rc, out=out, err=err, keys=keys)
+    for keytab, service_principal, keys in imports:
+        for e in keys:
+            kvno = str(e['kvno'])
+            eno = str(e['eno'])
+            if have_extended_keys:
+                args = [asetkey, 'add', 'rxkad_krb5', kvno, eno, keytab.name,
+                        service_principal]
+            else:
+                # Old versions only support DES. OpenAFS 1.6.5 up to 1.8.0
+                # will read non-DES keys from rxkad.keytab directly, so we
+                # just ignore them here and hope for the best.
+                if e['eno'] not in DES_ENCTYPES:
+                    continue
+                args = [asetkey, 'add', kvno, keytab.name, service_principal]
+            rc, out, err = module.run_command(args)
+            results['debug'].append(dict(cmd=' '.join(args),
+                                    rc=rc, out=out, err=err))
+            if rc != 0:
+                log.error("Failed asetkey add; rc=%d, out=%s, err=%s",
+                          rc, out, err)
+                module.fail_json(msg="Failed asetkey add",
+                                 rc=rc, out=out, err=err, keys=keys)
 
     # Check for changes and return list of key version numbers. Avoid returning
     # the key values!
     rc, after, err = module.run_command([asetkey, 'list'])
     if rc != 0:
-        log.error("Failed to list keys; rc=%d, out=%s, err=%s", rc, out, err)
+        log.error("Failed to list keys; rc=%d, out=%s, err=%s",
+                  rc, after, err)
         module.fail_json(msg="Failed to list keys.",
-                         asetkey=asetkey, rc=rc, out=out, err=err)
+                         asetkey=asetkey, rc=rc, out=after, err=err)
     if before != after:
         results['changed'] = True
     for line in after.splitlines():
@@ -258,7 +443,7 @@ def main():
             results['imported'].append(dict(type=m.group(1), kvno=m.group(2),
                                             eno=m.group(3)))
 
-    log.info('Results: %s', pprint.pformat(results))
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
@@ -91,6 +91,15 @@ options:
     required: false
     default: search PATH
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -167,6 +176,14 @@ realm:
   type: str
   return: when present in the principal parameter
 #  sample: EXAMPLE.COM
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
 import os        # noqa: E402
@@ -180,6 +197,8 @@ from ansible.module_utils.common.sys_info import (     # noqa: E402
 )
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.kerberos import Keytab  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
@@ -735,6 +754,7 @@ class FreeBSDHeimdalKerberosAdmin(HeimdalKerberosAdmin):
     distribution = 'Freebsd'
 
 
+@profiled
 def main():
     module = AnsibleModule(
             argument_spec=dict(
@@ -751,9 +771,11 @@ def main():
                 keytab_name=dict(type='str'),
                 keytabs=dict(type='path'),
                 kadmin=dict(type='path'),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    CommandTimer(module).attach()
     log.info('Starting %s', module_name)
 
     kadmin = KerberosAdmin(module)
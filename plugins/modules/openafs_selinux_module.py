@@ -14,7 +14,21 @@ module: openafs_selinux_module
 
 short_description: Create and install an selinux module from input files
 
-description: Build the selinux module from the given input files.
+description:
+  - Build the selinux module from the given input files.
+  - The installed module version is checked with C(semodule), and the
+    module is installed when it is missing or the version differs from the
+    version in the te file.
+  - The hash of the input files, the installed module version, and a stamp
+    of the active SELinux module store are saved in the openafs local facts
+    file. The C(semodule) version check is skipped when the input files and
+    the module store are unchanged since the module was last checked. Any
+    C(semodule) transaction, such as removing the module out of band,
+    replaces the module store, so the module is checked again on the next
+    run.
+  - The compiled policy package is saved in a C(cache) subdirectory of
+    I(path), keyed by a hash of the input files, and is reused instead
+    of being rebuilt, for example when the module was removed out of band.
 
 options:
 
@@ -31,6 +45,15 @@ options:
         the destination path of the output pp and mod files.
     default: /var/lib/ansible-openafs/selinux
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 """
@@ -63,18 +86,74 @@ version:
   description: Module version
   returned: success
   type: str
+
+cached:
+  description:
+    - True if a previously built policy package was installed instead of
+      building the policy package.
+  returned: success
+  type: bool
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 """
 
+import hashlib                  # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
+import shutil                   # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule   # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import FactsStore  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
+SELINUX_CONFIG = '/etc/selinux/config'
+
+# The active module store of a policy, which is replaced by each semodule
+# transaction; policycoreutils 2.4 and later, then older versions.
+SELINUX_STORES = (
+    '/var/lib/selinux/%s/active',
+    '/etc/selinux/%s/modules/active',
+)
+
+
+def store_stamp():
+    """
+    Return a stamp of the active SELinux module store, or None if the
+    module store is not found.
+    """
+    policy = None
+    try:
+        with open(SELINUX_CONFIG) as f:
+            for line in f:
+                m = re.match(r'\s*SELINUXTYPE\s*=\s*(\S+)', line)
+                if m:
+                    policy = m.group(1)
+    except IOError:
+        return None
+    if not policy:
+        return None
+    for pattern in SELINUX_STORES:
+        store = pattern % policy
+        try:
+            st = os.stat(store)
+        except OSError:
+            continue
+        return [store, st.st_ino, st.st_mtime]
+    return None
+
 
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -84,9 +163,11 @@ def main():
                 state=dict(type='str', choices=['present'], default='present'),
                 name=dict(type='str', default='openafs'),
                 path=dict(type='path', default='/var/lib/ansible-openafs'),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    CommandTimer(module).attach()
     log = Logger(module_name)
     log.info('Starting %s', module_name)
 
@@ -115,6 +196,65 @@ def main():
     def semodule(*args):
         return run_command('semodule', *args)
 
+    def read_inputs():
+        """
+        Read the te and fc input files. Returns the sha256 hex digest of the
+        inputs and the module version declared in the te file, if any.
+        """
+        h = hashlib.sha256()
+        version = None
+        try:
+            for f in (te, fc):
+                with open(f, 'rb') as fh:
+                    data = fh.read()
+                h.update(os.path.basename(f).encode('utf-8') + b'\0')
+                h.update(data + b'\0')
+                if f == te:
+                    for line in data.decode('utf-8', 'replace').splitlines():
+                        m = re.match(r'\s*module\s+(\S+)\s+(\S+)\s*;', line)
+                        if m and m.group(1) == name:
+                            version = m.group(2)
+                            break
+        except Exception as e:
+            die("Failed to read input files: %s" % str(e))
+        return h.hexdigest(), version
+
+    def installed_version():
+        out = semodule('-lstandard')
+        for line in out.splitlines():
+            m = re.match(r'\s*(\S+)\s+(\S+)\s*', line)
+            if m and m.group(1) == name:
+                return m.group(2)
+        return None
+
+    def build(digest):
+        """
+        Build the policy package, or reuse the one previously built from the
+        same inputs. Returns the path of the policy package to install.
+        """
+        cachedir = os.path.join(path, 'cache')
+        cached_pp = os.path.join(cachedir, '%s-%s.pp' % (name, digest))
+        if os.path.exists(cached_pp):
+            log.info("Using cached policy package '%s'.", cached_pp)
+            results['cached'] = True
+            return cached_pp
+        mod = os.path.join(path, '%s.mod' % name)
+        pp = os.path.join(path, '%s.pp' % name)
+        checkmodule('-M', '-m', '-o', mod, te)
+        semodule_package('-o', pp, '-m', mod, '-f', fc)
+        try:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            for old in os.listdir(cachedir):
+                if old.startswith('%s-' % name) and old.endswith('.pp'):
+                    os.remove(os.path.join(cachedir, old))
+            tmp = cached_pp + '.tmp'
+            shutil.copyfile(pp, tmp)
+            os.rename(tmp, cached_pp)
+        except (IOError, OSError) as e:
+            log.warning("Unable to cache policy package: %s", e)
+        return pp
+
     if not name:
         die("Module name is required.")
 
@@ -124,42 +264,47 @@ def main():
         if not os.path.exists(f):
             die("Input file '%s' not found." % f)
 
-    current_version = None
-    target_version = None
-
-    out = semodule('-lstandard')
-    for line in out.splitlines():
-        m = re.match(r'\s*(\S+)\s+(\S+)\s*', line)
-        if m and m.group(1) == name:
-            current_version = m.group(2)
-            break
-
+    digest, target_version = read_inputs()
+    results['module'] = os.path.join(path, '%s.pp' % name)
+    results['version'] = target_version
+    results['cached'] = False
+
+    store = FactsStore()
+    try:
+        recorded = store.load().get('selinux_modules', {}).get(name)
+    except ValueError:
+        recorded = None
+    stamp = store_stamp()
+    if stamp and recorded == {'inputs': digest, 'version': target_version,
+                              'store': stamp}:
+        log.info("%s module is up to date; module store is unchanged.", name)
+        module.exit_json(**results)
+
+    current_version = installed_version()
     if not current_version:
         log.info("%s module is not installed.", name)
     else:
         log.info("%s module version is '%s'.", name, current_version)
-        try:
-            with open(te) as f:
-                for line in f.readlines():
-                    m = re.match(r'\s*module\s+(\S+)\s+(\S+)\s*;', line)
-                    if m and m.group(1) == name:
-                        target_version = m.group(2)
-                        break
-        except Exception as e:
-            die("Failed to read te file: %s" % str(e))
         if not target_version:
             die("SELinux module version number not found in file '%s'." % te)
         log.info("%s module target version is '%s'.", name, target_version)
 
     if not current_version or (current_version != target_version):
-        mod = os.path.join(path, '%s.mod' % name)
-        pp = os.path.join(path, '%s.pp' % name)
-        checkmodule('-M', '-m', '-o', mod, te)
-        semodule_package('-o', pp, '-m', mod, '-f', fc)
+        pp = build(digest)
         semodule('-i', pp)
+        results['module'] = pp
         results['changed'] = True
+        stamp = store_stamp()
+
+    try:
+        with store.update() as facts:
+            modules = facts.setdefault('selinux_modules', {})
+            modules[name] = {'inputs': digest, 'version': target_version,
+                             'store': stamp}
+    except (IOError, OSError) as e:
+        log.warning("Unable to save local facts: %s", e)
 
-    log.info('Results: %s', pprint.pformat(results))
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
@@ -18,10 +18,30 @@ description:
   - Relabel the server directories after the files have been installed
     and the configuration files updated.
   - Relabel the partition directories and the AlwaysAttach file, when present.
-  - Safe the list of directories relabelled in the openafs local facts file
-    to avoid running restorecon on subsequent plays.
-
-options: {}
+  - The current contexts are first compared with the expected contexts with
+    a C(restorecon) dry run, and only the mismatched paths are relabelled.
+    The server directories and each partition are checked and relabelled
+    concurrently.
+  - The paths relabelled are returned in the I(relabelled) result. The
+    list of relabelled directories saved in the local facts by earlier
+    versions of this module is removed.
+
+options:
+  jobs:
+    description:
+      - The maximum number of C(restorecon) processes to run at the same
+        time.
+    type: int
+    default: the number of CPUs plus 4, up to 32
+
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
 
 author:
   - Michael Meffie
@@ -34,15 +54,33 @@ EXAMPLES = r"""
 """
 
 RETURN = r"""
+relabelled:
+  description: The paths relabelled.
+  type: list
+  returned: always
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 """
 
 import glob                     # noqa: E402
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
+import re                       # noqa: E402
+
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from multiprocessing import cpu_count  # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import FactsStore  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
@@ -52,66 +90,107 @@ module_name = os.path.basename(__file__).replace('.py', '')
 # to set the selinux context on /usr/vice before the bosserver starts.
 top_dirs = ['/usr/afs', '/usr/vice']
 
+# restorecon -n -v output for a path to be relabelled. Older versions print
+# "restorecon reset <path> context <old>-><new>".
+RELABEL = re.compile(r'^(?:Would relabel|restorecon reset) (.+?) '
+                     r'(?:from|context) ')
+
+# Maximum number of paths per restorecon command.
+BATCH_SIZE = 500
 
+
+@profiled
 def main():
     results = dict(
         changed=False,
+        relabelled=[],
     )
     module = AnsibleModule(
             argument_spec=dict(
+                jobs=dict(type='int', default=None),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    CommandTimer(module).attach()
     log = Logger(module_name)
     log.info('Starting %s', module_name)
+    restorecon_bin = module.get_bin_path('restorecon', required=True)
 
     def restorecon(*args):
-        restorecon = module.get_bin_path('restorecon', required=True)
-        cmdargs = [restorecon] + list(args)
+        cmdargs = [restorecon_bin] + list(args)
         cmdline = ' '.join(cmdargs)
         log.info("Running: %s", cmdline)
         rc, out, err = module.run_command(cmdargs)
         if rc != 0:
             log.error("Command failed: %s, rc=%d, err=%s", cmdline, rc, err)
-            module.fail_json(msg="Command failed", cmd=cmdline,
-                             out=out, err=err)
-
-    factsfile = '/etc/ansible/facts.d/openafs.fact'
-    try:
-        with open(factsfile) as fp:
-            facts = json.load(fp)
-    except Exception:
-        facts = {}
-
-    changed = []
-    relabelled = facts.get('relabelled', [])
+            raise RuntimeError("Command failed: %s, err=%s" % (cmdline, err))
+        return out
+
+    def mismatched(paths, recursive):
+        """
+        Find the paths with contexts which do not match the policy.
+        """
+        args = ['-n', '-v', '-i']
+        if recursive:
+            args.append('-r')
+        out = restorecon(*(args + paths))
+        found = []
+        for line in out.splitlines():
+            m = RELABEL.match(line)
+            if m:
+                found.append(m.group(1))
+        return found
+
+    def relabel(job):
+        """
+        Relabel the mismatched paths of a server directory or a partition.
+        """
+        paths, recursive = job
+        found = mismatched(paths, recursive)
+        for i in range(0, len(found), BATCH_SIZE):
+            restorecon('-i', *found[i:i + BATCH_SIZE])
+        return found
 
     for path in top_dirs:
         if not os.path.exists(path):
             os.makedirs(path)
-        if path not in relabelled:
-            restorecon('-i', '-r', path)
-            changed.append(path)
-
-    for path in glob.glob('/vicep*'):
-        if path not in relabelled:
-            restorecon('-i', path)
-            changed.append(path)
 
-    for path in glob.glob('/vicep*/AlwaysAttach'):
-        if path not in relabelled:
-            restorecon(path)
-            changed.append(path)
+    # The server directories are checked recursively. Only the partition
+    # directories and AlwaysAttach files are checked in the partitions.
+    jobs = [([path], True) for path in top_dirs]
+    for path in sorted(glob.glob('/vicep*')):
+        paths = [path]
+        always_attach = os.path.join(path, 'AlwaysAttach')
+        if os.path.exists(always_attach):
+            paths.append(always_attach)
+        jobs.append((paths, False))
+
+    workers = module.params['jobs'] or min(32, cpu_count() + 4)
+    changed = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for found in executor.map(relabel, jobs):
+                changed.extend(found)
+    except RuntimeError as e:
+        module.fail_json(msg=str(e))
 
     if changed:
-        facts['relabelled'] = sorted(set(relabelled) | set(changed))
-        if not os.path.exists(os.path.dirname(factsfile)):
-            os.makedirs(os.path.dirname(factsfile))
-        with open(factsfile, 'w') as fp:
-            json.dump(facts, fp, indent=2)
         results['changed'] = True
+        results['relabelled'] = sorted(changed)
 
-    log.info('Results: %s', pprint.pformat(results))
+    # The relabelled paths are only reported per run; drop the list saved in
+    # the local facts by earlier versions.
+    store = FactsStore()
+    try:
+        stale = 'relabelled' in store.load()
+    except ValueError:
+        stale = False
+    if stale:
+        with store.update() as facts:
+            facts.pop('relabelled', None)
+
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
@@ -46,6 +46,15 @@ options:
     type: bool
     default: True
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -82,9 +91,19 @@ single:
   description: Value is a single string
   type: bool
   returned: always
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
 from ansible.module_utils.basic import AnsibleModule   # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 
 class ServiceProperty(object):
@@ -175,6 +194,7 @@ class ServiceProperty(object):
                 cmd=cmd, rc=rc, out=out, err=err)
 
 
+@profiled
 def main():
     module = AnsibleModule(
             argument_spec=dict(
@@ -186,9 +206,11 @@ def main():
                 property=dict(required=True),
                 value=dict(required=False),
                 single=dict(type='bool', default=True),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    CommandTimer(module).attach()
 
     prop = ServiceProperty(module)
     if prop.state == 'present':
@@ -42,36 +42,17 @@ author:
 EXAMPLES = r'''
 '''
 
-import json                     # noqa: E402
 import os                       # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import FactsStore  # noqa: E402, E501
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
 
-def flatten(prefix, value):
-    """
-    Flatten the data tree in sorted order.
-    """
-    if isinstance(value, dict):
-        for k in sorted(value.keys()):
-            for element in flatten(prefix + str(k), value[k]):
-                yield element
-    elif isinstance(value, (list, tuple)):
-        for v in sorted(value):
-            for element in flatten(prefix, v):
-                yield element
-    else:
-        yield prefix + str(value)
-
-
-def signature(facts):
-    text = '\n'.join(flatten('', facts))
-    return text
-
-
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -90,40 +71,26 @@ def main():
 
     state = module.params['state']
     factsdir = module.params['factsdir']
-    factsfile = os.path.join(factsdir, 'openafs.fact')
-
-    try:
-        with open(factsfile) as fp:
-            facts = json.load(fp)
-    except Exception:
-        facts = {}
-    signature_before = signature(facts)
-
-    for key, value in module.params['facts'].items():
-        if state == 'set':
-            facts[key] = value
-        elif state == 'update':
-            if key not in facts:
+    store = FactsStore(factsdir)
+    with store.update() as facts:
+        for key, value in module.params['facts'].items():
+            if state == 'set':
                 facts[key] = value
-            elif isinstance(facts[key], dict) and isinstance(value, dict):
-                facts[key].update(value)
-            elif isinstance(facts[key], list) and isinstance(value, list):
-                facts[key].append(value)
+            elif state == 'update':
+                if key not in facts:
+                    facts[key] = value
+                elif isinstance(facts[key], dict) and isinstance(value, dict):
+                    facts[key].update(value)
+                elif isinstance(facts[key], list) and \
+                        isinstance(value, list):
+                    facts[key].append(value)
+                else:
+                    facts[key] = value
             else:
-                facts[key] = value
-        else:
-            module.fail_json(msg='Internal error: unknown state %s' % state)
-
-    if not os.path.exists(factsdir):
-        os.makedirs(factsdir)
-    with open(factsfile, 'w') as fp:
-        json.dump(facts, fp, indent=2)
-
-    with open(factsfile) as fp:
-        facts = json.load(fp)
-    signature_after = signature(facts)
-    if signature_before != signature_after:
-        log.info("Facts file '%s' changed.", factsfile)
+                module.fail_json(
+                    msg='Internal error: unknown state %s' % state)
+    if store.changed:
+        log.info("Facts file '%s' changed.", store.path)
         results['changed'] = True
 
     # Update local facts in the current play.
@@ -83,6 +83,15 @@ options:
     type: str
     default: admin.keytab
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -112,20 +121,31 @@ user:
 #      groups:
 #        - "system:administrators"
 #        - tester
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 '''
 
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
 import time                     # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import lookup_facts  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
 
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -141,11 +161,13 @@ def main():
                 localauth=dict(type='bool', default=False),
                 auth_user=dict(type='str', default='admin'),
                 auth_keytab=dict(type='str', default='admin.keytab'),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
     log = Logger(module_name)
     log.info('Starting %s', module_name)
+    timer = CommandTimer(module).attach()
 
     state = module.params['state']
     user = module.params['user']
@@ -165,8 +187,7 @@ def main():
 
     def lookup_command(name):
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             cmd = facts['bins'][name]
         except Exception:
             cmd = module.get_bin_path(name)
@@ -219,9 +240,10 @@ def main():
             args.append('-localauth')
         cmdline = ' '.join(args)
         retries = 120
+        attempt = 0
         while True:
             log.debug('Running: %s', cmdline)
-            rc, out, err = module.run_command(args)
+            rc, out, err = timer.run_command(args, retry=attempt)
             log.debug('Ran: %s, rc=%d, out=%s, err=%s', cmdline, rc, out, err)
             if is_done(rc, out, err):
                 return out
@@ -234,6 +256,7 @@ def main():
                         cmdline, rc, err, retries,
                         ('ies' if retries > 1 else 'y'))
             retries -= 1
+            attempt += 1
             time.sleep(2)
 
     def pts_examine(name):
@@ -363,7 +386,7 @@ def main():
     else:
         module.fail_json(msg="Internal error: invalid state %s" % state)
 
-    log.debug('Results: %s' % pprint.pformat(results))
+    log.debug('Results: %s', pretty(results))
     log.info('Exiting %s' % module_name)
     module.exit_json(**results)
 
@@ -177,6 +177,15 @@ options:
     type: str
     default: admin.keytab
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 """
@@ -247,17 +256,27 @@ volume:
 #        partition: a
 #        server: 192.168.122.214
 #        type: rw
+
+timings:
+  description:
+    - The external commands run, with the argument vector, wall clock time
+      in seconds, retry attempt, and exit code of each command, and a
+      summary of the count, total, p50 and p95 times by command name.
+  returned: when timings are requested
+  type: dict
 """
 
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
 import time                     # noqa: E402
 import errno                    # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import lookup_facts  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 log = Logger(module_name)
@@ -307,6 +326,7 @@ class Command(object):
         self.module = module
         self.results = results
         self.localauth = module.params['localauth']
+        self.timer = CommandTimer(module).attach()
 
     def die(self, msg):
         log.error(msg)
@@ -320,8 +340,7 @@ class Command(object):
         if name in self._commands:
             return self._commands[name]
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             cmd = facts['bins'][name]
         except Exception:
             cmd = self.module.get_bin_path(name)
@@ -393,8 +412,9 @@ class Command(object):
             args.append('-localauth')
         cmdline = ' '.join(args)
         retries = 120
+        attempt = 0
         while True:
-            rc, out, err = self.module.run_command(args)
+            rc, out, err = self.timer.run_command(args, retry=attempt)
             log.debug('command=%s, rc=%d, out=%s, err=%s',
                       cmdline, rc, out, err)
             if done(rc, out, err):
@@ -406,6 +426,7 @@ class Command(object):
                         cmdline, rc, err, retries,
                         ('ies' if retries > 1 else 'y'))
             retries -= 1
+            attempt += 1
             time.sleep(5)
 
     def vos_listvldb(self, name, retry_not_found=True):
@@ -732,8 +753,7 @@ class Volume(object):
         Lookup an OpenAFS directory from the local facts file.
         """
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             dir = facts['dirs'][name]
         except Exception:
             self.module.fail_json(msg='Unable to locate %s directory.' % name)
@@ -773,7 +793,7 @@ class Volume(object):
                 continue
             fileservers[i] = entry
         log.debug('determine_sites: fileservers=%s',
-                  pprint.pformat(fileservers))
+                  pretty(fileservers))
 
         # Convert the ipv4 addresses of the rw and ro sites to the server
         # index.
@@ -788,7 +808,7 @@ class Volume(object):
                 ro.append((i, s['partition']))
 
         log.debug('determine_sites: rw=%s, ro=%s',
-                  pprint.pformat(rw), pprint.pformat(ro))
+                  pretty(rw), pretty(ro))
 
         # Assemble a list of server indexes to matching our goal state. Start
         # with the existing ro sites.
@@ -812,7 +832,7 @@ class Volume(object):
                     available.append(i)
             while len(goal) < nreplicas and available:
                 goal.append((available.pop(0), None))
-        log.debug('determine_sites: goal=%s', pprint.pformat(goal))
+        log.debug('determine_sites: goal=%s', pretty(goal))
 
         # Finally, get the addresses and partitions to be added. Order is
         # important here, since we want to add the clone first.
@@ -826,7 +846,7 @@ class Volume(object):
                     parts = self.cmd.vos_listpart(addr)
                     part = parts[0]
                 sites.append((addr, part))
-        log.debug('determine_sites: sites=%s', pprint.pformat(sites))
+        log.debug('determine_sites: sites=%s', pretty(sites))
         return sites
 
     def get_cell_name(self):
@@ -1114,7 +1134,7 @@ class Volume(object):
                     terms.extend(list(m.groups()))
                 else:
                     self.die("Invalid acl term '%s'." % a)
-        log.debug('acl=%s', pprint.pformat(terms))
+        log.debug('acl=%s', pretty(terms))
         return terms
 
     def set_acl(self, volume, path, acl):
@@ -1165,10 +1185,11 @@ class Volume(object):
         self.results['acl'] = new
         if new != old:
             log.info('changed: acl from=%s to=%s',
-                     pprint.pformat(old), pprint.pformat(new))
+                     pretty(old), pretty(new))
             self.results['changed'] = True
 
 
+@profiled
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -1187,6 +1208,7 @@ def main():
             localauth=dict(type='bool', default=False),
             auth_user=dict(type='str', default='admin'),
             auth_keytab=dict(type='str', default='admin.keytab'),
+            timings=dict(type='bool', default=False),
         ),
         supports_check_mode=False,
     )
@@ -1200,7 +1222,7 @@ def main():
     else:
         v.die("Internal error: invalid state %s" % v.state)
 
-    log.debug('Results: %s' % pprint.pformat(v.results))
+    log.debug('Results: %s', pretty(v.results))
     log.info('Exiting %s' % module_name)
     module.exit_json(**v.results)
 
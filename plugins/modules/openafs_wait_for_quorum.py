@@ -18,7 +18,15 @@ description:
   - Wait until the VLDB and PRDB database elections are completed
     and a sync site is set.
 
-options: {}
+options:
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
 
 author:
   - Michael Meffie
@@ -34,18 +42,21 @@ EXAMPLES = r'''
     - afs_is_dbserver
 '''
 
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
 import time                     # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import lookup_facts  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
 
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -55,10 +66,12 @@ def main():
                 timeout=dict(type='int', default=600),
                 delay=dict(type='int', default=0),
                 sleep=dict(type='int', default=20),
-                fail_on_timeout=dict(type='bool', default=False)
+                fail_on_timeout=dict(type='bool', default=False),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    timer = CommandTimer(module).attach()
     log = Logger(module_name)
     log.info('Starting %s', module_name)
 
@@ -80,8 +93,7 @@ def main():
         if not found in the local facts.
         """
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             cmd = facts['bins'][name]
         except Exception:
             cmd = module.get_bin_path(name)
@@ -97,7 +109,7 @@ def main():
         udebug = lookup_command('udebug')
         args = [udebug, '-server', 'localhost', '-port', str(port)]
         log.info('Running: %s', ' '.join(args))
-        rc, out, err = module.run_command(args)
+        rc, out, err = timer.run_command(args, retry=retries)
         log.debug("Ran udebug: rc=%d, out=%s, err=%s", rc, out, err)
         if rc != 0:
             log.warning("Failed udebug: rc=%d, out=%s, err=%s", rc, out, err)
@@ -162,7 +174,7 @@ def main():
         retries += 1
 
     results['retries'] = retries
-    log.info('Results: %s', pprint.pformat(results))
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
@@ -46,6 +46,15 @@ options:
     type: bool
     default: True
 
+  timings:
+    description:
+      - Return a summary of the time taken by the external commands run by
+        the module in the I(timings) result.
+      - Timings are also returned when the C(ANSIBLE_OPENAFS_TIMINGS)
+        environment variable is set on the remote node.
+    type: bool
+    default: false
+
 author:
   - Michael Meffie
 '''
@@ -60,9 +69,7 @@ EXAMPLES = r'''
     - afs_is_fileserver
 '''
 
-import json                     # noqa: E402
 import os                       # noqa: E402
-import pprint                   # noqa: E402
 import re                       # noqa: E402
 import socket                   # noqa: E402
 import struct                   # noqa: E402
@@ -70,6 +77,10 @@ import time                     # noqa: E402
 
 from ansible.module_utils.basic import AnsibleModule  # noqa: E402
 from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import Logger  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import lookup_facts  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.common import pretty  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.profiling import profiled  # noqa: E402, E501
+from ansible_collections.openafs_contrib.openafs.plugins.module_utils.timings import CommandTimer  # noqa: E402, E501
 
 module_name = os.path.basename(__file__).replace('.py', '')
 
@@ -260,6 +271,7 @@ class Sysid:
             ">".format(self=self)
 
 
+@profiled
 def main():
     results = dict(
         changed=False,
@@ -269,10 +281,12 @@ def main():
                 timeout=dict(type='int', default=600),
                 delay=dict(type='int', default=0),
                 sleep=dict(type='int', default=20),
-                signal=dict(type='bool', default=True)
+                signal=dict(type='bool', default=True),
+                timings=dict(type='bool', default=False),
             ),
             supports_check_mode=False,
     )
+    timer = CommandTimer(module).attach()
     log = Logger(module_name)
     log.info('Starting %s', module_name)
 
@@ -294,8 +308,7 @@ def main():
         if not found in the local facts.
         """
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             cmd = facts['bins'][name]
         except Exception as e:
             log.warning("Unable to load facts: %s", e)
@@ -309,8 +322,7 @@ def main():
         Lookup an OpenAFS directory from the local facts file.
         """
         try:
-            with open('/etc/ansible/facts.d/openafs.fact') as f:
-                facts = json.load(f)
+            facts = lookup_facts()
             dir = facts['dirs'][name]
         except Exception as e:
             log.warning("Unable to load facts: %s", e)
@@ -345,9 +357,10 @@ def main():
         args.append('-localauth')
         cmdline = ' '.join(args)
         retries = 120
+        attempt = 0
         while True:
             log.debug('Running: %s', cmdline)
-            rc, out, err = module.run_command(args)
+            rc, out, err = timer.run_command(args, retry=attempt)
             log.debug('Ran: %s, rc=%d, out=%s, err=%s', cmdline, rc, out, err)
             if done(rc, out, err):
                 return out
@@ -360,6 +373,7 @@ def main():
                         cmdline, rc, err, retries,
                         ('ies' if retries > 1 else 'y'))
             retries -= 1
+            attempt += 1
             time.sleep(5)
 
     def vos_listaddrs():
@@ -495,7 +509,7 @@ def main():
         retries += 1
 
     results['retries'] = retries
-    log.info('Results: %s', pprint.pformat(results))
+    log.info('Results: %s', pretty(results))
     module.exit_json(**results)
 
 
@@ -0,0 +1,32 @@
+import json
+import os
+import pathlib
+import subprocess
+
+
+def test_openafs_timings(tmp_path):
+    mypath = pathlib.Path(__file__).parent
+    collections = mypath.parent.parent.parent.parent.parent.parent
+    env = dict(os.environ)
+    env["ANSIBLE_COLLECTIONS_PATHS"] = str(collections)
+    env["ANSIBLE_CALLBACKS_ENABLED"] = \
+        "openafs_contrib.openafs.openafs_timings"
+    env["ANSIBLE_CALLBACK_WHITELIST"] = env["ANSIBLE_CALLBACKS_ENABLED"]
+    env["ANSIBLE_OPENAFS_TIMINGS_DIR"] = str(tmp_path / "reports")
+    cmd = "ansible-playbook -e factsdir=%s %s/test_openafs_timings.yml" % \
+        (tmp_path / "facts", mypath)
+    print()
+    print("Running:", cmd)
+    rc = subprocess.call(cmd, shell=True, env=env)
+    assert rc == 0
+
+    reports = sorted(os.listdir(str(tmp_path / "reports")))
+    assert len(reports) == 2
+    assert reports[0].endswith(".json")
+    assert reports[1].endswith(".txt")
+    with open(str(tmp_path / "reports" / reports[0])) as f:
+        summary = json.load(f)
+    assert summary["hosts"]["localhost"]["tasks"] == 2
+    assert summary["modules"]["openafs_store_facts"]["tasks"] == 2
+    assert sorted(t["task"] for t in summary["slowest"]) == \
+        ["Store facts", "Store facts again"]
@@ -1,14 +1,23 @@
 import os
 import pathlib
 
+import pytest
 
-def test_counter():
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_counter(backend, tmp_path, monkeypatch):
     mypath = pathlib.Path(__file__).parent
     collections = mypath.parent.parent.parent.parent.parent.parent
-    os.environ["ANSIBLE_COLLECTIONS_PATHS"] = str(collections)
+    monkeypatch.setenv("ANSIBLE_COLLECTIONS_PATHS", str(collections))
+    monkeypatch.setenv("ANSIBLE_OPENAFS_COUNTER_BACKEND", backend)
+    monkeypatch.setenv("ANSIBLE_OPENAFS_COUNTER_DIR", str(tmp_path))
     cmd = "ansible-playbook %s/test_counter.yml" % mypath
     print()
     print("ANSIBLE_COLLECTIONS_PATHS:", collections)
+    print("ANSIBLE_OPENAFS_COUNTER_BACKEND:", backend)
+    print("ANSIBLE_OPENAFS_COUNTER_DIR:", tmp_path)
     print("Running:", cmd)
     rc = os.system(cmd)
     assert rc == 0
+    counter = "counter.db" if backend == "sqlite" else "counter.json"
+    assert (tmp_path / counter).exists()
@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import common  # noqa: E402
+
+
+def test_facts_store_load_missing(tmp_path):
+    store = common.FactsStore(str(tmp_path / "facts.d"))
+    assert store.load() == {}
+
+
+def test_facts_store_update(tmp_path):
+    store = common.FactsStore(str(tmp_path / "facts.d"))
+    with store.update() as facts:
+        facts["bins"] = {"vos": "/usr/bin/vos"}
+    assert store.changed
+    with open(store.path) as f:
+        assert json.load(f) == {"bins": {"vos": "/usr/bin/vos"}}
+    assert oct(os.stat(store.path).st_mode & 0o777) == oct(0o644)
+    assert sorted(os.listdir(store.factsdir)) == [
+        ".openafs.fact.lock", "openafs.fact"]
+
+
+def test_facts_store_unchanged(tmp_path):
+    factsdir = tmp_path / "facts.d"
+    factsdir.mkdir()
+    path = factsdir / "openafs.fact"
+    path.write_text('{"b": 2, "a": 1}')
+    mtime = os.stat(str(path)).st_mtime_ns
+
+    store = common.FactsStore(str(factsdir))
+    with store.update() as facts:
+        facts["a"] = 1
+    assert not store.changed
+    assert os.stat(str(path)).st_mtime_ns == mtime
+    assert path.read_text() == '{"b": 2, "a": 1}'
+
+
+def test_facts_store_invalid(tmp_path):
+    factsdir = tmp_path / "facts.d"
+    factsdir.mkdir()
+    (factsdir / "openafs.fact").write_text("{")
+    store = common.FactsStore(str(factsdir))
+    with store.update() as facts:
+        assert facts == {}
+        facts["a"] = 1
+    assert store.changed
+    assert store.load() == {"a": 1}
+
+
+def test_log_level():
+    assert common.log_level("x", "") == common.LOG_LEVELS["debug"]
+    assert common.log_level("x", "info") == common.LOG_LEVELS["info"]
+    spec = "warning,openafs_volume=debug"
+    assert common.log_level("openafs_volume", spec) == \
+        common.LOG_LEVELS["debug"]
+    assert common.log_level("openafs_user", spec) == \
+        common.LOG_LEVELS["warning"]
+
+
+def test_logger_deferred(tmp_path):
+    calls = []
+
+    def expensive():
+        calls.append(1)
+        return "value"
+
+    logfile = str(tmp_path / "test.log")
+    log = common.Logger("test_logger", level="info", logfile=logfile,
+                        use_syslog=False)
+    log.debug("debug %s", common.Lazy(expensive))
+    assert calls == []
+    log.info("info %s", common.Lazy(expensive))
+    log.warning("100% done")
+    assert calls == [1]
+    assert not os.path.exists(logfile)
+    log.flush()
+    with open(logfile) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("test_logger[%d]: INFO: info value" %
+                             os.getpid())
+    assert lines[1].endswith("WARNING: 100% done")
+
+
+def test_get_logger():
+    log = common.get_logger("test_get_logger", use_syslog=False)
+    assert common.get_logger("test_get_logger") is log
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import kerberos  # noqa: E402
+import pytest  # noqa: E402
+
+# hole.keytab: an aes256 key, a deleted entry, and an aes128 key without the
+# trailing 32-bit kvno. kvno.keytab: a key with kvno 300, which is truncated
+# to 44 in the 8-bit kvno, and a key with a zero 32-bit kvno.
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+PRINCIPAL = "afs/example.com@EXAMPLE.COM"
+
+
+def test_keytab_hole():
+    keytab = kerberos.Keytab(os.path.join(FIXTURES, "hole.keytab"))
+    assert [(e["principal"], e["kvno"], e["eno"], e["enctype"])
+            for e in keytab.entries] == [
+        (PRINCIPAL, 3, 18, "aes256-cts-hmac-sha1-96"),
+        (PRINCIPAL, 3, 17, "aes128-cts-hmac-sha1-96"),
+    ]
+    assert keytab.entries[0]["components"] == ["afs", "example.com"]
+    assert keytab.entries[0]["realm"] == "EXAMPLE.COM"
+    assert keytab.entries[0]["timestamp"] == 1605734384
+    assert keytab.get_key(PRINCIPAL, 3, 18) == b"a" * 32
+    assert keytab.get_key(PRINCIPAL, 3, 17) == b"b" * 16
+    assert keytab.find("afs@EXAMPLE.COM") == []
+
+
+def test_keytab_kvno():
+    keytab = kerberos.Keytab(os.path.join(FIXTURES, "kvno.keytab"))
+    assert [(e["kvno"], e["eno"]) for e in keytab.entries] == \
+        [(300, 18), (2, 18)]
+    assert keytab.get_kvno(PRINCIPAL) == 300
+    assert keytab.get_entries(PRINCIPAL) == keytab.entries[:1]
+    assert keytab.get_entries(PRINCIPAL, 2) == keytab.entries[1:]
+    assert keytab.get_key(PRINCIPAL, 300, 18) == b"c" * 32
+    assert keytab.get_key(PRINCIPAL, 2, 18) == b"d" * 32
+    with pytest.raises(KeyError):
+        keytab.get_key(PRINCIPAL, 44, 18)
+
+
+def test_keytab_invalid(tmp_path):
+    path = tmp_path / "bad.keytab"
+    path.write_bytes(b"\x01\x02\x03\x04")
+    with pytest.raises(ValueError):
+        kerberos.Keytab(str(path))
@@ -0,0 +1,61 @@
+import os
+import struct
+import sys
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import keyfile  # noqa: E402
+import pytest  # noqa: E402
+
+
+def test_keyfile_new(tmp_path):
+    path = str(tmp_path / "KeyFileExt")
+    kf = keyfile.KeyFileExt(path)
+    assert kf.keys == {}
+    assert kf.list() == []
+
+
+def test_keyfile_write_read(tmp_path):
+    path = str(tmp_path / "KeyFileExt")
+    kf = keyfile.KeyFileExt(path)
+    kf.add(keyfile.RXKAD_KRB5, 3, 18, b"k" * 32)
+    kf.add(keyfile.RXKAD_KRB5, 3, 17, b"j" * 16)
+    assert kf.changed
+    kf.write()
+    assert not kf.changed
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    with open(path, "rb") as f:
+        data = f.read()
+    assert struct.unpack("!l", data[:4]) == (2,)
+    assert struct.unpack("!lllll", data[4:24]) == (32, 2, 3, 17, 16)
+
+    kf = keyfile.KeyFileExt(path)
+    assert kf.list() == [
+        {"type": "rxkad_krb5", "kvno": "3", "eno": "17"},
+        {"type": "rxkad_krb5", "kvno": "3", "eno": "18"},
+    ]
+    assert kf.keys[(2, 3, 18)] == b"k" * 32
+
+
+def test_keyfile_missing(tmp_path):
+    path = str(tmp_path / "KeyFileExt")
+    kf = keyfile.KeyFileExt(path)
+    kf.add(keyfile.RXKAD_KRB5, 3, 18, b"k" * 32)
+    entries = [
+        (3, 18, b"k" * 32),   # present
+        (3, 17, b"j" * 16),   # missing
+        (4, 18, b"x" * 32),   # missing
+    ]
+    missing = kf.missing(keyfile.RXKAD_KRB5, entries)
+    assert [(kvno, eno) for kvno, eno, key in missing] == [(3, 17), (4, 18)]
+    kf.changed = False
+    kf.add(keyfile.RXKAD_KRB5, 3, 18, b"k" * 32)
+    assert not kf.changed
+
+
+def test_keyfile_invalid(tmp_path):
+    path = tmp_path / "KeyFileExt"
+    path.write_bytes(struct.pack("!ll", 1, 8))
+    with pytest.raises(keyfile.KeyFileError):
+        keyfile.KeyFileExt(str(path))
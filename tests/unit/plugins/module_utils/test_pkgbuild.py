@@ -0,0 +1,222 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+pkgbuild = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.module_utils."
+    "pkgbuild")
+
+# Fake rpmbuild. The source rpm and one binary rpm per job are written to
+# the _topdir, and the start and end of each job are logged to the calls
+# file. A job with the kernel version in the fail file fails.
+RPMBUILD = """#!/bin/sh
+topdir=
+name=userspace
+while [ $# -gt 0 ]; do
+    case "$1" in
+    --define)
+        case "$2" in
+        "_topdir "*) topdir="${{2#_topdir }}" ;;
+        "build_modules 1") name=kmod ;;
+        "kernvers "*) kernvers="${{2#kernvers }}" ;;
+        esac
+        shift
+        ;;
+    -bs)
+        name=source
+        ;;
+    esac
+    shift
+done
+[ -n "$kernvers" ] && name="$name-$kernvers"
+echo "start $name" >> {calls}
+sleep 0.2
+if grep -qx "$kernvers" {fail} 2>/dev/null; then
+    echo "end $name" >> {calls}
+    exit 1
+fi
+if [ $name = source ]; then
+    mkdir -p "$topdir/SRPMS"
+    rpm="$topdir/SRPMS/openafs-1.9.1-1.src.rpm"
+else
+    mkdir -p "$topdir/RPMS/x86_64"
+    rpm="$topdir/RPMS/x86_64/openafs-$name-1.9.1-1.x86_64.rpm"
+fi
+echo "$name" > "$rpm"
+echo "Wrote: $rpm"
+echo "end $name" >> {calls}
+"""
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule:
+    def __init__(self, rpmbuild, **params):
+        self.rpmbuild = rpmbuild
+        self.params = dict(build="all", kernvers=None, jobs=None,
+                           topdir=None, logdir=None)
+        self.params.update(params)
+
+    def get_bin_path(self, name, required=False):
+        assert name == "rpmbuild"
+        return self.rpmbuild
+
+    def run_command(self, args, **kwargs):
+        raise AssertionError("unexpected run_command: %s" % args)
+
+    def exit_json(self, **kwargs):
+        pass
+
+    def fail_json(self, msg, **kwargs):
+        raise ModuleFailed(msg, kwargs)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    paths = {
+        "calls": str(tmp_path / "calls"),
+        "fail": str(tmp_path / "fail"),
+        "topdir": str(tmp_path / "rpmbuild"),
+    }
+    rpmbuild = tmp_path / "rpmbuild.sh"
+    rpmbuild.write_text(RPMBUILD.format(**paths))
+    rpmbuild.chmod(0o755)
+    paths["rpmbuild"] = str(rpmbuild)
+    for name in ("SPECS", "SOURCES"):
+        os.makedirs(os.path.join(paths["topdir"], name))
+    paths["spec"] = os.path.join(paths["topdir"], "SPECS", "openafs.spec")
+    with open(paths["spec"], "w") as f:
+        f.write("Name: openafs\nSource0: openafs-1.9.1-src.tar.bz2\n")
+    paths["source"] = os.path.join(paths["topdir"], "SOURCES",
+                                   "openafs-1.9.1-src.tar.bz2")
+    with open(paths["source"], "w") as f:
+        f.write("source\n")
+    monkeypatch.setattr(pkgbuild, "get_platform_subclass",
+                        lambda cls: pkgbuild.RedHatRpmBuilder)
+    return paths
+
+
+def build(workspace, **params):
+    """
+    Run the builder and return the results and the jobs run, in the order
+    started.
+    """
+    if os.path.exists(workspace["calls"]):
+        os.remove(workspace["calls"])
+    module = FakeModule(workspace["rpmbuild"], topdir=workspace["topdir"],
+                        **params)
+    builder = pkgbuild.PackageBuilder(module)
+    builder.inputs = [os.path.basename(workspace["source"])]
+    builder.build()
+    calls = []
+    if os.path.exists(workspace["calls"]):
+        with open(workspace["calls"]) as f:
+            calls = [line.split() for line in f]
+    return builder.results, calls
+
+
+def max_running(calls):
+    running = highest = 0
+    for event, name in calls:
+        running += 1 if event == "start" else -1
+        highest = max(highest, running)
+    return highest
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 8])
+def test_build_concurrent(workspace, jobs):
+    kernvers = ["5.14.0-1", "5.14.0-2", "5.14.0-3"]
+    results, calls = build(workspace, kernvers=kernvers, jobs=jobs)
+    assert results["changed"]
+    # The source rpm is built before the binary rpms.
+    assert calls[:2] == [["start", "source"], ["end", "source"]]
+    assert max_running(calls[2:]) == min(jobs, 4)
+
+    topdir = workspace["topdir"]
+    rpms = os.path.join(topdir, "RPMS", "x86_64")
+    assert sorted(results["packages"]) == sorted(
+        [os.path.join(topdir, "SRPMS", "openafs-1.9.1-1.src.rpm")] +
+        [os.path.join(rpms, "openafs-%s-1.9.1-1.x86_64.rpm" % name)
+         for name in ["userspace"] + ["kmod-%s" % k for k in kernvers]])
+    for path in results["packages"]:
+        assert os.path.isfile(path)
+    assert os.listdir(os.path.join(topdir, "JOBS")) == []
+
+
+def test_build_failure(workspace):
+    with open(workspace["fail"], "w") as f:
+        f.write("5.14.0-2\n")
+    with pytest.raises(ModuleFailed) as e:
+        build(workspace, kernvers=["5.14.0-1", "5.14.0-2"])
+    msg, kwargs = e.value.args
+    assert msg == "rpmbuild failed"
+    assert kwargs["jobs"] == ["kmod-5.14.0-2"]
+    assert kwargs["logfiles"] == [os.path.join(
+        workspace["topdir"], "BUILD", "rpmbuild-kmod-5.14.0-2.log")]
+    # None of the binary rpms are moved to the workspace.
+    assert not os.path.exists(os.path.join(workspace["topdir"], "RPMS"))
+    assert not os.path.exists(os.path.join(workspace["topdir"],
+                                           pkgbuild.STORE))
+
+
+def test_job_key(workspace):
+    module = FakeModule(workspace["rpmbuild"], topdir=workspace["topdir"])
+    builder = pkgbuild.PackageBuilder(module)
+    defines = [("build_userspace", "1"), ("build_modules", "0")]
+    key = builder.job_key("a" * 64, "userspace", defines)
+    assert key == builder.job_key("a" * 64, "userspace", list(defines))
+    assert key != builder.job_key("b" * 64, "userspace", defines)
+    assert key != builder.job_key("a" * 64, "kmod", defines)
+    assert key != builder.job_key("a" * 64, "userspace", defines[:1])
+
+
+def test_build_skip_unchanged(workspace):
+    results, calls = build(workspace, kernvers=["5.14.0-1"])
+    assert results["changed"]
+    assert results["cached"] == []
+    packages = results["packages"]
+
+    # Nothing changed; no jobs are run.
+    results, calls = build(workspace, kernvers=["5.14.0-1"])
+    assert not results["changed"]
+    assert calls == []
+    assert results["cached"] == ["source", "userspace", "kmod-5.14.0-1"]
+    assert results["packages"] == packages
+
+    # The spec file was touched, but is the same.
+    os.utime(workspace["spec"], None)
+    results, calls = build(workspace, kernvers=["5.14.0-1"])
+    assert calls == []
+
+    # A new kernel version; only the new kernel module job is run.
+    results, calls = build(workspace, kernvers=["5.14.0-1", "5.14.0-2"])
+    assert results["changed"]
+    assert [c for c in calls if c[0] == "start"] == \
+        [["start", "kmod-5.14.0-2"]]
+
+    # A package was removed; the job is run again.
+    os.remove(packages[1])
+    results, calls = build(workspace, kernvers=["5.14.0-1"])
+    assert [c for c in calls if c[0] == "start"] == \
+        [["start", "userspace"]]
+    assert os.path.exists(packages[1])
+
+    # The source changed; every job is run again.
+    with open(workspace["source"], "w") as f:
+        f.write("new source\n")
+    results, calls = build(workspace, kernvers=["5.14.0-1"])
+    assert results["cached"] == []
+    assert sorted(c[1] for c in calls if c[0] == "start") == \
+        ["kmod-5.14.0-1", "source", "userspace"]
@@ -0,0 +1,70 @@
+import os
+import pstats
+import sys
+import tracemalloc
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import profiling  # noqa: E402
+import pytest  # noqa: E402
+
+
+@pytest.mark.parametrize("value,modes", [
+    ("", set()),
+    ("no", set()),
+    ("cpu", {"cpu"}),
+    ("memory", {"memory"}),
+    ("1", {"cpu", "memory"}),
+    ("all", {"cpu", "memory"}),
+])
+def test_profile_modes(monkeypatch, value, modes):
+    monkeypatch.setenv(profiling.PROFILE_ENV, value)
+    assert profiling.profile_modes() == modes
+
+
+def test_profiler(tmp_path):
+    directory = str(tmp_path / "profile")
+    profiler = profiling.Profiler("test", {"cpu", "memory"}, directory)
+    profiler.start()
+    data = [str(n) for n in range(1000)]
+    results = profiler.stop()
+    assert data
+    assert profiler.stop() is results
+    assert sorted(os.listdir(directory)) == [
+        os.path.basename(results["cprofile"]),
+        os.path.basename(results["tracemalloc"]),
+    ]
+    assert pstats.Stats(results["cprofile"]).total_calls > 0
+    assert tracemalloc.Snapshot.load(results["tracemalloc"]).traces
+    assert results["peak_memory"] > 0
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiled(monkeypatch, tmp_path):
+    directory = str(tmp_path / "profile")
+    monkeypatch.setenv(profiling.PROFILE_ENV, "cpu")
+    monkeypatch.setenv(profiling.PROFILE_DIR_ENV, directory)
+
+    @profiling.profiled
+    def main():
+        return 42
+
+    assert main() == 42
+    files = os.listdir(directory)
+    assert len(files) == 1
+    assert files[0].startswith("test_profiling-")
+    assert files[0].endswith(".prof")
+
+
+def test_not_profiled(monkeypatch, tmp_path):
+    directory = str(tmp_path / "profile")
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+    monkeypatch.setenv(profiling.PROFILE_DIR_ENV, directory)
+
+    @profiling.profiled
+    def main():
+        return 42
+
+    assert main() == 42
+    assert not os.path.exists(directory)
@@ -0,0 +1,110 @@
+import sys
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import timings  # noqa: E402
+import pytest  # noqa: E402
+
+
+class FakeModule:
+    def __init__(self, params=None, rc=0):
+        self.params = params or {}
+        self.rc = rc
+        self.commands = []
+
+    def run_command(self, args, **kwargs):
+        self.commands.append((args, kwargs))
+        return self.rc, 'out', 'err'
+
+
+@pytest.mark.parametrize("args,name", [
+    (["/usr/bin/vos", "listvldb", "-name", "root.cell"], "vos listvldb"),
+    (["/usr/bin/vos", "-help"], "vos"),
+    (["/usr/sbin/kadmin.local", "-q", "listprincs"], "kadmin.local"),
+    ([], ""),
+])
+def test_command_name(args, name):
+    assert timings.command_name(args) == name
+
+
+def test_percentile():
+    values = [float(n) for n in range(1, 101)]
+    assert timings.percentile(values, 50) == 50.0
+    assert timings.percentile(values, 95) == 95.0
+    assert timings.percentile([3.0], 95) == 3.0
+    assert timings.percentile([], 50) == 0.0
+
+
+def test_timings_enabled(monkeypatch):
+    monkeypatch.delenv(timings.TIMINGS_ENV, raising=False)
+    assert not timings.timings_enabled(FakeModule())
+    assert timings.timings_enabled(FakeModule({"timings": True}))
+    monkeypatch.setenv(timings.TIMINGS_ENV, "yes")
+    assert timings.timings_enabled(FakeModule())
+
+
+def test_run_command():
+    module = FakeModule({"timings": True}, rc=1)
+    timer = timings.CommandTimer(module)
+    rc, out, err = timer.run_command(["pts", "examine", "admin"], cwd="/tmp")
+    assert (rc, out, err) == (1, "out", "err")
+    assert module.commands == [(["pts", "examine", "admin"], {"cwd": "/tmp"})]
+    timer.run_command(["pts", "examine", "admin"], retry=1)
+    with timer.timed(["make", "all"]) as status:
+        status["rc"] = 0
+
+    results = timer.update({"changed": False})
+    summary = results["timings"]
+    assert [c["argv"] for c in summary["calls"]] == [
+        ["pts", "examine", "admin"],
+        ["pts", "examine", "admin"],
+        ["make", "all"],
+    ]
+    pts = summary["commands"]["pts examine"]
+    assert pts["count"] == 2
+    assert pts["retries"] == 1
+    assert pts["failures"] == 2
+    assert pts["p50"] <= pts["p95"]
+    assert summary["commands"]["make"]["failures"] == 0
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.delenv(timings.TIMINGS_ENV, raising=False)
+    timer = timings.CommandTimer(FakeModule())
+    timer.run_command(["vos", "listaddrs"])
+    assert len(timer.calls) == 1
+    assert timer.update({"changed": False}) == {"changed": False}
+
+
+def test_attach():
+    module = FakeModule({"timings": True})
+    results = {}
+    module.exit_json = lambda **kwargs: results.update(kwargs)
+    module.fail_json = lambda msg=None, **kwargs: results.update(kwargs)
+    timings.CommandTimer(module).attach()
+    module.run_command("bos status localhost")
+    module.exit_json(changed=True)
+    assert module.commands == [("bos status localhost", {})]
+    assert results["changed"]
+    assert results["timings"]["calls"][0]["argv"] == \
+        ["bos", "status", "localhost"]
+    assert results["timings"]["commands"]["bos status"]["count"] == 1
+
+
+def test_attach_fail_in_command():
+    module = FakeModule({"timings": True})
+    results = {}
+    module.exit_json = lambda **kwargs: results.update(kwargs)
+    module.fail_json = lambda msg=None, **kwargs: results.update(kwargs)
+
+    def run_command(args, check_rc=False, **kwargs):
+        module.fail_json(msg="failed", rc=1)  # check_rc failure
+        return 1, "", ""
+
+    module.run_command = run_command
+    timings.CommandTimer(module).attach()
+    module.run_command(["kadmin.local", "-q", "listprincs"], True)
+    calls = results["timings"]["calls"]
+    assert [c["argv"][0] for c in calls] == ["kadmin.local"]
+    assert results["timings"]["commands"]["kadmin.local"]["failures"] == 1
@@ -0,0 +1,159 @@
+import os
+import sys
+
+sys.path.append("plugins/module_utils")
+sys.path.append("../plugins/module_utils")
+sys.path.append("../../plugins/module_utils")
+import treesync  # noqa: E402
+import pytest  # noqa: E402
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "bin"))
+    os.makedirs(os.path.join(root, "etc"))
+    with open(os.path.join(root, "bin", "vos"), "w") as f:
+        f.write("vos\n")
+    with open(os.path.join(root, "bin", "pts"), "w") as f:
+        f.write("pts\n")
+    with open(os.path.join(root, "etc", "CellServDB"), "w") as f:
+        f.write(">example.com\n")
+    os.symlink("vos", os.path.join(root, "bin", "vos.link"))
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("link", [False, True])
+def test_sync_tree(tmp_path, link):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+
+    files = treesync.sync_tree(src, dst, link=link)
+    assert [f for f, changed in files] == [
+        os.path.join(dst, "bin", "pts"),
+        os.path.join(dst, "bin", "vos"),
+        os.path.join(dst, "bin", "vos.link"),
+        os.path.join(dst, "etc", "CellServDB"),
+    ]
+    assert read(os.path.join(dst, "bin", "vos")) == "vos\n"
+    assert os.readlink(os.path.join(dst, "bin", "vos.link")) == "vos"
+    assert not [n for n in os.listdir(os.path.join(dst, "bin"))
+                if n.startswith(".")]
+
+    # Nothing to do on the second pass.
+    assert treesync.sync_tree(src, dst, link=link) == []
+    files = treesync.sync_tree(src, dst, report_unchanged=True)
+    assert len(files) == 4
+    assert not any(changed for f, changed in files)
+
+
+def test_sync_tree_changed(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    treesync.sync_tree(src, dst)
+
+    with open(os.path.join(src, "bin", "pts"), "w") as f:
+        f.write("pts version 2\n")
+    files = treesync.sync_tree(src, dst)
+    assert files == [(os.path.join(dst, "bin", "pts"), True)]
+    assert read(os.path.join(dst, "bin", "pts")) == "pts version 2\n"
+
+
+def test_sync_tree_checksum(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    treesync.sync_tree(src, dst)
+
+    # Same size and time, different contents.
+    path = os.path.join(dst, "bin", "vos")
+    st = os.stat(path)
+    with open(path, "w") as f:
+        f.write("xxx\n")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert treesync.sync_tree(src, dst) == []
+    files = treesync.sync_tree(src, dst, checksum=True)
+    assert files == [(path, True)]
+    assert read(path) == "vos\n"
+
+
+def test_sync_tree_exclude(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    exclude = [os.path.join(dst, "etc", "*")]
+    files = treesync.sync_tree(src, dst, exclude=exclude)
+    assert len(files) == 3
+    assert not os.path.exists(os.path.join(dst, "etc", "CellServDB"))
+
+
+def test_sync_tree_not_a_directory(tmp_path):
+    with pytest.raises(treesync.CopyTreeError):
+        treesync.sync_tree(str(tmp_path / "missing"), str(tmp_path / "dst"))
+
+
+def test_sync_tree_rebuilt(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    treesync.sync_tree(src, dst)
+
+    # Identical contents with a newer time are not copied again, and the
+    # destination time is updated.
+    path = os.path.join(src, "bin", "vos")
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 60))
+    assert treesync.sync_tree(src, dst) == []
+    assert os.stat(os.path.join(dst, "bin", "vos")).st_mtime_ns == \
+        os.stat(path).st_mtime_ns
+
+    # Changed contents of the same size are copied.
+    with open(path, "w") as f:
+        f.write("xxx\n")
+    os.utime(path, (st.st_atime, st.st_mtime + 120))
+    files = treesync.sync_tree(src, dst)
+    assert files == [(os.path.join(dst, "bin", "vos"), True)]
+
+
+def test_sync_tree_copies(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    treesync.sync_tree(src, dst)
+    s = os.stat(os.path.join(src, "bin", "vos"))
+    d = os.stat(os.path.join(dst, "bin", "vos"))
+    assert s.st_ino != d.st_ino
+
+
+def test_sync_tree_same_second(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    treesync.sync_tree(src, dst)
+
+    # Changed contents of the same size within the same second are copied.
+    path = os.path.join(src, "bin", "vos")
+    ns = os.stat(path).st_mtime_ns
+    with open(path, "w") as f:
+        f.write("xxx\n")
+    second = ns - ns % 1000000000
+    os.utime(os.path.join(dst, "bin", "vos"), ns=(second, second))
+    os.utime(path, ns=(second + 1000, second + 1000))
+    files = treesync.sync_tree(src, dst)
+    assert files == [(os.path.join(dst, "bin", "vos"), True)]
+    assert read(os.path.join(dst, "bin", "vos")) == "xxx\n"
+
+
+def test_sync_tree_symlinked_dir(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    make_tree(src)
+    os.symlink("bin", os.path.join(src, "sbin"))
+    treesync.sync_tree(src, dst)
+    assert os.path.isdir(os.path.join(dst, "sbin"))
+    assert not os.path.islink(os.path.join(dst, "sbin"))
+    assert read(os.path.join(dst, "sbin", "vos")) == "vos\n"
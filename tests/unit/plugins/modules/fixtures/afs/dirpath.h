@@ -0,0 +1,90 @@
+/* src/config/dirpath.h.  Generated from dirpath.h.in by configure.  */
+/*
+ * Copyright 2000, International Business Machines Corporation and others.
+ * All Rights Reserved.
+ *
+ * This software has been released under the terms of the IBM Public
+ * License.  For details, see the LICENSE file in the top-level source
+ * directory or online at http://www.openafs.org/dl/license10.html
+ */
+
+#ifndef AFS_DIRPATH_H
+#define AFS_DIRPATH_H
+
+/* Dirpath package: Rationale and Usage
+ *
+ * With the port of AFS to Windows NT, it becomes necessary to support
+ * storing AFS system files (binaries, databases, logs, etc.) in a
+ * user-specified installation directory.  This breaks from the traditional
+ * notion of all AFS system files being stored under /usr/afs or /usr/vice.
+ *
+ * The core concept is that there is a dirpath.h file that
+ * defines the canonical directory paths, and a set of functions that
+ * return the local directory paths.
+ */
+
+#include <afs/param.h>
+
+/* Pathname components */
+#define AFSDIR_USR_DIR   "usr"
+#define AFSDIR_AFS_DIR   "afs"
+#define AFSDIR_VICE_DIR  "vice"
+#define AFSDIR_BIN_DIR   "bin"
+#define AFSDIR_ETC_DIR   "etc"
+#define AFSDIR_LOGS_DIR  "logs"
+#define AFSDIR_LOCAL_DIR "local"
+#define AFSDIR_BACKUP_DIR "backup"
+#define AFSDIR_DB_DIR    "db"
+
+/* ---------------------  Canonical path names ---------------------- */
+#ifdef AFS_NT40_ENV
+#define AFSDIR_CANONICAL_USR_DIRPATH            "\\Afs"
+#define AFSDIR_CANONICAL_SERVER_AFS_DIRPATH     "\\Afs\\Server"
+#define AFSDIR_CANONICAL_CLIENT_VICE_DIRPATH  \
+                       "\\Program Files\\OpenAFS\\Client"
+#else
+#define AFSDIR_CANONICAL_USR_DIRPATH            "/usr"
+#define AFSDIR_CANONICAL_SERVER_AFS_DIRPATH     "/usr/afs"
+#define AFSDIR_CANONICAL_CLIENT_VICE_DIRPATH    "/usr/vice"
+#endif
+
+#define AFSDIR_CANONICAL_SERVER_BIN_DIRPATH "/usr/lib/openafs"
+#define AFSDIR_CANONICAL_SERVER_ETC_DIRPATH "/etc/openafs/server"
+#define AFSDIR_CANONICAL_SERVER_LOGS_DIRPATH "/var/log/openafs"
+#define AFSDIR_CANONICAL_SERVER_LOCAL_DIRPATH "/var/lib/openafs/local"
+#define AFSDIR_CANONICAL_SERVER_DB_DIRPATH "/var/lib/openafs/db"
+#define AFSDIR_CANONICAL_SERVER_BACKUP_DIRPATH "/var/lib/openafs/backup"
+#define AFSDIR_CANONICAL_SERVER_BOSCONFIG_DIRPATH "/etc/openafs"
+#define AFSDIR_CANONICAL_CLIENT_ETC_DIRPATH "/etc/openafs"
+#define AFSDIR_CANONICAL_SERVER_MIGRATE_DIRPATH \
+    AFSDIR_CANONICAL_SERVER_LOCAL_DIRPATH "/migrate"
+
+/* ----------------- Local (i.e., non-canonical) path names ----------------- */
+
+typedef enum afsdir_id {
+    AFSDIR_SERVER_AFS_DIRPATH_ID,
+    AFSDIR_SERVER_ETC_DIRPATH_ID,
+    AFSDIR_SERVER_BIN_DIRPATH_ID,
+    AFSDIR_SERVER_LOGS_DIRPATH_ID,
+    AFSDIR_SERVER_BACKUP_DIRPATH_ID,
+    AFSDIR_SERVER_DB_DIRPATH_ID,
+    AFSDIR_SERVER_LOCAL_DIRPATH_ID,
+    AFSDIR_CLIENT_VICE_DIRPATH_ID,
+    AFSDIR_CLIENT_ETC_DIRPATH_ID,
+    AFSDIR_PATHSTRING_MAX
+} afsdir_id_t;
+
+extern const char *getDirPath(afsdir_id_t string_id);
+
+/* Directory paths */
+#define AFSDIR_SERVER_AFS_DIRPATH getDirPath(AFSDIR_SERVER_AFS_DIRPATH_ID)
+#define AFSDIR_SERVER_ETC_DIRPATH getDirPath(AFSDIR_SERVER_ETC_DIRPATH_ID)
+#define AFSDIR_SERVER_BIN_DIRPATH getDirPath(AFSDIR_SERVER_BIN_DIRPATH_ID)
+#define AFSDIR_SERVER_LOGS_DIRPATH getDirPath(AFSDIR_SERVER_LOGS_DIRPATH_ID)
+#define AFSDIR_SERVER_BACKUP_DIRPATH getDirPath(AFSDIR_SERVER_BACKUP_DIRPATH_ID)
+#define AFSDIR_SERVER_DB_DIRPATH getDirPath(AFSDIR_SERVER_DB_DIRPATH_ID)
+#define AFSDIR_SERVER_LOCAL_DIRPATH getDirPath(AFSDIR_SERVER_LOCAL_DIRPATH_ID)
+#define AFSDIR_CLIENT_VICE_DIRPATH getDirPath(AFSDIR_CLIENT_VICE_DIRPATH_ID)
+#define AFSDIR_CLIENT_ETC_DIRPATH getDirPath(AFSDIR_CLIENT_ETC_DIRPATH_ID)
+
+#endif /* AFS_DIRPATH_H */
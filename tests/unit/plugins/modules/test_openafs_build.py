@@ -0,0 +1,234 @@
+import json
+import os
+import pathlib
+import sys
+from multiprocessing import cpu_count
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+ob = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_build")
+basic = pytest.importorskip("ansible.module_utils.basic")
+
+if ob.platform.system() != "Linux":
+    pytest.skip("kernels option is only supported on Linux",
+                allow_module_level=True)
+
+# Fake configure and make. The libafs_tree target creates the tree with
+# the configure script. The kernel module build creates the module for the
+# kernel version of the configured kernel headers, unless the version is
+# listed in the fail file.
+CONFIGURE = """#!/bin/sh
+printf '%s\\n' "$@" > configure.args
+"""
+
+MAKE = """#!/bin/sh
+echo "$(basename $(pwd)) $*" >> {calls}
+if [ "$1" = libafs_tree ]; then
+    mkdir -p libafs_tree
+    cp {configure} libafs_tree/configure
+    exit 0
+fi
+headers=$(sed -n 's/^--with-linux-kernel-headers=//p' configure.args)
+version=$(cat "$headers/include/config/kernel.release")
+if grep -qx "$version" {fail} 2>/dev/null; then
+    exit 1
+fi
+mkdir -p src/libafs/MODLOAD-$version-SP
+touch src/libafs/MODLOAD-$version-SP/openafs.ko
+"""
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule:
+    def __init__(self, **params):
+        self.params = dict(
+            kernels=None, srcdir=None, builddir=None, logdir=None,
+            make=None, fakeroot=None, configure_environment=None,
+            jobs=0, kernel_jobs=1, timings=False)
+        self.params.update(params)
+
+    def get_bin_path(self, name, required=False):
+        return None
+
+    def run_command(self, args, **kwargs):
+        return 0, "", ""
+
+    def exit_json(self, **kwargs):
+        pass
+
+    def fail_json(self, msg, **kwargs):
+        raise ModuleFailed(msg)
+
+
+def kernel_headers(path, version):
+    """
+    Create a kernel headers directory.
+    """
+    release = path / "include" / "config" / "kernel.release"
+    release.parent.mkdir(parents=True)
+    release.write_text(version + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def srcdir(tmp_path):
+    paths = {
+        "calls": str(tmp_path / "calls"),
+        "fail": str(tmp_path / "fail"),
+        "configure": str(tmp_path / "configure"),
+        "make": str(tmp_path / "make"),
+    }
+    for name, script in (("configure", CONFIGURE), ("make", MAKE)):
+        with open(paths[name], "w") as f:
+            f.write(script.format(**paths))
+        os.chmod(paths[name], 0o755)
+    (tmp_path / "openafs").mkdir()
+    paths["srcdir"] = str(tmp_path / "openafs")
+    paths["tmp"] = tmp_path
+    return paths
+
+
+def builder(srcdir, **params):
+    module = FakeModule(srcdir=srcdir["srcdir"], make=srcdir["make"],
+                        **params)
+    return ob.Builder(module)
+
+
+def test_resolve_kernel(srcdir):
+    b = builder(srcdir, kernels=["5.14.0-1"])
+    assert b.resolve_kernel("5.14.0-1") == \
+        ("5.14.0-1", "/lib/modules/5.14.0-1/build")
+
+    headers = kernel_headers(srcdir["tmp"] / "kernels" / "k1", "5.14.0-2")
+    assert b.resolve_kernel(headers) == ("5.14.0-2", headers)
+    assert b.resolve_kernel(headers + "/") == ("5.14.0-2", headers)
+
+    empty = srcdir["tmp"] / "kernels" / "empty"
+    empty.mkdir()
+    with pytest.raises(ModuleFailed) as e:
+        b.resolve_kernel(str(empty))
+    assert str(e.value).startswith("Unable to read kernel version from ")
+
+
+def make_calls(srcdir):
+    with open(srcdir["calls"]) as f:
+        return [line.split() for line in f]
+
+
+@pytest.mark.parametrize("jobs,kernel_jobs,workers,make_jobs", [
+    (8, 2, 2, 4),
+    (8, 0, 1, 8),     # At least one kernel module build.
+    (8, 16, 3, 2),    # No more builds than kernels.
+    (0, 2, 2, 0),     # make without -j.
+])
+def test_build_kernels(srcdir, jobs, kernel_jobs, workers, make_jobs):
+    versions = ["5.14.0-1", "5.14.0-2", "5.14.0-3"]
+    kernels = [kernel_headers(srcdir["tmp"] / "kernels" / v, v)
+               for v in versions]
+    b = builder(srcdir, kernels=kernels, jobs=jobs, kernel_jobs=kernel_jobs)
+    b._stage = "make"
+    b.configure_args = ["./configure", "--prefix=/usr", "--enable-debug",
+                        "--enable-debug-kernel", "--disable-optimize-kernel"]
+    b.build_kernels()
+
+    builddir = srcdir["srcdir"]
+    assert b.changed
+    assert sorted(b.kernel_modules) == versions
+    for version in versions:
+        kbuilddir = os.path.join(builddir, "libafs-%s" % version)
+        assert b.kernel_modules[version] == [os.path.join(
+            kbuilddir, "src/libafs/MODLOAD-%s-SP/openafs.ko" % version)]
+        with open(os.path.join(kbuilddir, "configure.args")) as f:
+            assert f.read().splitlines() == [
+                "--with-linux-kernel-headers=%s" %
+                os.path.join(srcdir["tmp"], "kernels", version),
+                "--with-linux-kernel-packaging",
+                "--enable-debug-kernel",
+                "--disable-optimize-kernel",
+            ]
+    assert b.kmods == [b.kernel_modules[v][0] for v in versions]
+
+    calls = make_calls(srcdir)
+    assert calls[0] == [os.path.basename(builddir), "libafs_tree"]
+    expected = ["-j", str(make_jobs)] if make_jobs else []
+    assert sorted(calls[1:]) == \
+        [["libafs-%s" % v] + expected for v in versions]
+    log = os.path.join(builddir, ".ansible", "build.log")
+    with open(log) as f:
+        assert "Building kernel modules for 3 kernels (%d at a time)." % \
+            workers in f.read()
+
+
+def test_build_kernels_failed(srcdir):
+    versions = ["5.14.0-1", "5.14.0-2"]
+    kernels = [kernel_headers(srcdir["tmp"] / "kernels" / v, v)
+               for v in versions]
+    with open(srcdir["fail"], "w") as f:
+        f.write("5.14.0-2\n")
+    b = builder(srcdir, kernels=kernels, kernel_jobs=2)
+    b._stage = "make"
+    b.configure_args = ["./configure"]
+    with pytest.raises(ModuleFailed) as e:
+        b.build_kernels()
+    assert str(e.value) == \
+        'Kernel module build failed; 5.14.0-2: make failed; see ' \
+        '"%s/.ansible/make-5.14.0-2.log"' % srcdir["srcdir"]
+    assert list(b.kernel_modules) == ["5.14.0-1"]
+
+
+def test_build_kernels_missing_headers(srcdir):
+    b = builder(srcdir, kernels=[str(srcdir["tmp"] / "nokernel")])
+    b._stage = "make"
+    with pytest.raises(ModuleFailed) as e:
+        b.build_kernels()
+    assert str(e.value).startswith("Unable to read kernel version")
+
+    b = builder(srcdir, kernels=["0.0.0-none"])
+    b._stage = "make"
+    with pytest.raises(ModuleFailed) as e:
+        b.build_kernels()
+    assert str(e.value) == "Kernel headers not found for kernel " \
+        "0.0.0-none: /lib/modules/0.0.0-none/build"
+    assert not os.path.exists(srcdir["calls"])
+
+
+def test_kernel_options(srcdir, monkeypatch, capsys):
+    params = {}
+
+    def build(self):
+        params.update(self.module.params)
+        params["configure_options"] = self.get_configure_options()
+        return {"changed": False}
+    monkeypatch.setattr(ob.Builder, "build", build)
+    args = {"ANSIBLE_MODULE_ARGS": {
+        "srcdir": srcdir["srcdir"],
+        "make": srcdir["make"],
+        "kernels": ["5.14.0-1"],
+    }}
+    monkeypatch.setattr(basic, "_ANSIBLE_ARGS", json.dumps(args).encode())
+    with pytest.raises(SystemExit) as e:
+        ob.main()
+    assert e.value.code == 0, capsys.readouterr().out
+
+    # kernel_jobs and jobs default to the number of CPUs.
+    assert params["kernel_jobs"] == cpu_count()
+    assert params["jobs"] == cpu_count()
+    # The kernel module is not built in the main build tree.
+    options = params["configure_options"]
+    assert "kernel-module" in options["disable"]
+    assert "kernel-module" not in options["enable"]
+    assert "debug-kernel" not in options["enable"]
+    assert "linux-kernel-packaging" not in options["with"]
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+bs = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_build_sdist")
+basic = pytest.importorskip("ansible.module_utils.basic")
+
+VERSION = "1.9.1"
+
+# A stand-in for the OpenAFS regen.sh, which generates the configure script
+# and the documents. The runs are counted in the regen.log file.
+REGEN = """#!/bin/sh
+echo regen >> {log}
+echo "#!/bin/sh" > configure
+chmod +x configure
+mkdir -p doc/man-pages/man1
+echo ".TH vos 1" > doc/man-pages/man1/vos.1
+"""
+
+
+def have_program(name):
+    return any(os.access(os.path.join(p, name), os.X_OK)
+               for p in os.environ["PATH"].split(os.pathsep))
+
+
+def git(topdir, *args):
+    subprocess.check_call(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com",
+         "-c", "commit.gpgsign=false"] + list(args),
+        cwd=topdir, stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def source(tmp_path):
+    for name in ("git", "tar", "gzip"):
+        if not have_program(name):
+            pytest.skip("%s not found" % name)
+    topdir = tmp_path / "openafs"
+    (topdir / "src" / "afs").mkdir(parents=True)
+    (topdir / "doc" / "txt").mkdir(parents=True)
+    (topdir / "README").write_text("OpenAFS\n")
+    (topdir / "src" / "afs" / "afs.h").write_text("#define AFS 1\n")
+    (topdir / "doc" / "txt" / "notes").write_text("notes\n")
+    regen = topdir / "regen.sh"
+    regen.write_text(REGEN.format(log=tmp_path / "regen.log"))
+    regen.chmod(0o755)
+    git(str(topdir), "init", "-q")
+    git(str(topdir), "add", ".")
+    git(str(topdir), "commit", "-q", "-m", "initial")
+    git(str(topdir), "tag", "-a", "-m", VERSION, "openafs-stable-1_9_1")
+    return tmp_path
+
+
+def regen_count(source):
+    with open(str(source / "regen.log")) as f:
+        return len(f.readlines())
+
+
+def run_module(source, monkeypatch, capsys, sdist="sdist", **params):
+    args = {
+        "sdist": str(source / sdist),
+        "topdir": str(source / "openafs"),
+        "cachedir": str(source / "cache"),
+        "formats": ["gz"],
+    }
+    args.update(params)
+    args = {"ANSIBLE_MODULE_ARGS": args}
+    monkeypatch.setattr(basic, "_ANSIBLE_ARGS", json.dumps(args).encode())
+    with pytest.raises(SystemExit) as e:
+        bs.main()
+    results = json.loads(capsys.readouterr().out)
+    assert e.value.code == (1 if results.get("failed") else 0), results
+    return results
+
+
+def test_build_sdist_checksums(source, monkeypatch, capsys):
+    formats = ["gz"]
+    for suffix, name, commands in bs.COMPRESSIONS[1:]:
+        if any(have_program(c[0]) for c in commands):
+            formats.append(suffix)
+    results = run_module(source, monkeypatch, capsys, formats=formats)
+    assert results["changed"]
+    assert results["version"] == VERSION
+    archives = sorted(a["file"] for a in results["archives"])
+    expected = sorted(
+        str(source / "sdist" / ("openafs-%s-%s.tar.%s" % (VERSION, k, s)))
+        for k in ("doc", "src") for s in formats)
+    assert archives == expected
+    for info in results["archives"]:
+        path = info["file"]
+        with open(path, "rb") as f:
+            data = f.read()
+        assert info["size"] == len(data)
+        for name in ("md5", "sha256"):
+            digest = hashlib.new(name, data).hexdigest()
+            assert info[name] == digest
+            with open("%s.%s" % (path, name)) as f:
+                assert f.read() == "%s  %s\n" % (digest, path)
+            assert "%s.%s" % (path, name) in results["files"]
+        with tarfile.open(path) as tar:
+            assert tar.getnames()
+
+
+def test_build_sdist_compress_failure(source, monkeypatch, capsys):
+    results = run_module(source, monkeypatch, capsys, gzip="/bin/false")
+    assert results["failed"]
+    assert results["msg"].startswith("Compression failed: /bin/false -c")
+    assert not os.path.exists(str(source / "sdist" / bs.STORE))
+
+
+def baseline_archives(tree, workdir):
+    """
+    Create the archives with the tar commands used before the archives were
+    streamed; the doc directory, then the rest of the tree.
+    """
+    workdir.mkdir()
+    subprocess.check_call(["cp", "-a", tree, str(workdir)])
+    prefix = os.path.basename(tree)
+    subprocess.check_call(["tar", "cf", "doc.tar", "%s/doc" % prefix],
+                          cwd=str(workdir))
+    subprocess.check_call(["rm", "-rf", "%s/doc" % prefix], cwd=str(workdir))
+    subprocess.check_call(["tar", "cf", "src.tar", prefix], cwd=str(workdir))
+    return {k: str(workdir / ("%s.tar" % k)) for k in ("doc", "src")}
+
+
+def members(path):
+    """
+    Return the archive member names, types, modes, and file contents.
+    """
+    result = {}
+    with tarfile.open(path) as tar:
+        for m in tar.getmembers():
+            data = tar.extractfile(m).read() if m.isfile() else None
+            result[m.name.rstrip("/")] = (m.type, m.mode, data)
+    return result
+
+
+def test_build_sdist_contents(source, monkeypatch, capsys):
+    results = run_module(source, monkeypatch, capsys)
+    assert not results["cached"]
+    tree = os.path.join(str(source / "cache"), bs.CACHE_SUBDIR,
+                        "%s-%s" % (results["commit"], VERSION),
+                        "openafs-%s" % VERSION)
+    baseline = baseline_archives(tree, source / "baseline")
+    for kind in ("doc", "src"):
+        archive = str(source / "sdist" /
+                      ("openafs-%s-%s.tar.gz" % (VERSION, kind)))
+        assert members(archive) == members(baseline[kind])
+    doc = members(str(source / "sdist" /
+                      ("openafs-%s-doc.tar.gz" % VERSION)))
+    assert "openafs-%s/doc/man-pages/man1/vos.1" % VERSION in doc
+    src = members(str(source / "sdist" /
+                      ("openafs-%s-src.tar.gz" % VERSION)))
+    assert "openafs-%s/configure" % VERSION in src
+    assert "openafs-%s/.version" % VERSION in src
+    assert not [n for n in src if "/doc" in n]
+
+
+def test_build_sdist_cache(source, monkeypatch, capsys):
+    cachedir = source / "cache" / bs.CACHE_SUBDIR
+    cachedir.mkdir(parents=True)
+    stale = cachedir / ("%s-1.9.0" % ("0" * 40))
+    (stale / "openafs-1.9.0").mkdir(parents=True)
+    (cachedir / "notes").mkdir()
+    (cachedir / ("%s-1.8.0" % ("1" * 40))).write_text("not a tree\n")
+    (source / "other").mkdir()
+    (cachedir / ("%s-1.7.0" % ("2" * 40))).symlink_to(source / "other")
+
+    results = run_module(source, monkeypatch, capsys)
+    assert not results["cached"]
+    assert regen_count(source) == 1
+    key = "%s-%s" % (results["commit"], VERSION)
+    assert sorted(os.listdir(str(cachedir))) == sorted([
+        key,
+        "notes",
+        "%s-1.8.0" % ("1" * 40),
+        "%s-1.7.0" % ("2" * 40),
+    ])
+    assert (source / "other").is_dir()
+
+    # The cached tree is used for a new destination.
+    results = run_module(source, monkeypatch, capsys, sdist="sdist2")
+    assert results["changed"]
+    assert results["cached"]
+    assert regen_count(source) == 1
+    for kind in ("doc", "src"):
+        name = "openafs-%s-%s.tar.gz" % (VERSION, kind)
+        assert members(str(source / "sdist2" / name)) == \
+            members(str(source / "sdist" / name))
+
+
+def test_build_sdist_reproducible(source, monkeypatch, capsys):
+    results = run_module(source, monkeypatch, capsys)
+    first = {}
+    for info in results["archives"]:
+        with open(info["file"], "rb") as f:
+            first[info["file"]] = f.read()
+
+    # Rebuild everything, including the source tree, from the same commit.
+    subprocess.check_call(["rm", "-rf", str(source / "sdist"),
+                           str(source / "cache")])
+    results = run_module(source, monkeypatch, capsys)
+    assert not results["cached"]
+    assert regen_count(source) == 2
+    for info in results["archives"]:
+        with open(info["file"], "rb") as f:
+            assert f.read() == first[info["file"]]
+
+
+def test_build_sdist_store(source, monkeypatch, capsys):
+    results = run_module(source, monkeypatch, capsys)
+    assert results["changed"]
+    with open(str(source / "sdist" / bs.STORE)) as f:
+        store = json.load(f)
+    assert store["key"] == {
+        "commit": results["commit"],
+        "version": VERSION,
+        "formats": ["gz"],
+    }
+    assert store["files"] == results["files"]
+
+    # The commit is unchanged; nothing is written.
+    archive = results["archives"][0]["file"]
+    mtime = os.stat(archive).st_mtime_ns
+    again = run_module(source, monkeypatch, capsys)
+    assert not again["changed"]
+    assert again["cached"]
+    assert again["files"] == results["files"]
+    assert again["archives"] == results["archives"]
+    assert os.stat(archive).st_mtime_ns == mtime
+    assert not [c for c in again["commands"] if "log >" in c]
+
+    # A missing file, new format, or new commit is rebuilt.
+    os.remove(archive + ".md5")
+    assert run_module(source, monkeypatch, capsys)["changed"]
+    if have_program("xz"):
+        assert run_module(source, monkeypatch, capsys,
+                          formats=["gz", "xz"])["changed"]
+    (source / "openafs" / "NEWS").write_text("news\n")
+    git(str(source / "openafs"), "add", "NEWS")
+    git(str(source / "openafs"), "commit", "-q", "-m", "news")
+    results = run_module(source, monkeypatch, capsys)
+    assert results["changed"]
+    assert not results["cached"]
@@ -0,0 +1,240 @@
+import gzip
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+gip = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_get_install_paths")
+
+FIXTURES = os.path.join(str(mypath), "fixtures")
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule:
+    def __init__(self, outputs=None, **params):
+        self.params = dict(package_manager_type="rpm", cache=True)
+        self.params.update(params)
+        self.outputs = outputs or {}
+        self.commands = []
+
+    def get_bin_path(self, name, required=False):
+        return "/usr/bin/%s" % name
+
+    def run_command(self, args, **kwargs):
+        self.commands.append(args)
+        return 0, self.outputs.get(args[2], ""), ""
+
+    def fail_json(self, msg, **kwargs):
+        raise ModuleFailed(msg)
+
+
+def test_read_dirpath():
+    collector = gip.InstallationFactCollector(FakeModule())
+    dirs = collector.read_dirpath(os.path.join(FIXTURES, "afs", "dirpath.h"))
+    assert dirs == {
+        "afsbosconfigdir": "/etc/openafs",
+        "afsconfdir": "/etc/openafs/server",
+        "afsdbdir": "/var/lib/openafs/db",
+        "afslocaldir": "/var/lib/openafs/local",
+        "afslogsdir": "/var/log/openafs",
+        "afssrvbindir": "/usr/lib/openafs",
+        "viceetcdir": "/etc/openafs",
+    }
+
+
+def test_collect_dirs_man_page_fallback(tmp_path):
+    page = str(tmp_path / "cacheinfo.5.gz")
+    with gzip.open(page, "wb") as f:
+        f.write(b".SH DESCRIPTION\n"
+                b"The \\fIcacheinfo\\fR file must\n"
+                b"reside in the \\fB/etc/openafs\\fR directory\n"
+                b"on the client machine. \xff\n")
+    collector = gip.InstallationFactCollector(FakeModule())
+    dirs = collector.collect_dirs({"cacheinfo": page}, [])
+    assert dirs == {"viceetcdir": "/etc/openafs"}
+    with pytest.raises(ValueError):
+        collector.collect_dirs({"KeyFile": page}, [])
+
+    # The man pages are not searched when the header is installed.
+    dirpath = os.path.join(FIXTURES, "afs", "dirpath.h")
+    dirs = collector.collect_dirs({"KeyFile": page}, [dirpath])
+    assert dirs["afsconfdir"] == "/etc/openafs/server"
+
+
+def bump(path):
+    with open(path, "a") as f:
+        f.write("x")
+
+
+@pytest.mark.parametrize("pkg_mgr", ["rpm", "apt"])
+def test_cache(tmp_path, monkeypatch, pkg_mgr):
+    monkeypatch.setattr(gip, "CACHE", str(tmp_path / "facts" / "cache.json"))
+    monkeypatch.setattr(gip, "RPMDB_DIRS", (str(tmp_path / "rpm"),))
+    monkeypatch.setattr(gip, "DPKG_STATUS", str(tmp_path / "dpkg.status"))
+    monkeypatch.setattr(gip, "DPKG_INFO", str(tmp_path / "info"))
+    (tmp_path / "rpm").mkdir()
+    (tmp_path / "info").mkdir()
+    if pkg_mgr == "rpm":
+        db = str(tmp_path / "rpm" / "rpmdb.sqlite")
+    else:
+        db = gip.DPKG_STATUS
+    outputs = {
+        "--all": "openafs\n",
+        "--queryformat": "/usr/bin/pts\n",
+        "--show": "openafs-client install ok installed\n",
+        "--listfiles": "/.\n/usr/bin/pts\n",
+    }
+
+    def collect(**params):
+        module = FakeModule(outputs, package_manager_type=pkg_mgr, **params)
+        facts = gip.InstallationFactCollector(module).collect()
+        return facts, module.commands
+
+    # No package database; the facts are not cached.
+    facts, commands = collect()
+    assert not facts["cached"]
+    assert not os.path.exists(gip.CACHE)
+
+    bump(db)
+    facts, commands = collect()
+    assert not facts["cached"]
+    assert facts["paths"] == ["/usr/bin/pts"]
+    assert commands
+
+    # Hit; the package database is unchanged.
+    facts, commands = collect()
+    assert facts["cached"]
+    assert facts["paths"] == ["/usr/bin/pts"]
+    assert commands == []
+
+    # Miss; the package database changed.
+    bump(db)
+    facts, commands = collect()
+    assert not facts["cached"]
+    assert commands
+
+    facts, commands = collect(cache=False)
+    assert not facts["cached"]
+    assert commands
+
+
+def fixture_lines(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def test_rpm_paths():
+    module = FakeModule({"--queryformat": fixture_lines("rpm-filenames.txt")})
+    collector = gip.InstallationFactCollector(module)
+    paths = collector.collect_all_paths({"openafs-client", "openafs"})
+    assert module.commands == [[
+        "/usr/bin/rpm", "--query", "--queryformat", "[%{FILENAMES}\\n]",
+        "openafs", "openafs-client",
+    ]]
+    assert len(paths) == 17
+    assert "/usr/sbin/vos" in paths
+    assert not [p for p in paths if ".build-id" in p]
+
+    module.commands = []
+    assert collector.collect_all_paths(set()) == set()
+    assert module.commands == []
+
+
+def test_dpkg_paths(tmp_path, monkeypatch):
+    info = tmp_path / "info"
+    shutil.copytree(os.path.join(FIXTURES, "dpkg", "info"), str(info))
+    os.rename(str(info / "libafsauthent2.list"),
+              str(info / "libafsauthent2:amd64.list"))
+    monkeypatch.setattr(gip, "DPKG_INFO", str(info))
+    module = FakeModule({"--listfiles": fixture_lines("dpkg-listfiles.txt")},
+                        package_manager_type="apt")
+    collector = gip.InstallationFactCollector(module)
+    paths = collector.collect_all_paths(
+        {"openafs-client", "libafsauthent2", "openafs-fileserver",
+         "openafs-krb5"})
+
+    # The file lists not found in the dpkg database are listed with one
+    # dpkg-query.
+    assert module.commands == [[
+        "/usr/bin/dpkg-query", "--no-pager", "--listfiles",
+        "openafs-fileserver", "openafs-krb5",
+    ]]
+    assert "/." not in paths
+    assert "" not in paths
+    assert "/sbin/afsd" in paths
+    assert "/usr/lib/x86_64-linux-gnu/libafsauthent.so.2" in paths
+    assert "/usr/lib/openafs/fileserver" in paths
+    assert "/usr/bin/aklog" in paths
+    assert len(paths) == 22
+
+
+@pytest.mark.skipif(not os.path.isdir("/var/lib/dpkg/info"),
+                    reason="dpkg database not found")
+def test_dpkg_file_list_matches_dpkg_query():
+    dpkg_query = shutil.which("dpkg-query")
+    if not dpkg_query:
+        pytest.skip("dpkg-query not found")
+    lists = sorted(n for n in os.listdir("/var/lib/dpkg/info")
+                   if n.endswith(".list"))
+    packages = [n[:-len(".list")].split(":")[0] for n in lists[:10]]
+    collector = gip.InstallationFactCollector(
+        FakeModule(package_manager_type="apt"))
+    for package in packages:
+        out = subprocess.check_output(
+            [dpkg_query, "--no-pager", "--listfiles", package])
+        expected = collector.filter_paths(out.decode().splitlines())
+        lines = collector.read_file_list(package)
+        assert lines is not None
+        assert collector.filter_paths(lines) == expected
+
+
+def test_collect_bins(tmp_path):
+    def install(path, mode):
+        path = tmp_path / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+        path.chmod(mode)
+        return str(path)
+
+    programs = [
+        install("opt/openafs/sbin/vos", 0o755),
+        install("usr/vice/etc/afsd", 0o755),
+        install("usr/afs/bin/fileserver", 0o755),
+        install("usr/bin/pagsh.openafs", 0o755),
+    ]
+    others = [
+        install("usr/vice/etc/cacheinfo", 0o644),
+        install("usr/lib/libafsauthent.so.2", 0o755),
+        install("usr/share/openafs/afs.sh", 0o755),
+        install("usr/include/afs/dirpath.h", 0o644),
+    ]
+    missing = [str(tmp_path / "usr/bin/klog"), str(tmp_path / "gone/bos")]
+    paths = set(programs + others + missing + [str(tmp_path / "usr/bin")])
+
+    collector = gip.InstallationFactCollector(FakeModule())
+    bins = collector.collect_bins(paths)
+    assert bins == {
+        "vos": programs[0],
+        "afsd": programs[1],
+        "fileserver": programs[2],
+        "pagsh": programs[3],
+    }
+    # Only the existing files outside the data and library paths are
+    # examined.
+    assert collector.bins_examined == 6
@@ -0,0 +1,148 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+bdist = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_install_bdist")
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule:
+    def __init__(self, **params):
+        self.params = dict(manifest=True, staged=False)
+        self.params.update(params)
+
+    def fail_json(self, msg, **kwargs):
+        raise ModuleFailed(msg)
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_rollback_locally_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(bdist, "JOURNAL", str(tmp_path / "journal.json"))
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    write(str(src / "libafs.so.1"), "new library\n")
+    write(str(src / "vos"), "new version of vos\n")
+    write(str(dst / "libafs.so.1"), "old library, edited locally\n")
+    write(str(dst / "vos"), "old vos\n")
+
+    installer = object.__new__(bdist.BinaryDistInstaller)
+    installer.__init__(FakeModule())
+
+    # Fail the install after the library is renamed into place.
+    rename = os.rename
+
+    def failing_rename(a, b):
+        if b == str(dst / "vos") and not str(a).endswith(".orig"):
+            raise OSError("simulated failure")
+        rename(a, b)
+
+    monkeypatch.setattr(bdist.os, "rename", failing_rename)
+    with pytest.raises(ModuleFailed):
+        installer.install_staged([(str(src), str(dst))], [])
+
+    assert read(str(dst / "libafs.so.1")) == "old library, edited locally\n"
+    assert read(str(dst / "vos")) == "old vos\n"
+    assert sorted(os.listdir(str(dst))) == ["libafs.so.1", "vos"]
+    assert not os.path.exists(bdist.JOURNAL)
+
+
+def test_rerun_after_interrupted_install(tmp_path, monkeypatch):
+    monkeypatch.setattr(bdist, "JOURNAL", str(tmp_path / "journal.json"))
+    monkeypatch.setattr(bdist, "MANIFEST", str(tmp_path / "manifest.json"))
+    a = tmp_path / "a"
+    b = tmp_path / "b"
+    dst = tmp_path / "dst"
+    for tree, version in ((a, "a"), (b, "bb")):
+        tree.mkdir()
+        write(str(tree / "libafs.so.1"), "library %s\n" % version)
+        write(str(tree / "vos"), "vos version %s\n" % version)
+        write(str(tree / "pts"), "pts version %s\n" % version)
+    dst.mkdir()
+
+    def install(tree, **params):
+        installer = object.__new__(bdist.BinaryDistInstaller)
+        installer.__init__(FakeModule(**params))
+        files = installer.install_files(str(tree), [(str(tree), str(dst))],
+                                        [])
+        return installer, files
+
+    installer, files = install(a)
+    assert all(changed for fn, changed in files)
+    assert os.path.exists(bdist.MANIFEST)
+
+    # Interrupt the staged install of b after the library is in place.
+    rename = os.rename
+
+    def interrupted_rename(src, path):
+        if path == str(dst / "pts"):
+            raise KeyboardInterrupt()
+        rename(src, path)
+
+    monkeypatch.setattr(bdist.os, "rename", interrupted_rename)
+    with pytest.raises(KeyboardInterrupt):
+        install(b, staged=True)
+    monkeypatch.setattr(bdist.os, "rename", rename)
+    assert read(str(dst / "libafs.so.1")) == "library bb\n"
+    assert os.path.exists(bdist.JOURNAL)
+    assert not os.path.exists(bdist.MANIFEST)
+
+    # The rerun recovers the journal instead of trusting the manifest.
+    installer, files = install(a)
+    assert installer.changed
+    for name in ("libafs.so.1", "vos", "pts"):
+        assert read(str(dst / name)) == read(str(a / name))
+    assert sorted(os.listdir(str(dst))) == ["libafs.so.1", "pts", "vos"]
+    assert not os.path.exists(bdist.JOURNAL)
+    assert os.path.exists(bdist.MANIFEST)
+
+    # The next run is up to date with the manifest.
+    installer, files = install(a)
+    assert not installer.changed
+    assert not any(changed for fn, changed in files)
+
+
+def test_failed_install_removes_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(bdist, "JOURNAL", str(tmp_path / "journal.json"))
+    monkeypatch.setattr(bdist, "MANIFEST", str(tmp_path / "manifest.json"))
+    a = tmp_path / "a"
+    dst = tmp_path / "dst"
+    a.mkdir()
+    dst.mkdir()
+    write(str(a / "vos"), "vos\n")
+    write(bdist.MANIFEST, "{}")
+
+    def failing_copy_tree(src, dst, exclude):
+        raise OSError("simulated failure")
+
+    monkeypatch.setattr(bdist, "copy_tree", failing_copy_tree)
+    installer = object.__new__(bdist.BinaryDistInstaller)
+    installer.__init__(FakeModule())
+    with pytest.raises(OSError):
+        installer.install_files(str(a), [(str(a), str(dst))], [])
+    assert not os.path.exists(bdist.MANIFEST)
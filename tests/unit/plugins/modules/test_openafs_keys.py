@@ -0,0 +1,178 @@
+import json
+import os
+import pathlib
+import sys
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+keys = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_keys")
+common = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.module_utils."
+    "common")
+keyfile = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.module_utils."
+    "keyfile")
+basic = pytest.importorskip("ansible.module_utils.basic")
+
+# The keytab fixtures. conflict.keytab has a different kvno 3 aes256 key than
+# hole.keytab.
+KEYTABS = os.path.join(str(mypath.parent), "module_utils", "fixtures")
+
+# Fake asetkey with extended key support. The keys are listed in the state
+# file.
+ASETKEY = """#!/bin/sh
+echo "asetkey $*" >> {calls}
+case "$1" in
+"")
+    echo "usage: asetkey <subcommand> [args]" >&2
+    echo "    add <type> <kvno> <subtype> <keyfile> <princ>" >&2
+    exit 1
+    ;;
+list)
+    sort {state}
+    ;;
+add)
+    grep -q "^$2 kvno $3 enctype $4\\$" {state} || \\
+        echo "$2 kvno $3 enctype $4" >> {state}
+    ;;
+esac
+"""
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    paths = {
+        "calls": str(tmp_path / "calls"),
+        "state": str(tmp_path / "keys"),
+        "afsconfdir": str(tmp_path / "etc"),
+    }
+    os.mkdir(paths["afsconfdir"])
+    open(paths["state"], "w").close()
+    asetkey = str(tmp_path / "asetkey")
+    with open(asetkey, "w") as f:
+        f.write(ASETKEY.format(**paths))
+    os.chmod(asetkey, 0o755)
+    facts = {
+        "bins": {"asetkey": asetkey},
+        "dirs": {"afsconfdir": paths["afsconfdir"]},
+    }
+    factsdir = str(tmp_path / "facts")
+    monkeypatch.setattr(keys, "lookup_facts", lambda: facts)
+    monkeypatch.setattr(keys, "FactsStore",
+                        lambda: common.FactsStore(factsdir))
+    paths["facts"] = facts
+    paths["keyfile"] = os.path.join(paths["afsconfdir"], "KeyFileExt")
+    return paths
+
+
+def run_module(server, monkeypatch, capsys, **params):
+    args = {"ANSIBLE_MODULE_ARGS": params}
+    monkeypatch.setattr(basic, "_ANSIBLE_ARGS", json.dumps(args).encode())
+    if os.path.exists(server["calls"]):
+        os.remove(server["calls"])
+    with pytest.raises(SystemExit) as e:
+        keys.main()
+    results = json.loads(capsys.readouterr().out)
+    assert e.value.code == (1 if results.get("failed") else 0)
+    calls = []
+    if os.path.exists(server["calls"]):
+        with open(server["calls"]) as f:
+            calls = [line.split()[1:] for line in f]
+    return results, calls
+
+
+def test_keys_keyfile_adds_missing(server, monkeypatch, capsys):
+    kf = keyfile.KeyFileExt(server["keyfile"])
+    kf.add(keyfile.RXKAD_KRB5, 3, 18, b"a" * 32)
+    kf.write()
+    added = []
+    add = keyfile.KeyFileExt.add
+
+    def record_add(self, ktype, kvno, subtype, key):
+        added.append((ktype, kvno, subtype))
+        add(self, ktype, kvno, subtype, key)
+    monkeypatch.setattr(keyfile.KeyFileExt, "add", record_add)
+
+    keytab = os.path.join(KEYTABS, "hole.keytab")
+    results, calls = run_module(server, monkeypatch, capsys,
+                                keytab=keytab, cell="example.com")
+    assert results["changed"]
+    assert results["keyfile"] == server["keyfile"]
+    assert results["service_principal"] == "afs/example.com@EXAMPLE.COM"
+    assert results["imported"] == [
+        {"type": "rxkad_krb5", "kvno": "3", "eno": "17"},
+        {"type": "rxkad_krb5", "kvno": "3", "eno": "18"},
+    ]
+    assert calls == []
+    assert added == [(keyfile.RXKAD_KRB5, 3, 17)]
+    kf = keyfile.KeyFileExt(server["keyfile"])
+    assert kf.keys == {
+        (keyfile.RXKAD_KRB5, 3, 17): b"b" * 16,
+        (keyfile.RXKAD_KRB5, 3, 18): b"a" * 32,
+    }
+
+    del added[:]
+    results, calls = run_module(server, monkeypatch, capsys,
+                                keytab=keytab, cell="example.com")
+    assert not results["changed"]
+    assert added == []
+
+
+@pytest.mark.parametrize("direct", [True, False])
+def test_keys_keytabs(server, monkeypatch, capsys, direct):
+    if not direct:
+        del server["facts"]["dirs"]
+    results, calls = run_module(server, monkeypatch, capsys, keytabs=[
+        {"keytab": os.path.join(KEYTABS, "hole.keytab"),
+         "cell": "example.com"},
+        {"keytab": os.path.join(KEYTABS, "kvno.keytab"),
+         "cell": "example.com", "realm": "EXAMPLE.COM"},
+    ])
+    assert results["changed"]
+    assert results["have_extended_keys"]
+    assert results["service_principals"] == \
+        ["afs/example.com@EXAMPLE.COM"] * 2
+    assert "service_principal" not in results
+    assert len(results["keys"]) == 4
+    assert sorted((int(k["kvno"]), int(k["eno"]))
+                  for k in results["imported"]) == \
+        [(2, 18), (3, 17), (3, 18), (300, 18)]
+    if direct:
+        assert calls == [[]]  # The usage probe for the new key file.
+        assert len(keyfile.KeyFileExt(server["keyfile"]).keys) == 4
+    else:
+        assert not os.path.exists(server["keyfile"])
+        assert [c[:4] for c in calls if c[:1] == ["add"]] == [
+            ["add", "rxkad_krb5", "3", "18"],
+            ["add", "rxkad_krb5", "3", "17"],
+            ["add", "rxkad_krb5", "300", "18"],
+            ["add", "rxkad_krb5", "2", "18"],
+        ]
+
+
+@pytest.mark.parametrize("direct", [True, False])
+def test_keys_keytabs_conflict(server, monkeypatch, capsys, direct):
+    if not direct:
+        del server["facts"]["dirs"]
+    results, calls = run_module(server, monkeypatch, capsys, keytabs=[
+        {"keytab": os.path.join(KEYTABS, "hole.keytab"),
+         "cell": "example.com"},
+        {"keytab": os.path.join(KEYTABS, "conflict.keytab"),
+         "cell": "example.com"},
+    ])
+    assert results["failed"]
+    assert results["msg"] == "Conflicting keys for kvno 3 enctype 18."
+    assert not os.path.exists(server["keyfile"])
+    assert calls == []
+    with open(server["state"]) as f:
+        assert f.read() == ""
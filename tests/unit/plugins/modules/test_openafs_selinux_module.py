@@ -0,0 +1,149 @@
+import json
+import os
+import pathlib
+import sys
+
+import pytest
+
+# Import the module from the collections path, or from the directory
+# containing the ansible_collections directory of this collection.
+mypath = pathlib.Path(os.path.abspath(__file__)).parent
+for path in os.environ.get("ANSIBLE_COLLECTIONS_PATH", "").split(":"):
+    if path:
+        sys.path.insert(0, path)
+if len(mypath.parents) > 6:
+    sys.path.append(str(mypath.parents[6]))
+sm = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.modules."
+    "openafs_selinux_module")
+common = pytest.importorskip(
+    "ansible_collections.openafs_contrib.openafs.plugins.module_utils."
+    "common")
+basic = pytest.importorskip("ansible.module_utils.basic")
+
+# Fake SELinux tools. The installed modules are listed in the state file,
+# and each semodule transaction replaces the active module store.
+SEMODULE = """#!/bin/sh
+echo "semodule $*" >> {calls}
+case "$1" in
+-lstandard)
+    cat {state}
+    ;;
+-i)
+    cat "$2" > {state}
+    mkdir {store}.new && mv {store} {store}.old && mv {store}.new {store}
+    rm -rf {store}.old
+    ;;
+esac
+"""
+
+CHECKMODULE = """#!/bin/sh
+echo "checkmodule $*" >> {calls}
+sed -n 's/^module \\([^ ]*\\) \\([^ ;]*\\);/\\1 \\2/p' "$5" > "$4"
+"""
+
+SEMODULE_PACKAGE = """#!/bin/sh
+echo "semodule_package $*" >> {calls}
+cp "$4" "$2"
+"""
+
+
+@pytest.fixture
+def selinux(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    paths = {
+        "calls": str(tmp_path / "calls"),
+        "state": str(tmp_path / "installed"),
+        "store": str(tmp_path / "store" / "targeted" / "active"),
+    }
+    os.makedirs(paths["store"])
+    open(paths["state"], "w").close()
+    for name, script in (("semodule", SEMODULE),
+                         ("checkmodule", CHECKMODULE),
+                         ("semodule_package", SEMODULE_PACKAGE)):
+        with open(str(bindir / name), "w") as f:
+            f.write(script.format(**paths))
+        os.chmod(str(bindir / name), 0o755)
+    monkeypatch.setenv("PATH", "%s:%s" % (bindir, os.environ["PATH"]))
+
+    config = tmp_path / "config"
+    config.write_text("SELINUX=enforcing\nSELINUXTYPE=targeted\n")
+    monkeypatch.setattr(sm, "SELINUX_CONFIG", str(config))
+    monkeypatch.setattr(sm, "SELINUX_STORES",
+                        (str(tmp_path / "store" / "%s" / "active"),))
+    factsdir = str(tmp_path / "facts")
+    monkeypatch.setattr(sm, "FactsStore",
+                        lambda: common.FactsStore(factsdir))
+
+    inputs = tmp_path / "selinux"
+    inputs.mkdir()
+    (inputs / "openafs.fc").write_text("/usr/afs(/.*)? system_u\n")
+    paths["inputs"] = inputs
+    paths["facts"] = factsdir
+    return paths
+
+
+def write_te(selinux, version):
+    (selinux["inputs"] / "openafs.te").write_text(
+        "module openafs %s;\nrequire { type kernel_t; }\n" % version)
+
+
+def run_module(selinux, monkeypatch, capsys):
+    args = {"ANSIBLE_MODULE_ARGS": {"path": str(selinux["inputs"])}}
+    monkeypatch.setattr(basic, "_ANSIBLE_ARGS", json.dumps(args).encode())
+    if os.path.exists(selinux["calls"]):
+        os.remove(selinux["calls"])
+    with pytest.raises(SystemExit) as e:
+        sm.main()
+    assert e.value.code == 0
+    results = json.loads(capsys.readouterr().out)
+    calls = []
+    if os.path.exists(selinux["calls"]):
+        with open(selinux["calls"]) as f:
+            calls = [line.split()[:2] for line in f]
+    return results, calls
+
+
+def test_selinux_module(selinux, monkeypatch, capsys):
+    write_te(selinux, "1.0")
+    results, calls = run_module(selinux, monkeypatch, capsys)
+    assert results["changed"]
+    assert not results["cached"]
+    assert [c[0] for c in calls] == \
+        ["semodule", "checkmodule", "semodule_package", "semodule"]
+    cache = os.listdir(str(selinux["inputs"] / "cache"))
+    assert len(cache) == 1
+    assert cache[0].startswith("openafs-") and cache[0].endswith(".pp")
+
+    # Nothing changed; the semodule version check is skipped.
+    results, calls = run_module(selinux, monkeypatch, capsys)
+    assert not results["changed"]
+    assert calls == []
+
+    # The module was removed out of band; the cached pp is installed.
+    with open(selinux["state"], "w") as f:
+        f.write("")
+    os.rename(selinux["store"], selinux["store"] + ".old")
+    os.mkdir(selinux["store"])
+    results, calls = run_module(selinux, monkeypatch, capsys)
+    assert results["changed"]
+    assert results["cached"]
+    assert calls == [["semodule", "-lstandard"], ["semodule", "-i"]]
+    assert results["module"] == \
+        str(selinux["inputs"] / "cache" / cache[0])
+    with open(selinux["state"]) as f:
+        assert f.read() == "openafs 1.0\n"
+
+    # A new version is built, and replaces the cached pp.
+    write_te(selinux, "1.1")
+    results, calls = run_module(selinux, monkeypatch, capsys)
+    assert results["changed"]
+    assert not results["cached"]
+    assert results["version"] == "1.1"
+    assert [c[0] for c in calls] == \
+        ["semodule", "checkmodule", "semodule_package", "semodule"]
+    assert os.listdir(str(selinux["inputs"] / "cache")) != cache
+    assert len(os.listdir(str(selinux["inputs"] / "cache"))) == 1
+    facts = common.FactsStore(selinux["facts"]).load()
+    assert facts["selinux_modules"]["openafs"]["version"] == "1.1"